@@ -7,7 +7,8 @@ mongoDB collections.
 
 HPSSFiles: Is a collection of all files within those folders
 -> This is the true represetation on what is on tape.
-Every time the crawler runs, it updates the lastSeen field
+Every time the crawler runs, it stamps all seen files with the
+epoch of the crawl in the lastSeenEpoch field (see HPSSCrawlEpochs)
 
 unique index is: fileFullPath
 
@@ -16,10 +17,11 @@ fileType can be: tar, idx, picoDst, other
 This is a typical document:
 {'_id': ObjectId('5723e67af157a6a310232458'),
  'fileSize': '13538711552',
+ 'fileMTime': '2016-04-29 17:02',
  'fileType': 'tar',
  'filesInTar': 23,
  'fileFullPath': '/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/148.tar',
-  'lastSeen': '2016-04-29'}
+  'lastSeenEpoch': 42}
 
 HPSSPicoDsts: Is a collection of all picoDsts stored on HPSS,
 -> Every picoDst should show up only once. Duplicate entries are caught seperatly (see below)
@@ -47,6 +49,13 @@ This is a typical document:
 
 HPSSDuplicates: Collection of duplicted picoDsts on HPSS
 
+HPSSCrawlEpochs: Collection of crawls, every crawl has a monotonically
+increasing epoch as _id. Files not seen for K crawls are returned
+by sweepHpssFiles.
+
+This is a typical document:
+{'_id': 42, 'started': '2016-04-29', 'finished': '2016-04-29', 'incremental': True}
+
 """
 
 import sys
@@ -58,10 +67,17 @@ import time
 import socket
 import datetime
 import shlex, subprocess
+import threading
 
-from mongoUtil import mongoDbUtil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from mongoUtil import mongoDbUtil, bulkWriteBuffer, N_BULK_BATCH_SIZE
+from htarCache import htarCache
+from picoDstParser import getPathParser, DEFAULT_PATH_KEYS_SCHEMA
 import pymongo
 
+from pymongo import UpdateOne, UpdateMany
+
 from pymongo import results
 from pymongo import errors
 from pymongo import bulk
@@ -74,6 +90,17 @@ from pprint import pprint
 HPSS_BASE_FOLDER = "/nersc/projects/starofl"
 PICO_FOLDERS     = [ 'picodsts', 'picoDST' ]
 
+N_DUPLICATE_QUERY_CHUNK = 1000
+DUPLICATE_KEY_ERROR     = 11000
+
+N_SUBFOLDER_WORKERS = 4
+N_TAR_WORKERS       = 4
+
+N_DIRS_PER_HSI_CALL = 200
+FULL_CRAWL_WEEKDAY  = 6
+
+REBUILD_SUFFIX = '_rebuild'
+
 ##############################################
 
 # -- Check for a proper Python Version
@@ -86,87 +113,64 @@ class hpssUtil:
     """Helper Class for HPSS connections and retrieving stuff"""
 
     # _________________________________________________________
-    def __init__(self, target = 'picoDst', pathKeysSchema = 'runyear/system/energy/trigger/production/day%d/runnumber'):
+    def __init__(self, target = 'picoDst', pathKeysSchema = DEFAULT_PATH_KEYS_SCHEMA,
+                 bulkBatchSize = N_BULK_BATCH_SIZE, nTarWorkers = N_TAR_WORKERS):
         #    def __init__(self, target = 'picoDst', pathKeysSchema = 'runyear/system/energy/trigger/production/day%d/runnumber%d'):
         self._today = datetime.datetime.today().strftime('%Y-%m-%d')
 
-        self._target           = target
-        self._fileSuffix       = '.{0}.root'.format(target)
-        self._lengthFileSuffix = len(self._fileSuffix)
+        self._bulkBatchSize  = bulkBatchSize
+        self._pathKeysSchema = pathKeysSchema
+        self._nTarWorkers    = nTarWorkers
+        self._crawlEpoch     = None
 
-        if target == 'picoDst':
-            pathKeys = pathKeysSchema.split(os.path.sep)
+        self._summaryLock = threading.Lock()
+        self._insertLock  = threading.Lock()
+        self._resetSummary('')
 
-            # -- Get the type from each path key (tailing % char), or 's' for
-            #    string if absent.  i.e.
-            #    [['runyear', 's'], ['system', 's'], ['day', 'd'], ['runnumber', 'd']]
-            self._typedPathKeys = [k.split('%') if '%' in k else [k, 's'] for k in pathKeys]
-            self._typeMap = {'s': str, 'd': int, 'f': float}
+        self._tarCache = htarCache()
 
-    # _________________________________________________________
-    def _getTypedPathKeys(self, tokenizedPath):
-        """Get typed path keys for different scenarios."""
-
-        # -- Default case
-        if len(tokenizedPath) == 8:
-            return self._typedPathKeys
+        self._target     = target
+        self._fileSuffix = '.{0}.root'.format(target)
 
-        elif len(tokenizedPath) == 7:
-            pathKeysSchema = 'runyear/system/energy/trigger/production/day%d/runnumber'
+        # -- Compiled path parser of target
+        self._pathParser = getPathParser(target, pathKeysSchema)
 
-            # _________________________________________________________
-            def _getDateIndex(tokenizedPath):
-                """Get index of date field."""
+    # _________________________________________________________
+    def setCollections(self, collHpssFiles, collHpssPicoDsts, collHpssDuplicates, collHpssCheckpoints = None,
+                       collHpssDirFingerprints = None):
+        """Get collection from mongoDB.
 
-                for idx in range(len(tokenizedPath)):
-                    isDate = True
-                    try:
-                        date = int(tokenizedPath[idx])
-                        if date > 370:
-                            isDate = False
-                    except ValueError:
-                        isDate = False
+           Without collHpssCheckpoints, crawls are not checkpointed.
+           Without collHpssDirFingerprints, crawls are never incremental.
+           """
 
-                    if isDate:
-                        return idx
-                return -1
+        self._collHpssFiles           = collHpssFiles
+        self._collHpssPicoDsts        = collHpssPicoDsts
+        self._collHpssDuplicates      = collHpssDuplicates
+        self._collHpssCheckpoints     = collHpssCheckpoints
+        self._collHpssDirFingerprints = collHpssDirFingerprints
 
-            dateIdx = _getDateIndex(tokenizedPath)
+    # _________________________________________________________
+    def getFileList(self, crawlEpoch, nWorkers = 1, incremental = False):
+        """Loop over both folders containing picoDSTs on HPSS.
 
-            if dateIdx == 4 and "GeV" in tokenizedPath[2]:
-                # ORIG: pathKeysSchema = 'runyear/system/energy/trigger/production/day%d/runnumber'
-                pathKeysSchema = 'runyear/system/energy/trigger/day%d/runnumber'
+           All seen files are stamped with crawlEpoch.
 
-                pathKeys = pathKeysSchema.split(os.path.sep)
-                typedPathKeys = [k.split('%') if '%' in k else [k, 's'] for k in pathKeys]
-                return typedPathKeys
+           With nWorkers > 1, up to nWorkers subfolders are crawled
+           in parallel - each with its own hsi process and mongoDB connection.
 
-            else:
-                print("SCHEMA NOT KNOWN !!! - use Default", tokenizedPath)
-                return self._typedPathKeys
+           With incremental, unchanged leaf folders are not listed again.
 
-        else:
-            print("SCHEMA NOT KNOWN !!! - use Default", tokenizedPath)
-            return self._typedPathKeys
-
-    # _________________________________________________________
-    def setCollections(self, collHpssFiles, collHpssPicoDsts, collHpssDuplicates):
-        """Get collection from mongoDB."""
-
-        self._collHpssFiles      = collHpssFiles
-        self._collHpssPicoDsts   = collHpssPicoDsts
-        self._collHpssDuplicates = collHpssDuplicates
+           return True if all subfolders have been crawled successfully
+           """
 
-    # _________________________________________________________
-    def getFileList(self):
-        """Loop over both folders containing picoDSTs on HPSS."""
+        self._crawlEpoch = crawlEpoch
 
         for picoFolder in PICO_FOLDERS:
-            self._getFolderContent(picoFolder)
-            break
+            return self._getFolderContent(picoFolder, nWorkers, incremental)
 
     # _________________________________________________________
-    def _getFolderContent(self, picoFolder):
+    def _getFolderContent(self, picoFolder, nWorkers = 1, incremental = False):
         """Get listing of content of picoFolder."""
 
         # -- Get subfolders from HPSS
@@ -174,64 +178,484 @@ class hpssUtil:
         cmd = shlex.split(cmdLine)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
+        listSubFolders = [subFolder.decode("utf-8").rstrip() for subFolder in iter(p.stdout.readline, b'')
+                          if "Run" in subFolder.decode("utf-8").rstrip()]
+
         # -- Loop of the list of subfolders
-        for subFolder in iter(p.stdout.readline, b''):
-            if "Run" in subFolder.decode("utf-8").rstrip():
-                print("SubFolder: ", subFolder.decode("utf-8").rstrip())
-                self._parseSubFolder(subFolder.decode("utf-8").rstrip())
+        listSummaries = []
+        if nWorkers <= 1:
+            for subFolder in listSubFolders:
+                print("SubFolder: ", subFolder)
+                try:
+                    self._parseSubFolder(subFolder, incremental)
+                    listSummaries.append(self._summary)
+                except Exception as e:
+                    print("Error crawling subFolder:", subFolder, e)
+                    listSummaries.append({'subFolder': subFolder, 'failed': True})
+
+        # -- Crawl subfolders in worker pool
+        else:
+            with ProcessPoolExecutor(max_workers=nWorkers) as executor:
+                futures = {}
+                for subFolder in listSubFolders:
+                    print("SubFolder: ", subFolder)
+                    futures[executor.submit(crawlSubFolder, subFolder, self._target, self._pathKeysSchema,
+                                            self._bulkBatchSize, self._nTarWorkers, incremental,
+                                            self._crawlEpoch)] = subFolder
+
+                for future in as_completed(futures):
+                    try:
+                        listSummaries.append(future.result())
+                    except Exception as e:
+                        print("Error crawling subFolder:", futures[future], e)
+                        listSummaries.append({'subFolder': futures[future], 'failed': True})
+
+        self._printSummary(listSummaries)
+
+        return not any(summary['failed'] for summary in listSummaries)
+
+    # _________________________________________________________
+    def _resetSummary(self, subFolder):
+        """Reset summary of crawled subFolder."""
+
+        self._summary = {'subFolder': subFolder, 'failed': False, 'time': time.time(),
+                         'nFiles': 0, 'nNewFiles': 0, 'nNewPicoDsts': 0, 'nDuplicates': 0, 'nSkippedDirs': 0,
+                         'nFailedTars': 0}
+
+    # _________________________________________________________
+    def getSummary(self):
+        """Get summary of last crawled subFolder."""
+
+        return self._summary
 
     # _________________________________________________________
-    def _parseSubFolder(self, subFolder):
-        """Get recursive list of folders and files in subFolder ... as "ls" output."""
+    def _printSummary(self, listSummaries):
+        """Print consolidated summary of crawled subFolders."""
+
+        total = dict.fromkeys(['nFiles', 'nNewFiles', 'nNewPicoDsts', 'nDuplicates', 'nSkippedDirs', 'nFailedTars'], 0)
+
+        print('\n==---------------------------------------------------------==')
+        print('Crawler Summary')
+        print('==---------------------------------------------------------==')
+
+        for summary in sorted(listSummaries, key=lambda item: item['subFolder']):
+            if summary['failed']:
+                print('  ', summary['subFolder'], '-> FAILED')
+                continue
+
+            print('  ', summary['subFolder'], '->', ', '.join('{0}: {1}'.format(key, summary[key]) for key in total),
+                  '({0:.0f} s)'.format(summary['time']))
+            for key in total:
+                total[key] += summary[key]
+
+        print('   Total ->', ', '.join('{0}: {1}'.format(key, value) for key, value in total.items()))
+
+    # _________________________________________________________
+    def _parseSubFolder(self, subFolder, incremental = False):
+        """Get recursive list of folders and files in subFolder ... as "ls" output.
+
+           With incremental, subFolder is crawled level by level (see _crawlIncremental),
+           otherwise in one "ls -lR".
+
+           If hsi fails, the summary is marked as failed and the checkpoint
+           is kept. Failed htar listings of tar files are only counted.
+           """
+
+        self._resetSummary(subFolder)
+
+        # -- Pool of htar listings - filled while ls output is parsed
+        self._tarExecutor = ThreadPoolExecutor(max_workers=self._nTarWorkers)
+        self._tarFutures  = {}
+
+        # -- Get blocks done by an unfinished previous crawl and
+        #    resubmit tar files of it, which have not been listed
+        self._subFolder     = subFolder
+        self._pendingBlocks = []
+        doneBlocks = self._getCheckpoint(subFolder)
+
+        for doc in self._collHpssFiles.find({'fileFullPath': {'$regex': '^' + re.escape(subFolder + '/')},
+                                             'fileType': 'tar', 'filesInTar': {'$exists': False}}):
+            self._tarFutures[self._tarExecutor.submit(self._processTarFile, doc, True)] = doc['fileFullPath']
+
+        # -- Buffered upserts of HPSSFiles - new files are processed on flush
+        self._listPicoDsts = []
+        writer = bulkWriteBuffer(self._collHpssFiles, self._bulkBatchSize, self._onFlush)
+
+        isSuccessful = True
+
+        try:
+            if incremental and self._collHpssDirFingerprints is not None:
+                self._crawlIncremental(subFolder, writer, doneBlocks)
+            else:
+                self._crawlFull(subFolder, writer, doneBlocks)
+
+        # -- Listing cut short - HPSS down, authentication, timeout
+        #    Files not listed keep their old lastSeenEpoch
+        except RuntimeError as e:
+            print("Error listing subFolder:", subFolder, "-", e)
+            isSuccessful = False
+
+        # -- Wait for outstanding htar listings - failed tar files are only reported,
+        #    they have no filesInTar and are listed again by the next crawl
+        finally:
+            self._summary['nFailedTars'] = self._waitForTarFiles()
+
+        # -- Crawl of subFolder finished - a failed one is resumed
+        #    from its checkpoint and its crawl epoch is not finished
+        if isSuccessful:
+            self._clearCheckpoint(subFolder)
+        else:
+            self._summary['failed'] = True
+
+        self._summary['time'] = time.time() - self._summary['time']
+
+    # _________________________________________________________
+    def _crawlFull(self, subFolder, writer, doneBlocks):
+        """Crawl subFolder in one "ls -lR" and refresh fingerprints of all folders.
+
+           Raises RuntimeError if hsi fails - fingerprints are not refreshed.
+           """
 
         cmdLine = 'hsi -q ls -lR {0}'.format(subFolder)
         cmd = shlex.split(cmdLine)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
+        listBlocks = {} if self._collHpssDirFingerprints is not None else None
+        self._parseListing(p.stdout, subFolder, writer, doneBlocks, listBlocks)
+        p.wait()
+
+        # -- Flush remaining upserts
+        writer.flush()
+        self._commitCheckpoint()
+
+        if p.returncode != 0:
+            raise RuntimeError('hsi failed with exit code {0}'.format(p.returncode))
+
+        # -- Refresh fingerprints of all folders
+        if listBlocks is not None:
+            dirMeta = dict(item for block in listBlocks.values() for item in block['subDirs'].items())
+
+            fingerprintWriter = bulkWriteBuffer(self._collHpssDirFingerprints, self._bulkBatchSize)
+            for dirPath, block in listBlocks.items():
+                self._addFingerprint(fingerprintWriter, dirPath, dirMeta.get(dirPath), block)
+            fingerprintWriter.flush()
+
+    # _________________________________________________________
+    def _parseListing(self, stream, subFolder, writer, doneBlocks, listBlocks = None):
+        """Parse "ls -l" output of folders in subFolder and write files to writer.
+
+           If listBlocks is given, it is filled for every listed folder with
+           number of files, their total bytes and subfolders with (mtime, size).
+           """
+
         # -- Parse ls output line-by-line -> utilizing output blocks in ls
         inBlock = 0
-        listPicoDsts = []
-        for lineTerminated in iter(p.stdout.readline, b''):
+        skipBlock = False
+        blockFiles = []
+        for lineTerminated in iter(stream.readline, b''):
             line = lineTerminated.decode("utf-8").rstrip('\t\n')
             lineCleaned = ' '.join(line.split())
 
             if lineCleaned.startswith(subFolder):
                 inBlock = 1
                 self._currentBlockPath = line.rstrip(':')
+                skipBlock = self._currentBlockPath in doneBlocks
+
+                if listBlocks is not None:
+                    block = listBlocks.setdefault(self._currentBlockPath,
+                                                  {'nEntries': 0, 'totalBytes': 0, 'subDirs': {}})
             else:
                 if not lineCleaned:
+                    if inBlock and not skipBlock:
+                        self._closeBlock(writer, blockFiles)
+                    blockFiles = []
                     inBlock = 0
                     self._currentBlockPath = ""
                 else:
-                    if inBlock and not lineCleaned.startswith('d'):
-                        doc = self._parseLine(lineCleaned)
+                    if not inBlock:
+                        continue
+
+                    # -- sub folder - only needed for fingerprints
+                    if lineCleaned.startswith('d'):
+                        if listBlocks is not None:
+                            lineTokenized = lineCleaned.split(' ', 9)
+                            dirPath = "{0}/{1}".format(self._currentBlockPath, lineTokenized[8])
+                            block['subDirs'][dirPath] = (normalizeMTime(*lineTokenized[5:8]), int(lineTokenized[4]))
+                        continue
+
+                    doc = self._parseLine(lineCleaned)
+
+                    if listBlocks is not None:
+                        block['nEntries']   += 1
+                        block['totalBytes'] += doc['fileSize']
+
+                    if skipBlock:
+                        continue
+
+                    # -- insert if not in yet - lastSeenEpoch is stamped per block
+                    docOnInsert = {key: value for key, value in doc.items() if key != 'fileMTime'}
+                    docOnInsert['lastSeenEpoch'] = self._crawlEpoch
+
+                    writer.add(UpdateOne({'fileFullPath': doc['fileFullPath']},
+                                         {'$set': {'fileMTime': doc['fileMTime']},
+                                          '$setOnInsert' : docOnInsert},
+                                         upsert = True), doc)
+                    blockFiles.append(doc['fileFullPath'])
+                    self._summary['nFiles'] += 1
+
+        # -- Last block without tailing empty line
+        if inBlock and not skipBlock:
+            self._closeBlock(writer, blockFiles)
+
+    # _________________________________________________________
+    def _closeBlock(self, writer, blockFiles):
+        """Stamp files of current block with crawl epoch and mark block as pending."""
+
+        if blockFiles:
+            writer.add(UpdateMany({'fileFullPath': {'$in': blockFiles}},
+                                  {'$set': {'lastSeenEpoch': self._crawlEpoch}}))
+
+        self._pendingBlocks.append(self._currentBlockPath)
+
+    # _________________________________________________________
+    def _crawlIncremental(self, subFolder, writer, doneBlocks):
+        """Crawl subFolder level by level and skip unchanged leaf folders.
+
+           Every folder has a fingerprint: mtime and size of its entry in the
+           parent folder, number of files, their total bytes and number of
+           subfolders. Leaf folders with unchanged mtime and size are not
+           listed - all their known files are stamped with the crawl epoch.
+
+           Folders with subfolders are always listed, as changes further down
+           do not show up in their mtime. Files rewritten in place are only
+           caught by a full crawl.
+
+           Raises RuntimeError if hsi fails - fingerprints of the failed
+           chunk of folders are not refreshed.
+           """
+
+        fingerprints = dict((doc['dirPath'], doc) for doc in
+                            self._collHpssDirFingerprints.find({'dirPath': {'$regex': '^' + re.escape(subFolder + '/')}},
+                                                               {'_id': False}))
+
+        epochWriter       = bulkWriteBuffer(self._collHpssFiles, self._bulkBatchSize)
+        fingerprintWriter = bulkWriteBuffer(self._collHpssDirFingerprints, self._bulkBatchSize)
+
+        dirMeta  = {subFolder: None}
+        listDirs = [subFolder]
+
+        try:
+            while listDirs:
+                listNextDirs = []
+
+                # -- List all folders of this level in chunks - one hsi call per chunk
+                for idx in range(0, len(listDirs), N_DIRS_PER_HSI_CALL):
+                    listChunk = listDirs[idx:idx+N_DIRS_PER_HSI_CALL]
+
+                    cmdLine = '; '.join('ls -l "{0}"'.format(dirPath) for dirPath in listChunk)
+                    p = subprocess.Popen(['hsi', '-q', cmdLine], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+                    listBlocks = {}
+                    self._parseListing(p.stdout, subFolder, writer, doneBlocks, listBlocks)
+                    p.wait()
+
+                    if p.returncode != 0:
+                        raise RuntimeError('hsi failed with exit code {0}'.format(p.returncode))
+
+                    # -- Every listing has to start with a "dir:" header
+                    listMissing = [dirPath for dirPath in listChunk if dirPath not in listBlocks]
+                    if listMissing:
+                        raise RuntimeError('No listing header for {0} folders in hsi output, e.g. {1}'.format(len(listMissing),
+                                                                                                         listMissing[0]))
+
+                    # -- Files have to be written, before fingerprint is updated
+                    writer.flush()
+                    self._commitCheckpoint()
+
+                    for dirPath, block in listBlocks.items():
+                        self._addFingerprint(fingerprintWriter, dirPath, dirMeta.pop(dirPath, None), block)
+
+                        for subDirPath, meta in block['subDirs'].items():
+                            fingerprint = fingerprints.get(subDirPath)
+
+                            # -- unchanged leaf folder - only stamp crawl epoch
+                            if fingerprint and fingerprint['nSubDirs'] == 0 and \
+                                    fingerprint['dirSize'] == meta[1] and isSameMTime(fingerprint['mTime'], meta[0]):
+                                epochWriter.add(UpdateMany({'fileFullPath': {'$regex': '^' + re.escape(subDirPath + '/')}},
+                                                           {'$set': {'lastSeenEpoch': self._crawlEpoch}}))
+                                fingerprintWriter.add(UpdateOne({'dirPath': subDirPath}, {'$set': {'lastSeen': self._today}}))
+                                self._summary['nSkippedDirs'] += 1
+                                continue
 
-                        # -- update lastSeen and insert if not in yet
-                        ret = self._collHpssFiles.find_one_and_update({'fileFullPath': doc['fileFullPath']},
-                                                                      {'$set': {'lastSeen': self._today},
-                                                                       '$setOnInsert' : doc},
-                                                                       upsert = True)
+                            dirMeta[subDirPath] = meta
+                            listNextDirs.append(subDirPath)
 
-                        # -- document already there do nothing
-                        if ret:
-                            continue
+                listDirs = listNextDirs
 
-                        # -- new document inserted - add the picoDst(s)
-                        if doc['fileType'] == "tar":
-                            nDocsInTar = self._parseTarFile(doc)
-                            self._collHpssFiles.find_one_and_update({'fileFullPath': doc['fileFullPath']},
-                                                                    {'$set': {'filesInTar': nDocsInTar}})
-                            continue
+        # -- Stamps and fingerprints of folders done are kept
+        finally:
+            epochWriter.flush()
+            fingerprintWriter.flush()
 
-                        if doc['fileType'] == "picoDst":
-                            listPicoDsts.append(self._makePicoDstDoc(doc['fileFullPath'], doc['fileSize']))
+    # _________________________________________________________
+    def _addFingerprint(self, fingerprintWriter, dirPath, meta, block):
+        """Add update of fingerprint of listed folder to fingerprintWriter."""
+
+        mTime, dirSize = meta if meta else (None, None)
+
+        fingerprintWriter.add(UpdateOne({'dirPath': dirPath},
+                                        {'$set': {'mTime': mTime, 'dirSize': dirSize,
+                                                  'nEntries': block['nEntries'],
+                                                  'totalBytes': block['totalBytes'],
+                                                  'nSubDirs': len(block['subDirs']),
+                                                  'lastSeen': self._today}},
+                                        upsert = True))
+
+    # _________________________________________________________
+    def _getCheckpoint(self, subFolder):
+        """Get set of blocks already done in an unfinished crawl of subFolder."""
 
-                            if len(listPicoDsts) >= 10000:
-                                self._insertPicoDsts(listPicoDsts)
-                                listPicoDsts[:] = []
+        if self._collHpssCheckpoints is None:
+            return set()
+
+        doneBlocks = set(entry['blockPath'] for entry in
+                         self._collHpssCheckpoints.find({'subFolder': subFolder}, {'blockPath': True, '_id': False}))
+        if doneBlocks:
+            print("Resume crawl of {0}: skip {1} blocks already done".format(subFolder, len(doneBlocks)))
+
+        return doneBlocks
+
+    # _________________________________________________________
+    def _onFlush(self, result, listDocs):
+        """Process result of bulk write and checkpoint the crawl."""
+
+        self._processNewFiles(result, listDocs)
+        self._commitCheckpoint()
+
+    # _________________________________________________________
+    def _commitCheckpoint(self):
+        """Insert buffered picoDsts and mark finished blocks as done.
+
+           A block is only marked as done, once all of its files have
+           been written. Tar files are resubmitted on a restart, if not
+           yet listed.
+           """
 
         # -- Insert picoDsts in collection
-        self._insertPicoDsts(listPicoDsts)
+        self._insertPicoDsts(self._listPicoDsts)
+        self._listPicoDsts = []
+
+        if self._collHpssCheckpoints is not None and self._pendingBlocks:
+            self._collHpssCheckpoints.insert_many([{'subFolder': self._subFolder, 'blockPath': blockPath}
+                                                   for blockPath in self._pendingBlocks], ordered=False)
+        self._pendingBlocks = []
+
+    # _________________________________________________________
+    def _clearCheckpoint(self, subFolder):
+        """Remove checkpoint of finished crawl of subFolder."""
+
+        if self._collHpssCheckpoints is None:
+            return
+
+        self._collHpssCheckpoints.delete_many({'subFolder': subFolder})
+
+    # _________________________________________________________
+    def _processNewFiles(self, result, listDocs):
+        """Process files newly inserted in HPSSFiles by a bulk write.
+
+           Documents already there are only updated - new documents
+           are identified by the upserted_ids of the bulk write result.
+           """
+
+        self._summary['nNewFiles'] += len(result.upserted_ids)
+
+        listNewPicoDsts = []
+        for idx in sorted(result.upserted_ids):
+            doc = listDocs[idx]
+
+            # -- new document inserted - add the picoDst(s)
+            if doc['fileType'] == "tar":
+                self._tarFutures[self._tarExecutor.submit(self._processTarFile, doc)] = doc['fileFullPath']
+                continue
+
+            if doc['fileType'] == "picoDst":
+                listNewPicoDsts.append((doc['fileFullPath'], doc['fileSize']))
+
+        self._listPicoDsts.extend(self._makePicoDstDocs(listNewPicoDsts))
+
+        if len(self._listPicoDsts) >= 10000:
+            self._insertPicoDsts(self._listPicoDsts)
+            self._listPicoDsts = []
+
+    # _________________________________________________________
+    def _processTarFile(self, hpssDoc, isRequeued=False):
+        """Add content of new tar file and update filesInTar - run in tar pool.
+
+           isRequeued: tar file of an unfinished previous crawl, listed again
+           """
+
+        nDocsInTar = self._parseTarFile(hpssDoc, isRequeued)
+        self._collHpssFiles.find_one_and_update({'fileFullPath': hpssDoc['fileFullPath']},
+                                                {'$set': {'filesInTar': nDocsInTar}})
+
+    # _________________________________________________________
+    def _waitForTarFiles(self):
+        """Wait for all htar listings of the tar pool to finish.
+
+           return number of failed tar files
+           """
+
+        nFailed = 0
+
+        for future in as_completed(self._tarFutures):
+            try:
+                future.result()
+            except Exception as e:
+                print("Error processing tar file:", self._tarFutures[future], e)
+                nFailed += 1
+
+        self._tarExecutor.shutdown()
+        self._tarFutures = {}
+
+        return nFailed
+
+    # _________________________________________________________
+    def rebuildPicoDsts(self):
+        """Rebuild picoDst collections from HPSSFiles collection.
+
+           Listings of tar files are taken from the htar cache,
+           only tar files not in the cache are listed with htar.
+
+           The picoDst collections set have to be empty.
+
+           return True if all tar files have been listed
+           """
+
+        self._resetSummary('rebuild')
+
+        self._tarExecutor = ThreadPoolExecutor(max_workers=self._nTarWorkers)
+        self._tarFutures  = {}
+
+        listFiles = []
+        for doc in self._collHpssFiles.find({'fileType': {'$in': ['tar', 'picoDst']}}):
+            if doc['fileType'] == "tar":
+                self._tarFutures[self._tarExecutor.submit(self._processTarFile, doc)] = doc['fileFullPath']
+                continue
+
+            listFiles.append((doc['fileFullPath'], doc['fileSize']))
+
+            if len(listFiles) >= 10000:
+                self._insertPicoDsts(self._makePicoDstDocs(listFiles))
+                listFiles = []
+
+        self._insertPicoDsts(self._makePicoDstDocs(listFiles))
+
+        nFailed = self._waitForTarFiles()
+
+        self._summary['time'] = time.time() - self._summary['time']
+        self._printSummary([self._summary])
+
+        return nFailed == 0
 
     # _________________________________________________________
     def _parseLine(self, line):
@@ -245,6 +669,7 @@ class hpssUtil:
         fileName     = lineTokenized[8]
         fileFullPath = "{0}/{1}".format(self._currentBlockPath, fileName)
         fileSize     = int(lineTokenized[4])
+        fileMTime    = normalizeMTime(*lineTokenized[5:8])
         fileType     = "other"
 
         if fileName.endswith(".tar"):
@@ -255,27 +680,67 @@ class hpssUtil:
             fileType = "picoDst"
 
         # -- return record
-        return { 'fileFullPath': fileFullPath, 'fileSize': fileSize, 'fileType': fileType}
+        return { 'fileFullPath': fileFullPath, 'fileSize': fileSize, 'fileMTime': fileMTime, 'fileType': fileType}
 
     # _________________________________________________________
-    def _parseTarFile(self, hpssDoc):
+    def _parseTarFile(self, hpssDoc, isRequeued=False):
         """Get Content of tar file and parse it.
 
            return a number of documents in Tar file
            """
 
+        listMembers = self._listTarFile(hpssDoc)
+        if listMembers is None:
+            return
+
+        # -- select only target
+        listMembers = [member for member in listMembers if member[0].endswith(self._fileSuffix)]
+
+        # -- make PicoDst documents of all members
+        listDocs = self._makePicoDstDocs(listMembers, hpssDoc=hpssDoc, isInTarFile=True)
+
+        nDocsInTar = len(listDocs)
+
+        # -- Insert picoDsts in collection
+        self._insertPicoDsts(listDocs, isRequeued)
+
+        return nDocsInTar
+
+    # _________________________________________________________
+    def _listTarFile(self, hpssDoc):
+        """Get listing of tar file - from htar cache or via htar -tf.
+
+           Only successful listings are cached. A failed htar raises, the
+           tar file is listed again by the next crawl.
+
+           return list of [fileFullPath, fileSize] of all members, or
+           None if tar file has no index file
+           """
+
+        # -- Check cache first - tar files without mtime are not cached
+        #    Only the date is used, the time is not shown for older files
+        tarMTime = hpssDoc.get('fileMTime', '')[:len('YYYY-MM-DD')]
+        if tarMTime:
+            listMembers = self._tarCache.get(hpssDoc['fileFullPath'], hpssDoc['fileSize'], tarMTime)
+            if listMembers is not None:
+                return listMembers
+
         cmdLine = 'htar -tf {0}'.format(hpssDoc['fileFullPath'])
         cmd = shlex.split(cmdLine)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
-        listDocs = []
+        listMembers  = []
+        isSuccessful = False
 
         for lineTerminated in iter(p.stdout.readline, b''):
             line = lineTerminated.decode("utf-8").rstrip('\t\n')
             lineCleaned = ' '.join(line.split())
 
-            if lineCleaned == "HTAR: HTAR SUCCESSFUL" or \
-                    lineCleaned.startswith('HTAR: d'):
+            if lineCleaned == "HTAR: HTAR SUCCESSFUL":
+                isSuccessful = True
+                continue
+
+            if lineCleaned.startswith('HTAR: d'):
                 continue
 
             if 'ERROR: No such file: {0}.idx'.format(hpssDoc['fileFullPath']) == lineCleaned :
@@ -297,83 +762,62 @@ class hpssUtil:
                     print("Error tokenizing hTar line:", lineTokenized)
                     continue
 
-            fileFullPath  = lineTokenized[6]
-            fileSize      = int(lineTokenized[3])
+            listMembers.append([lineTokenized[6], int(lineTokenized[3])])
 
-            # -- select only target
-            if not fileFullPath.endswith(self._fileSuffix):
-                continue
-
-            # -- make PicoDst document and add it to list
-            listDocs.append(self._makePicoDstDoc(fileFullPath, fileSize, hpssDoc=hpssDoc, isInTarFile=True))
+        # -- Failed listing - HPSS down, authentication, timeout
+        p.wait()
+        if p.returncode != 0 or not isSuccessful:
+            raise RuntimeError('htar -tf failed with exit code {0}{1}'.format(p.returncode,
+                               '' if isSuccessful else ', no "HTAR SUCCESSFUL"'))
 
-        nDocsInTar = len(listDocs)
+        # -- Add listing to cache
+        if tarMTime:
+            self._tarCache.put(hpssDoc['fileFullPath'], hpssDoc['fileSize'], tarMTime, listMembers)
 
-        # -- Insert picoDsts in collection
-        self._insertPicoDsts(listDocs)
-
-        return nDocsInTar
+        return listMembers
 
     # _________________________________________________________
-    def _makePicoDstDoc(self, fileFullPath, fileSize, hpssDoc=None, isInTarFile=False):
-        """Create entry for picoDsts."""
-
-        # -- identify start of "STAR naming conventions"
-        idxBasePath = fileFullPath.find("/Run")+1
-
-        # -- Create document
-        doc = {
-               'filePath':     fileFullPath[idxBasePath:],
-               'fileFullPath': fileFullPath,
-               'fileSize':     fileSize,
-               'target':       self._target,
-               'isInTarFile':  isInTarFile,
-               'staging':      {'stageMarkerXRD': False},
-            }
+    def _makePicoDstDocs(self, listFiles, hpssDoc=None, isInTarFile=False):
+        """Create entries for list of picoDsts - list of (fileFullPath, fileSize).
 
-        if isInTarFile:
-            doc['fileFullPathTar'] = hpssDoc['fileFullPath']
-
-        # -- Strip basePath of fileName and tokenize it
-        cleanPathTokenized = doc['filePath'].split(os.path.sep)
-
-        # -- Get TypedKeys for tokenized path
-        typedPathKeys = self._getTypedPathKeys(cleanPathTokenized)
+           All paths are parsed in one batch, folders are parsed only once.
+           """
 
-        # -- Create STAR details sub document
-        docStarDetails = dict([(keys[0], self._typeMap[keys[1]](value))
-                               for keys, value in zip(typedPathKeys, cleanPathTokenized)])
+        # -- Get paths starting with "STAR naming conventions" and STAR details
+        columns = self._pathParser.parseBatch(fileFullPath for fileFullPath, fileSize in listFiles)
 
-        # -- Create a regex pattern to get the stream from the fileName
-        regexStream = re.compile('(st_.*)_{}'.format(docStarDetails.get('runnumber', '')))
+        listDocs = []
+        for idx, (fileFullPath, fileSize) in enumerate(listFiles):
 
-        fileNameParts = re.split(regexStream, cleanPathTokenized[-1])
-        if len(fileNameParts) == 3 and len(fileNameParts[0]) == 0:
-            docStarDetails['stream'] = fileNameParts[1]
+            # -- Create document
+            doc = {
+                   'filePath':     columns.filePath[idx],
+                   'fileFullPath': fileFullPath,
+                   'fileSize':     fileSize,
+                   'target':       self._target,
+                   'isInTarFile':  isInTarFile,
+                   'staging':      {'stageMarkerXRD': False},
+                }
 
-            strippedSuffix = fileNameParts[-1][1:-self._lengthFileSuffix]
-            strippedSuffixParts = strippedSuffix.split('_')
+            if isInTarFile:
+                doc['fileFullPathTar'] = hpssDoc['fileFullPath']
 
-            docStarDetails['picoType'] = strippedSuffixParts[0] \
-                if len(strippedSuffixParts) == 2 \
-                else strippedSuffix
-        else:
-            print('xxx: ', fileNameParts, docStarDetails)
-            docStarDetails['stream'] = 'xx'
-            docStarDetails['picoType'] = 'xx'
+            # -- Add STAR details to document
+            doc['starDetails'] = columns.starDetails(idx)
 
-        # -- Add STAR details to document
-        doc['starDetails'] = docStarDetails
+            listDocs.append(doc)
 
-        # -- return picoDst document
-        return doc
+        # -- return picoDst documents
+        return listDocs
 
     # _________________________________________________________
-    def _insertPicoDsts(self, listDocs):
+    def _insertPicoDsts(self, listDocs, isRequeued=False):
         """Insert list of picoDsts in to collections.
 
         In HPSSPicoDst collection and
         in to HPSSDuplicates collection if a duplicate
+
+        isRequeued: members of a requeued tar file - see _splitDuplicates
         """
 
         # -- Empty list
@@ -382,25 +826,235 @@ class hpssUtil:
 
 #        print("Insert List: Try to add {0} picoDsts".format(len(listDocs)))
 
-        # -- Clean listDocs with duplicate entries and move them on extra list: listDuplicates
-        listDuplicates = []
+        # -- Split and insert as one step - tar pool and main thread insert concurrently
+        with self._insertLock:
+
+            # -- Split listDocs in new entries and duplicate entries: listDuplicates
+            listDocs, listDuplicates = self._splitDuplicates(listDocs, isRequeued)
+
+            # -- Insert list of picoDsts in to HpssPicoDsts collection
+            if listDocs:
+                listDocs, listInsertedMeanwhile = self._insertNewPicoDsts(listDocs)
+                listDuplicates.extend(listInsertedMeanwhile)
+
+                print("Insert List: Add {0} picoDsts".format(len(listDocs)))
+                with self._summaryLock:
+                    self._summary['nNewPicoDsts'] += len(listDocs)
+
+            # -- Insert list of duplicate picoDsts in to HpssDuplicates collection
+            if listDuplicates:
+                print("Insert List: Add {0} duplicate picoDsts".format(len(listDuplicates)))
+                with self._summaryLock:
+                    self._summary['nDuplicates'] += len(listDuplicates)
+                self._collHpssDuplicates.insert_many(listDuplicates, ordered=False)
+
+    # _________________________________________________________
+    def _insertNewPicoDsts(self, listDocs):
+        """Insert new picoDsts in HPSSPicoDst collection.
+
+           Documents inserted meanwhile by another crawler process fail
+           on the unique filePath index - they are duplicates.
 
-        for entry in self._collHpssPicoDsts.find({'starDetails.runyear': listDocs[0]['starDetails']['runyear']}, {'filePath': True, '_id': False}):
-            element = next((item for item in listDocs if item['filePath'] == entry['filePath']), None)
-            if element:
-                listDuplicates.append(element)
-                listDocs.remove(element)
+           return list of inserted documents and list of duplicates
+           """
 
-        # -- Insert list of picoDsts in to HpssPicoDsts collection
-        if listDocs:
-            print("Insert List: Add {0} picoDsts".format(len(listDocs)))
+        try:
             self._collHpssPicoDsts.insert_many(listDocs, ordered=False)
+        except errors.BulkWriteError as e:
+            listErrors = e.details['writeErrors']
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in listErrors):
+                raise
+
+            duplicateIndices = set(error['index'] for error in listErrors)
+            return ([doc for idx, doc in enumerate(listDocs) if idx not in duplicateIndices],
+                    [listDocs[idx] for idx in sorted(duplicateIndices)])
+
+        return listDocs, []
+
+    # _________________________________________________________
+    def _splitDuplicates(self, listDocs, isRequeued=False):
+        """Split list of picoDsts in new documents and duplicates.
+
+           Only the filePaths of the list itself are looked up in the
+           HPSSPicoDst collection, in chunks of $in queries on the
+           unique filePath index. Repeated filePaths within the list
+           are treated as duplicates as well.
+
+           Members of a requeued tar file (isRequeued) already there from
+           the same tar file with the same size are dropped - the tar file
+           was listed before a crash, but filesInTar was not set.
+
+           return list of new documents and list of duplicates
+           """
+
+        # -- Get filePaths of the list already in collection - with their origin
+        existingPaths = {}
+        for idx in range(0, len(listDocs), N_DUPLICATE_QUERY_CHUNK):
+            chunkPaths = [doc['filePath'] for doc in listDocs[idx:idx+N_DUPLICATE_QUERY_CHUNK]]
+            for entry in self._collHpssPicoDsts.find({'filePath': {'$in': chunkPaths}},
+                                                     {'filePath': True, 'fileFullPath': True, 'fileSize': True,
+                                                      'fileFullPathTar': True, '_id': False}):
+                existingPaths[entry['filePath']] = _getOrigin(entry)
+
+        # -- Classify documents in one pass
+        listNew = []
+        listDuplicates = []
+        for doc in listDocs:
+            if doc['filePath'] not in existingPaths:
+                listNew.append(doc)
+                existingPaths[doc['filePath']] = _getOrigin(doc)
+            elif not isRequeued or existingPaths[doc['filePath']] != _getOrigin(doc):
+                listDuplicates.append(doc)
+
+        return listNew, listDuplicates
+
+
+# ____________________________________________________________________________
+def _getOrigin(doc):
+    """Get origin of picoDst document - (fileFullPath, fileFullPathTar, fileSize)."""
+
+    return doc.get('fileFullPath'), doc.get('fileFullPathTar'), doc.get('fileSize')
+
+# ____________________________________________________________________________
+def normalizeMTime(month, day, yearOrTime, today = None):
+    """Normalize mtime of "ls -l" output.
+
+       Recent entries show the time instead of the year - their year is the
+       current one, or the last one if the date would be in the future.
+
+       return 'YYYY-MM-DD HH:MM' for recent entries, otherwise 'YYYY-MM-DD'
+       """
+
+    today = today if today else datetime.date.today()
+
+    try:
+        monthIdx = datetime.datetime.strptime(month, '%b').month
+
+        if ':' not in yearOrTime:
+            return datetime.date(int(yearOrTime), monthIdx, int(day)).strftime('%Y-%m-%d')
+
+        year = today.year if (monthIdx, int(day)) <= (today.month, today.day) else today.year - 1
+        return '{0} {1:0>5s}'.format(datetime.date(year, monthIdx, int(day)).strftime('%Y-%m-%d'), yearOrTime)
+
+    except ValueError:
+        return ' '.join([month, day, yearOrTime])
+
+# ____________________________________________________________________________
+def isSameMTime(mTime, otherMTime):
+    """Check if normalized mtimes are the same.
+
+       If one of them has only the date (entry aged past six months in
+       "ls -l"), only the dates are compared.
+       """
+
+    if not mTime or not otherMTime:
+        return False
+
+    if mTime == otherMTime:
+        return True
+
+    nDate = len('YYYY-MM-DD')
+    return min(len(mTime), len(otherMTime)) == nDate and mTime[:nDate] == otherMTime[:nDate]
 
-        # -- Insert list of duplicate picoDsts in to HpssDuplicates collection
-        if listDuplicates:
-            print("Insert List: Add {0} duplicate picoDsts".format(len(listDuplicates)))
-            self._collHpssDuplicates.insert_many(listDuplicates, ordered=False)
+# ____________________________________________________________________________
+def crawlSubFolder(subFolder, target, pathKeysSchema, bulkBatchSize, nTarWorkers, incremental, crawlEpoch):
+    """Crawl one subFolder in a worker process.
+
+       Uses its own mongoDB connection and returns the summary of the crawl.
+       """
+
+    dbUtil = mongoDbUtil("", "admin")
+
+    hpss = hpssUtil(target, pathKeysSchema, bulkBatchSize, nTarWorkers)
+    hpss.setCollections(dbUtil.getCollection("HPSS_Files"),
+                        dbUtil.getCollection("HPSS_PicoDsts"),
+                        dbUtil.getCollection("HPSS_Duplicates"),
+                        dbUtil.getCollection("HPSS_CrawlCheckpoints"),
+                        dbUtil.getCollection("HPSS_DirFingerprints"))
+    hpss._crawlEpoch = crawlEpoch
+    try:
+        hpss._parseSubFolder(subFolder, incremental)
+    finally:
+        dbUtil.close()
 
+    return hpss.getSummary()
+
+# ____________________________________________________________________________
+def startCrawlEpoch(collHpssCrawlEpochs, incremental = False):
+    """Get epoch for a new crawl.
+
+       If the last crawl did not finish, its epoch is returned to resume it.
+       """
+
+    while True:
+        lastEpoch = collHpssCrawlEpochs.find_one(sort=[('_id', pymongo.DESCENDING)])
+        if lastEpoch and not lastEpoch['finished']:
+            print("Resume crawl epoch", lastEpoch['_id'])
+            return lastEpoch['_id']
+
+        crawlEpoch = lastEpoch['_id'] + 1 if lastEpoch else 1
+        try:
+            collHpssCrawlEpochs.insert_one({'_id': crawlEpoch, 'incremental': incremental,
+                                            'started': datetime.datetime.today().strftime('%Y-%m-%d'),
+                                            'finished': None})
+            return crawlEpoch
+        except errors.DuplicateKeyError:
+            continue
+
+# ____________________________________________________________________________
+def finishCrawlEpoch(collHpssCrawlEpochs, crawlEpoch):
+    """Mark crawl epoch as finished."""
+
+    collHpssCrawlEpochs.update_one({'_id': crawlEpoch},
+                                   {'$set': {'finished': datetime.datetime.today().strftime('%Y-%m-%d')}})
+
+# ____________________________________________________________________________
+def sweepHpssFiles(collHpssFiles, collHpssCrawlEpochs, nEpochs):
+    """Get files in HPSSFiles not seen in the last nEpochs finished crawls.
+
+       Uses the index on lastSeenEpoch - returns a cursor, or None
+       if no crawl finished yet.
+       """
+
+    lastEpoch = collHpssCrawlEpochs.find_one({'finished': {'$ne': None}}, sort=[('_id', pymongo.DESCENDING)])
+    if not lastEpoch:
+        return None
+
+    minEpoch = lastEpoch['_id'] - nEpochs + 1
+
+    return collHpssFiles.find({'$or': [{'lastSeenEpoch': {'$lt': minEpoch}},
+                                       {'lastSeenEpoch': {'$exists': False}}]})
+
+# ____________________________________________________________________________
+def rebuildPicoDstCollections(dbUtil):
+    """Rebuild HPSS_PicoDsts and HPSS_Duplicates from HPSS_Files.
+
+       The picoDsts are inserted into fresh collections, which replace the
+       old ones only if all tar files could be listed. Staging marks are
+       lost with the old collection - the applied staging requests of the
+       target are removed before, so that the stager sets all marks again.
+       """
+
+    # -- Both collections are created, so that they can be renamed even if empty
+    collHpssPicoDsts = dbUtil.createCollection('HPSS_PicoDsts' + REBUILD_SUFFIX)
+    collHpssPicoDsts.create_index([('filePath', pymongo.ASCENDING)], unique=True)
+
+    collHpssDuplicates = dbUtil.createCollection('HPSS_Duplicates' + REBUILD_SUFFIX)
+
+    hpss = hpssUtil()
+    hpss.setCollections(dbUtil.getCollection("HPSS_Files"), collHpssPicoDsts, collHpssDuplicates)
+
+    if not hpss.rebuildPicoDsts():
+        print("Rebuild incomplete - old collections are kept, rebuilt ones are in *{0}".format(REBUILD_SUFFIX))
+        return
+
+    # -- Clear applied staging requests first - a failed swap can not lose the marks
+    dbUtil.getCollection('Staging_Requests').delete_many({'_id': {'$regex': '^picoDst_'}})
+
+    collHpssPicoDsts.rename('HPSS_PicoDsts', dropTarget=True)
+    collHpssDuplicates.rename('HPSS_Duplicates', dropTarget=True)
+
+    print("Rebuild done - HPSS_PicoDsts and HPSS_Duplicates replaced")
 
 # ____________________________________________________________________________
 def checkForHPSSTransfer():
@@ -431,13 +1085,30 @@ def main():
     # -- Connect to mongoDB
     dbUtil = mongoDbUtil("", "admin")
 
+    # -- Rebuild picoDst collections from HPSS_Files only
+    if '--rebuild' in sys.argv[1:]:
+        rebuildPicoDstCollections(dbUtil)
+        dbUtil.close()
+        return
+
     collHpssFiles      = dbUtil.getCollection("HPSS_Files")
     collHpssPicoDsts   = dbUtil.getCollection("HPSS_PicoDsts")
     collHpssDuplicates = dbUtil.getCollection("HPSS_Duplicates")
 
+    collHpssCheckpoints     = dbUtil.getCollection("HPSS_CrawlCheckpoints")
+    collHpssDirFingerprints = dbUtil.getCollection("HPSS_DirFingerprints")
+    collHpssCrawlEpochs     = dbUtil.getCollection("HPSS_CrawlEpochs")
+
     hpss = hpssUtil()
-    hpss.setCollections(collHpssFiles, collHpssPicoDsts, collHpssDuplicates)
-    hpss.getFileList()
+    hpss.setCollections(collHpssFiles, collHpssPicoDsts, collHpssDuplicates, collHpssCheckpoints,
+                        collHpssDirFingerprints)
+
+    # -- Incremental crawl - full crawl once a week as safety net
+    incremental = datetime.date.today().weekday() != FULL_CRAWL_WEEKDAY
+
+    crawlEpoch = startCrawlEpoch(collHpssCrawlEpochs, incremental)
+    if hpss.getFileList(crawlEpoch, N_SUBFOLDER_WORKERS, incremental):
+        finishCrawlEpoch(collHpssCrawlEpochs, crawlEpoch)
 
     dbUtil.close()
 
@@ -13,6 +13,9 @@ import os.path
 import re
 import json
 import shutil
+
+# -- Requires psutil and, on python 3.4 (no os.scandir), the scandir
+#    backport used by xrdWalker and xrdWatcher: pip install psutil scandir
 import psutil
 
 import logging as log
@@ -21,13 +24,19 @@ import socket
 import datetime
 import shlex, subprocess
 import errno
+import fcntl
+import sqlite3
 
-from mongoUtil import mongoDbUtil
+from mongoUtil import mongoDbUtil, bulkWriteBuffer
+from xrdWalker import xrdWalker
+from xrdInventory import xrdInventory, INVENTORY_FILE
+from xrdWatcher import xrdWatcher
 import pymongo
 
 from pymongo import results
 from pymongo import errors
 from pymongo import bulk
+from pymongo import InsertOne
 
 from pprint import pprint
 
@@ -35,7 +44,18 @@ from pprint import pprint
 # -- GLOBAL CONSTANTS
 
 XROOTD_PREFIX = '/export/data/xrd/ns/star'
-DISK_LIST = ['data', 'data1', 'data2', 'data3', 'data4']
+
+DAEMON_FLUSH_INTERVAL  = 5
+DAEMON_RESCAN_INTERVAL = 24 * 3600
+
+# -- Rescans after lost events at most this often, with unwatched directories this often
+DAEMON_MIN_RESCAN_INTERVAL       = 600
+DAEMON_UNWATCHED_RESCAN_INTERVAL = 3600
+
+# -- Files modified more recently are still being written - added later
+DAEMON_SETTLE_TIME = 60
+
+DAEMON_LOCK_FILE = '/export/data/xrd/sdmsCrawlerXRD.lock'
 
 ##############################################
 
@@ -50,7 +70,6 @@ class crawlerXRD:
 
     # _________________________________________________________
     def __init__(self, dbUtil):
-        self._today = datetime.datetime.today().strftime('%Y-%m-%d')
         self._nodeName = socket.getfqdn().split('.')[0]
 
         self._listOfTargets = ['picoDst', 'picoDstJet', 'aschmah']
@@ -64,6 +83,16 @@ class crawlerXRD:
                           'picoDstJet': 'PicoDstsJets',
                           'aschmah': 'ASchmah'}
 
+        # -- Working directories of targets - longest first, to find target of a file
+        self._workDirs = dict((target, os.path.join(XROOTD_PREFIX, self._baseFolders[target]))
+                              for target in self._listOfTargets)
+
+        self._listWorkDirsByLength = sorted(self._workDirs.items(), key=lambda item: len(item[1]), reverse=True)
+
+        self._walker = xrdWalker()
+
+        self._inventoryFile = INVENTORY_FILE
+
         self._addCollections(dbUtil)
 
     # _________________________________________________________
@@ -82,89 +111,304 @@ class crawlerXRD:
         self._collDataServer = dbUtil.getCollection("XRD_DataServers")
 
     # _________________________________________________________
-    def process(self, target):
-        """process target"""
+    def process(self, fullSync = False, onDir = None):
+        """process all targets in one walk - only changes to the local inventory are added to DB
 
-        print("Process Target:", target, "on", self._nodeName)
+           onDir is called with every directory before it is read.
+           """
 
-        if target not in self._listOfTargets:
-            print('Unknown "target"', target, 'for processing')
-            return
+        print("Process Targets:", ', '.join(self._listOfTargets), "on", self._nodeName)
+
+        inventory = xrdInventory(self._inventoryFile)
+
+        # -- Seed inventory with files stored on this node in DB - first run or full sync
+        if fullSync or not inventory.isSeeded():
+            print('   Seed local inventory from DB')
+            inventory.seed(fileInfo for target in self._listOfTargets for fileInfo in self._getFilesOnNode(target))
+
+        # -- Results are streamed to DB in bulk inserts of bounded size
+        self._openWriters()
+
+        # -- Run over all files - compare with inventory
+        inventory.startRun()
+
+        for doc in self._walkFiles(self._getFolders(), onDir):
+            self._addFile(inventory, doc)
+
+        # -- Add files not found anymore as missing to DB
+        for target in self._listOfTargets:
+            for doc in self._makeMissingDocs(target, inventory.getMissing(target)):
+                self._writersMiss[target].add(InsertOne(doc))
+
+        self._flushWriters()
+
+        # -- Commit inventory after all changes are in DB
+        inventory.finishRun()
+        inventory.close()
+
+    # _________________________________________________________
+    def watch(self):
+        """Daemon - add changes seen by inotify to DB.
+
+           Changes are collected for DAEMON_FLUSH_INTERVAL and added to DB
+           together. All files are walked at start and every DAEMON_RESCAN_INTERVAL.
+
+           If inotify events were lost or changes could not be added to the
+           inventory, one rescan is pending - it is done at most every
+           DAEMON_MIN_RESCAN_INTERVAL, events queued until then are dropped.
+           Directories without watch (limit of watches reached) are rescanned
+           every DAEMON_UNWATCHED_RESCAN_INTERVAL.
+
+           Files still being written are kept back and added once they were
+           not modified for DAEMON_SETTLE_TIME - the namespace holds links,
+           writes to their targets on the data partitions are not seen.
+           """
+
+        print("Watch Targets:", ', '.join(self._listOfTargets), "on", self._nodeName)
+
+        watcher = xrdWatcher()
+        lastRescan    = 0
+        rescanPending = False
+
+        # -- Created files still being written
+        pending = {}
+
+        try:
+            while True:
+                # -- Lost events - all coalesced in one pending rescan
+                if watcher.overflowed:
+                    if not rescanPending:
+                        print('inotify events lost - rescan pending')
+                    watcher.overflowed = False
+                    rescanPending = True
+
+                timeSinceRescan = time.time() - lastRescan
+
+                # -- Full rescan - watches are added by the walk before a directory is read,
+                #    so no change is lost. Queued events are covered by the rescan.
+                if timeSinceRescan > DAEMON_RESCAN_INTERVAL or \
+                        (rescanPending and timeSinceRescan > DAEMON_MIN_RESCAN_INTERVAL) or \
+                        (watcher.unwatched and timeSinceRescan > DAEMON_UNWATCHED_RESCAN_INTERVAL):
+                    watcher.drain()
+                    watcher.overflowed = False
+                    rescanPending      = False
+
+                    # -- Watches of unwatched directories are tried again by the walk
+                    watcher.unwatched.clear()
+
+                    self.process(onDir=watcher.addDir)
+                    self.updateServerInfo()
+                    lastRescan = time.time()
+
+                    if watcher.unwatched:
+                        print('   {0} directories not watched - rescan in {1} s'.format(len(watcher.unwatched),
+                                                                                      DAEMON_UNWATCHED_RESCAN_INTERVAL))
+
+                # -- Collect changes - last event of a file counts
+                changes     = pending
+                deletedDirs = set()
+                deadline    = time.time() + DAEMON_FLUSH_INTERVAL
+
+                while time.time() < deadline:
+                    for path, created, isDir in watcher.read(deadline - time.time()):
+                        if not isDir:
+                            changes[path] = created
+                        elif not created:
+                            deletedDirs.add(path)
+
+                if not changes and not deletedDirs:
+                    continue
+
+                # -- Add changes - rescan if inventory could not be updated
+                try:
+                    pending = self._applyChanges(changes, deletedDirs)
+                except sqlite3.Error as e:
+                    print('Error updating inventory - rescan pending:', e)
+                    rescanPending = True
+                    pending = {}
+
+        except KeyboardInterrupt:
+            print("Stop watching")
+
+        finally:
+            watcher.close()
+
+    # _________________________________________________________
+    def _applyChanges(self, changes, deletedDirs):
+        """Add changes of files and deleted directories to inventory and DB.
+
+           return dict of created files still being written - not added yet
+           """
+
+        pending = {}
+
+        inventory = xrdInventory(self._inventoryFile)
+        self._openWriters()
+
+        # -- Deleted directories first - files of targets below are missing
+        for path in deletedDirs:
+            for target, workDir in self._workDirs.items():
+                if path.startswith(workDir + '/'):
+                    prefix = path[len(workDir)+1:]
+                elif workDir == path or workDir.startswith(path + '/'):
+                    prefix = ''
+                else:
+                    continue
+
+                for doc in self._makeMissingDocs(target, inventory.removeTree(target, prefix)):
+                    self._writersMiss[target].add(InsertOne(doc))
+
+        for path, created in changes.items():
+            # -- Created file - if not deleted again
+            if created and os.path.lexists(path):
+                if self._isBeingWritten(path):
+                    pending[path] = created
+                    continue
+
+                doc = self._makeDoc(*self._walker.getFileInfo(path))
+                if doc:
+                    self._addFile(inventory, doc)
+                continue
+
+            # -- Deleted file
+            target, workDir = self._getTarget(path)
+            if target and inventory.remove(target, path[len(workDir)+1:]):
+                for doc in self._makeMissingDocs(target, [path[len(workDir)+1:]]):
+                    self._writersMiss[target].add(InsertOne(doc))
+
+        self._flushWriters()
+
+        # -- Commit inventory after all changes are in DB
+        inventory.commit()
+        inventory.close()
 
-        # -- Get list of files stored on this node
-        listOfFilesOnNode = list(item['filePath']
-                                 for item in self._colls[target].find({'target': target,
-                                                                       'storage.location': 'XRD',
-                                                                       'storage.details': self._nodeName},
-                                                                      {'filePath': True, '_id': False}))
-
-        # -- Get working directoty
-        self._workDir = os.path.join(XROOTD_PREFIX, self._baseFolders[target])
-
-        # -- Check if working directory exists
-        if not os.path.isdir(self._workDir):
-            # -- Add missing files to DB - if there are some
-            if listOfFilesOnNode:
-                self._collsMiss[target].insert_many(listOfFilesOnNode, ordered=False)
+        return pending
+
+    # _________________________________________________________
+    def _isBeingWritten(self, path):
+        """Check if file (link target) was modified within DAEMON_SETTLE_TIME."""
+
+        try:
+            return os.stat(path).st_mtime > time.time() - DAEMON_SETTLE_TIME
+        except OSError:
+            return False
+
+    # _________________________________________________________
+    def _getFolders(self):
+        """Get folders to walk - nested working directories are walked with their parent."""
+
+        listWorkDirs = [workDir for workDir in set(self._workDirs.values()) if os.path.isdir(workDir)]
+
+        return [workDir for workDir in listWorkDirs
+                if not any(workDir.startswith(parent + '/') for parent in listWorkDirs)]
+
+    # _________________________________________________________
+    def _openWriters(self):
+        """Get bulk write buffers for new and missing files."""
+
+        self._writersNew  = dict((target, bulkWriteBuffer(self._collsNew[target])) for target in self._listOfTargets)
+        self._writersMiss = dict((target, bulkWriteBuffer(self._collsMiss[target])) for target in self._listOfTargets)
+
+    # _________________________________________________________
+    def _flushWriters(self):
+        """Flush bulk write buffers and print number of changes."""
+
+        for target in self._listOfTargets:
+            self._writersNew[target].flush()
+            self._writersMiss[target].flush()
+
+            if self._writersNew[target].nOps or self._writersMiss[target].nOps:
+                print('   {0}: {1} new files, {2} missing files'.format(target, self._writersNew[target].nOps,
+                                                                       self._writersMiss[target].nOps))
+
+    # _________________________________________________________
+    def _addFile(self, inventory, doc):
+        """Add file to inventory - add it to DB if new or changed."""
+
+        state = inventory.update(doc['target'], doc['filePath'], doc['fileSize'], doc['storage']['disk'])
+        if not state:
             return
 
-        # -- Get list folders to walk on
-        ignoreList = [os.path.join(XROOTD_PREFIX, value) for key, value in self._baseFolders.items()
-                      if key != target ]
+        # -- Add broken links as missing, new and changed files as new to DB
+        if 'issue' in doc:
+            self._writersMiss[doc['target']].add(InsertOne(doc))
+        else:
+            self._writersNew[doc['target']].add(InsertOne(doc))
+
+    # _________________________________________________________
+    def _getFilesOnNode(self, target):
+        """Get files of target stored on this node - yields (target, filePath, fileSize, disk)."""
+
+        for item in self._colls[target].find({'target': target,
+                                              'storage.location': 'XRD',
+                                              'storage.details': self._nodeName},
+                                             {'filePath': True, 'fileSize': True, '_id': False}):
+            yield target, item['filePath'], item.get('fileSize', -1), ''
+
+    # _________________________________________________________
+    def _getTarget(self, fileFullPath):
+        """Get target of file by the longest matching working directory.
+
+           return target and working directory or None, None
+           """
 
-        folderList = [name for name in os.listdir(self._workDir)
-                      if os.path.isdir(os.path.join(self._workDir, name))
-                      and os.path.join(self._workDir, name) not in ignoreList]
+        for target, workDir in self._listWorkDirsByLength:
+            if fileFullPath.startswith(workDir + '/'):
+                return target, workDir
 
-        listOfNewFiles = []
+        return None, None
 
-        # -- Run over folders for target
-        for folder in folderList:
-            for root, dirs, files in os.walk(os.path.join(self._workDir, folder)):
-                for fileName in files:
+    # _________________________________________________________
+    def _walkFiles(self, listFolders, onDir = None):
+        """Walk over folders - yields document of every file of a target."""
+
+        for fileInfo in self._walker.walk(listFolders, onDir):
+            doc = self._makeDoc(*fileInfo)
+            if doc:
+                yield doc
 
-                    # -- document of current file
-                    doc = {'fileFullPath': os.path.join(root, fileName),
-                           'filePath': os.path.join(root[len(self._workDir)+1:], fileName),
-                           'storage': {'location': 'XRD',
-                                       'detail': self._nodeName,
-                                       'disk': ''},
-                           'target': target,
-                           'fileSize': -1}
+    # _________________________________________________________
+    def _makeDoc(self, fileFullPath, fileSize, disk):
+        """Make document of file.
 
-                    # -- check if file link is ok and get size
-                    try:
-                        fstat = os.stat(doc['fileFullPath'])
-                    except OSError as e:
-                        doc['issue'] = 'brokenLink'
-                        self._collsMiss[target].insert(doc)
-                        continue
+           return document or None if file belongs to no target
+           """
 
-                    doc['fileSize'] = fstat.st_size
-                    doc['storage']['disk'] = os.readlink(doc['fileFullPath']).split('/')[2]
+        target, workDir = self._getTarget(fileFullPath)
+        if not target:
+            return None
 
-                    # -- If fileName in listOfFilesOnNode
-                    #    -> Do Nothing
-                    if doc['filePath'] in listOfFilesOnNode:
-                        listOfFilesOnNode.remove(doc['filePath'])
-                        continue
+        # -- document of current file
+        doc = {'fileFullPath': fileFullPath,
+               'filePath': fileFullPath[len(workDir)+1:],
+               'storage': {'location': 'XRD',
+                           'detail': self._nodeName,
+                           'disk': disk},
+               'target': target,
+               'fileSize': fileSize}
 
-                    # -- New file add to list of files to be added
-                    listOfNewFiles.append(doc)
+        # -- check if file link is ok
+        if fileSize < 0:
+            doc['issue'] = 'brokenLink'
 
-        # -- Add new files to DB
-        if listOfNewFiles:
-            self._collsNew[target].insert_many(listOfNewFiles, ordered=False)
+        return doc
 
-        # -- Add missing files to DB
-        if listOfFilesOnNode:
-            self._collsMiss[target].insert_many(listOfFilesOnNode, ordered=False)
+    # _________________________________________________________
+    def _makeMissingDocs(self, target, missingFiles):
+        """Make documents for files missing on node - yields document of every file."""
 
+        for filePath in missingFiles:
+            yield {'filePath': filePath,
+                   'storage': {'location': 'XRD',
+                               'detail': self._nodeName},
+                   'target': target}
 
     # _________________________________________________________
     def updateServerInfo(self):
         """update info Server"""
 
+        today = datetime.datetime.today().strftime('%Y-%m-%d')
+
         # -- Set of mounted data partitions
         mountSet = set(disk.mountpoint for disk in psutil.disk_partitions()
                        if '/export/data' in disk.mountpoint)
@@ -192,7 +436,7 @@ class crawlerXRD:
                                                  {'$set': {'freeSpace': free,
                                                            'usedSpace': used,
                                                            'totalSpace': total,
-                                                           'lastWalkerRun': self._today},
+                                                           'lastWalkerRun': today},
                                                   '$setOnInsert' : doc}, upsert = True)
 
 # ____________________________________________________________________________
@@ -204,10 +448,23 @@ def main():
 
     xrd = crawlerXRD(dbUtil)
 
-    # -- process different targets
-    xrd.process('picoDst')
-    xrd.process('picoDstJet')
-    xrd.process('aschmah')
+    # -- Daemon - watch for changes, only one daemon per node
+    if '--daemon' in sys.argv[1:]:
+        with open(DAEMON_LOCK_FILE, 'a') as lockFile:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                print('XRD Crawler daemon already running on', socket.getfqdn().split('.')[0])
+                dbUtil.close()
+                return
+
+            xrd.watch()
+
+        dbUtil.close()
+        return
+
+    # -- process all targets in one walk - full sync with DB if requested
+    xrd.process(fullSync='--full' in sys.argv[1:])
 
     # -- Update data server DB
     xrd.updateServerInfo()
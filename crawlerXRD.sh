@@ -1,8 +1,15 @@
 #!/bin/bash
 
+# -- Keep the XRD crawler daemon running on this data server
+#    Run from cron every few minutes instead of the nightly crawl - if the
+#    daemon is already running, crawlerXRD.py exits right away. The daemon
+#    rescans all files once a day by itself.
+
+# -- Needs psutil and the scandir backport (python 3.4 has no os.scandir)
+#      pip install --user psutil scandir
 
 module load python/3.4.3
 
 source ~jthaeder/SDMS/setenv.sh
 
-python ~jthaeder/SDMS/crawlerXRD.py
+python -u ~jthaeder/SDMS/crawlerXRD.py --daemon >> /export/data/xrd/sdmsCrawlerXRD.log 2>&1
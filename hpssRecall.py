@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Tape ordered recall of files from HPSS
+
+Recalling files in catalog order results in repeated tape mounts and
+seeks. The recallScheduler groups recall items by tape volume and sorts
+them by position on tape. The items are recalled in this order by the
+workers of the staging queue, one per tape drive (see stagerSDMS).
+
+A recall item is a dict with at least:
+ 'hpssPath' : path of the file or tar file on HPSS
+ 'fileSize' : size in bytes
+
+Tape volume and position are taken from "hsi ls -P" (hsiTapeInfo), or
+from a stand-in (catalogTapeInfo), which keeps the catalog order. The
+source is selected by name in TAPE_INFO_SOURCES (see getTapeInfo).
+"""
+
+import sys
+import subprocess
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+N_FILES_PER_HSI_CALL = 500
+N_TAPE_DRIVES        = 4
+N_ITEMS_PER_RECALL   = 100
+
+UNKNOWN_VOLUME   = ''
+UNKNOWN_POSITION = (-1,)
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class hsiTapeInfo:
+    """Get tape volume and position of files on HPSS via "hsi ls -P"."""
+
+    # _________________________________________________________
+    def getTapeInfo(self, listPaths):
+        """Get tape volume and position for list of paths.
+
+           return dict of path -> (volume, position)
+           """
+
+        tapeInfo = {}
+
+        for idx in range(0, len(listPaths), N_FILES_PER_HSI_CALL):
+            cmdLine = 'ls -P {0}'.format(' '.join('"{0}"'.format(path) for path in listPaths[idx:idx+N_FILES_PER_HSI_CALL]))
+            p = subprocess.Popen(['hsi', '-q', cmdLine], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+            # -- Parse lines like
+            #    FILE  /path/148.tar  13538711552  13538711552  4237+0  EA123400  5  0  1 ...
+            for lineTerminated in iter(p.stdout.readline, b''):
+                lineTokenized = lineTerminated.decode("utf-8").split()
+
+                if len(lineTokenized) < 6 or lineTokenized[0] != 'FILE':
+                    continue
+
+                try:
+                    position = tuple(int(token) for token in lineTokenized[4].split('+'))
+                except ValueError:
+                    position = UNKNOWN_POSITION
+
+                tapeInfo[lineTokenized[1]] = (lineTokenized[5], position)
+
+        return tapeInfo
+
+# ----------------------------------------------------------------------------------
+class catalogTapeInfo:
+    """Stand-in for tape info, if no HPSS metadata is available.
+
+       All files are on one unknown volume, in order of their path.
+       """
+
+    # _________________________________________________________
+    def getTapeInfo(self, listPaths):
+        """Get stand-in volume and position for list of paths."""
+
+        return dict((path, (UNKNOWN_VOLUME, (idx,))) for idx, path in enumerate(sorted(listPaths)))
+
+# ----------------------------------------------------------------------------------
+
+# -- Sources of tape info by name
+TAPE_INFO_SOURCES = {'hsi': hsiTapeInfo, 'catalog': catalogTapeInfo}
+
+# ____________________________________________________________________________
+def getTapeInfo(source = 'hsi'):
+    """Get tape info source by name - see TAPE_INFO_SOURCES."""
+
+    try:
+        return TAPE_INFO_SOURCES[source]()
+    except KeyError:
+        raise ValueError('Unknown tape info source: {0}'.format(source))
+
+# ----------------------------------------------------------------------------------
+class recallScheduler:
+    """Schedule recalls from HPSS in tape order."""
+
+    # _________________________________________________________
+    def __init__(self, tapeInfo = None):
+        self._tapeInfo = tapeInfo if tapeInfo else hsiTapeInfo()
+
+    # _________________________________________________________
+    def makePlan(self, listItems):
+        """Group recall items by tape volume and sort them by position.
+
+           Adds 'tapeVolume', 'tapePosition' and 'tapeOrder' (rank on
+           volume) to every item.
+
+           return plan: list of {'volume', 'items', 'nBytes'}, largest volume first
+           """
+
+        tapeInfo = self._tapeInfo.getTapeInfo(sorted(set(item['hpssPath'] for item in listItems)))
+
+        volumes = {}
+        for item in listItems:
+            item['tapeVolume'], item['tapePosition'] = tapeInfo.get(item['hpssPath'],
+                                                                    (UNKNOWN_VOLUME, UNKNOWN_POSITION))
+            volumes.setdefault(item['tapeVolume'], []).append(item)
+
+        plan = [{'volume': volume,
+                 'items': sorted(items, key=lambda item: (item['tapePosition'], item['hpssPath'])),
+                 'nBytes': sum(item['fileSize'] for item in items)}
+                for volume, items in volumes.items()]
+
+        # -- Rank of item on its volume
+        for volumePlan in plan:
+            for idx, item in enumerate(volumePlan['items']):
+                item['tapeOrder'] = idx
+
+        return sorted(plan, key=lambda volumePlan: volumePlan['nBytes'], reverse=True)
+
+    # _________________________________________________________
+    def reportPlan(self, plan):
+        """Print estimated mounts and bytes of plan.
+
+           return dict with 'nMounts', 'nItems' and 'nBytes'
+           """
+
+        report = {'nMounts': sum(1 for volumePlan in plan if volumePlan['volume'] != UNKNOWN_VOLUME),
+                  'nItems':  sum(len(volumePlan['items']) for volumePlan in plan),
+                  'nBytes':  sum(volumePlan['nBytes'] for volumePlan in plan)}
+
+        print('Recall plan: {0} items, {1:.1f} GB, {2} tape mounts'.format(report['nItems'], report['nBytes'] / 1024**3,
+                                                                          report['nMounts']))
+        for volumePlan in plan:
+            print('   Volume {0:10s}: {1:6d} items, {2:8.1f} GB'.format(volumePlan['volume'] or 'unknown',
+                                                                      len(volumePlan['items']),
+                                                                      volumePlan['nBytes'] / 1024**3))
+
+        return report
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Local on-disk cache of parsed htar listings
+
+Every tar file on HPSS gets one gzip compressed json file, which holds
+the listing of the tar file members as [fileFullPath, fileSize] pairs.
+
+The cache key is build from the full path, the size and the mtime date
+of the tar file as given in the "hsi ls -l" output (normalized to
+YYYY-MM-DD, see crawlerHPSS.normalizeMTime) - any change of the tar file
+on HPSS results in a new key.
+
+The cache is capped in size, least recently used entries are evicted
+first. (The access time is tracked via the mtime of the cache file.)
+
+The cache is best-effort: errors writing or evicting entries (e.g. disk
+full, entries removed by another crawler) are reported and ignored.
+"""
+
+import sys
+import os
+import gzip
+import json
+import hashlib
+import functools
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+HTAR_CACHE_DIR      = os.path.join(os.getenv('SCRATCH', os.path.expanduser('~')), 'SDMS_htarCache')
+HTAR_CACHE_MAX_SIZE = 2 * 1024**3
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class htarCache:
+    """Size capped on-disk cache of htar listings."""
+
+    # _________________________________________________________
+    def __init__(self, cacheDir = HTAR_CACHE_DIR, maxSize = HTAR_CACHE_MAX_SIZE):
+        self._cacheDir = cacheDir
+        self._maxSize  = maxSize
+
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(self._cacheDir, exist_ok=True)
+        except OSError as e:
+            print('Error creating htar cache:', e)
+
+        # -- Get current size of cache
+        self._cacheSize = sum(size for mtime, size, path in self._getEntries())
+
+    # _________________________________________________________
+    def _getCacheFile(self, tarFullPath, tarSize, tarMTime):
+        """Get cache file for tar file."""
+
+        key = '{0}|{1}|{2}'.format(tarFullPath, tarSize, tarMTime)
+        return os.path.join(self._cacheDir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json.gz')
+
+    # _________________________________________________________
+    def get(self, tarFullPath, tarSize, tarMTime):
+        """Get listing of tar file.
+
+           return list of [fileFullPath, fileSize] or None if not cached
+           """
+
+        cacheFile = self._getCacheFile(tarFullPath, tarSize, tarMTime)
+
+        try:
+            with gzip.open(cacheFile, 'rt') as inFile:
+                listing = json.load(inFile)
+        except (OSError, ValueError):
+            return None
+
+        # -- Mark as recently used
+        try:
+            os.utime(cacheFile)
+        except OSError:
+            pass
+
+        return listing['members']
+
+    # _________________________________________________________
+    def put(self, tarFullPath, tarSize, tarMTime, members):
+        """Add listing of tar file to cache - errors are reported, not raised."""
+
+        cacheFile = self._getCacheFile(tarFullPath, tarSize, tarMTime)
+        tmpFile   = '{0}.{1}.{2}.tmp'.format(cacheFile, os.getpid(), threading.get_ident())
+
+        try:
+            with gzip.open(tmpFile, 'wt') as outFile:
+                json.dump({'tarFullPath': tarFullPath, 'members': members}, outFile)
+
+            fileSize = os.path.getsize(tmpFile)
+            os.replace(tmpFile, cacheFile)
+
+        except OSError as e:
+            print('Error adding to htar cache:', tarFullPath, e)
+            try:
+                os.remove(tmpFile)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._cacheSize += fileSize
+
+            if self._cacheSize > self._maxSize:
+                self._evict()
+
+    # _________________________________________________________
+    def _getEntries(self):
+        """Get entries of cache - list of (mtime, size, path), oldest first."""
+
+        entries = []
+
+        try:
+            listEntries = self._listDir()
+        except OSError as e:
+            print('Error reading htar cache:', e)
+            return entries
+
+        # -- Entries can be removed meanwhile by another crawler
+        for name, path, getStat in listEntries:
+            if not name.endswith('.json.gz'):
+                continue
+
+            try:
+                fstat = getStat()
+            except OSError:
+                continue
+
+            entries.append((fstat.st_mtime, fstat.st_size, path))
+
+        return sorted(entries)
+
+    # _________________________________________________________
+    def _listDir(self):
+        """List cache folder - list of (name, path, stat function).
+
+           Without scandir (python 3.4 without the scandir backport),
+           the entries are listed with listdir and stat.
+           """
+
+        if scandir is not None:
+            return [(entry.name, entry.path, entry.stat) for entry in scandir(self._cacheDir)]
+
+        listPaths = [(name, os.path.join(self._cacheDir, name)) for name in os.listdir(self._cacheDir)]
+        return [(name, path, functools.partial(os.stat, path)) for name, path in listPaths]
+
+    # _________________________________________________________
+    def _evict(self):
+        """Remove least recently used entries until cache is below 90% of its size cap."""
+
+        entries = self._getEntries()
+
+        self._cacheSize = sum(entry[1] for entry in entries)
+
+        for mtime, size, path in entries:
+            if self._cacheSize <= 0.9 * self._maxSize:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            self._cacheSize -= size
@@ -12,11 +12,12 @@ import sys
 import datetime
 
 from mongoUtil import mongoDbUtil
+from crawlerHPSS import sweepHpssFiles
 
 ##############################################
 # -- GLOBAL CONSTANTS
 
-N_DAYS_AGO = 14
+N_EPOCHS_AGO = 14
 
 ##############################################
 
@@ -30,20 +31,21 @@ class hpssInspectUtil:
     """Class to inspect HPSS collections."""
 
     # _________________________________________________________
-    def __init__(self, nDaysAgo):
-        self._nDaysAgo = nDaysAgo
+    def __init__(self, nEpochsAgo):
+        self._nEpochsAgo = nEpochsAgo
         self._fields = {1: 'starDetails.runyear', 2: 'starDetails.energy', 3: 'starDetails.system',
                         4: 'starDetails.trigger', 5: 'starDetails.production'}
         self._fieldsExtra = {1: 'starDetails.day', 2: 'starDetails.runnumber', 3: 'starDetails.stream', 4: 'starDetails.picoType',
                              5: 'isInTarFile'}
 
     # _________________________________________________________
-    def setCollections(self, collHpssFiles, collHpssPicoDsts, collHpssDuplicates):
+    def setCollections(self, collHpssFiles, collHpssPicoDsts, collHpssDuplicates, collHpssCrawlEpochs):
         """Get collection from mongoDB."""
 
-        self._collHpssFiles      = collHpssFiles
-        self._collHpssPicoDsts   = collHpssPicoDsts
-        self._collHpssDuplicates = collHpssDuplicates
+        self._collHpssFiles       = collHpssFiles
+        self._collHpssPicoDsts    = collHpssPicoDsts
+        self._collHpssDuplicates  = collHpssDuplicates
+        self._collHpssCrawlEpochs = collHpssCrawlEpochs
 
     # ____________________________________________________________________________
     def generalInfo(self):
@@ -64,17 +66,23 @@ class hpssInspectUtil:
         """Check if all files are still on HPSS."""
 
         print('\n==---------------------------------------------------------==')
-        print('Inspector - check for files, changed within the last {0} days'.format(self._nDaysAgo))
+        print('Inspector - check for files, changed within the last {0} crawls'.format(self._nEpochsAgo))
         print('==---------------------------------------------------------==')
 
-        nDaysAgo = (datetime.date.today() - datetime.timedelta(days=self._nDaysAgo)).strftime('%Y-%m-%d')
+        lostPicoDsts = sweepHpssFiles(self._collHpssFiles, self._collHpssCrawlEpochs, self._nEpochsAgo)
+        if lostPicoDsts is None:
+            return
 
-        lostPicoDsts = list(self._collHpssFiles.find({'lastSeen': {"$lt" : nDaysAgo}}))
+        lostPicoDsts = list(lostPicoDsts)
         if lostPicoDsts:
-            print("These files (", len(lostPicoDsts),") have not been seen for the last", self._nDaysAgo,"days!")
+            print("These files (", len(lostPicoDsts),") have not been seen for the last", self._nEpochsAgo,"crawls!")
+
+            epochDates = dict((entry['_id'], entry['started']) for entry in self._collHpssCrawlEpochs.find({}))
 
             for entry in lostPicoDsts:
-                print("  ", entry['fileFullPath'], "- last seen:", entry['lastSeen'])
+                lastSeenEpoch = entry.get('lastSeenEpoch')
+                print("  ", entry['fileFullPath'], "- last seen:", epochDates.get(lastSeenEpoch, 'never'),
+                      "(crawl epoch {0})".format(lastSeenEpoch))
 
     # ____________________________________________________________________________
     def printOverviewPicoDst(self):
@@ -200,8 +208,10 @@ def main():
     collHpssPicoDsts   = dbUtil.getCollection("HPSS_PicoDsts")
     collHpssDuplicates = dbUtil.getCollection("HPSS_Duplicates")
 
-    inspect = hpssInspectUtil(N_DAYS_AGO)
-    inspect.setCollections(collHpssFiles, collHpssPicoDsts, collHpssDuplicates)
+    collHpssCrawlEpochs = dbUtil.getCollection("HPSS_CrawlEpochs")
+
+    inspect = hpssInspectUtil(N_EPOCHS_AGO)
+    inspect.setCollections(collHpssFiles, collHpssPicoDsts, collHpssDuplicates, collHpssCrawlEpochs)
 
     # -- Print General Info
     inspect.generalInfo()
@@ -24,7 +24,17 @@ ADMIN_USER    = 'STAR_XROOTD_admin'
 READONLY_USER = 'STAR_XROOTD_ro'
 
 COLLECTION_INDICES = {'HPSS_Files': 'fileFullPath', 'HPSS_PicoDsts': 'filePath', 'XRD_DataServers': 'nodeName',
-                      'XRD_PicoDsts': 'filePath'}
+                      'XRD_PicoDsts': 'filePath', 'HPSS_CrawlCheckpoints': 'blockPath',
+                      'HPSS_DirFingerprints': 'dirPath'}
+
+COLLECTION_SECONDARY_INDICES = {'HPSS_Files': ['lastSeenEpoch'], 'HPSS_PicoDsts': ['fileFullPathTar'],
+                                'HPSS_PicoDstsJets': ['filePath', 'fileFullPathTar'],
+                                'HPSS_ASchmah': ['filePath', 'fileFullPathTar'],
+                                'XRD_PicoDstsJets': ['filePath'], 'XRD_ASchmah': ['filePath'],
+                                'Disk_PicoDsts': ['filePath'], 'Disk_PicoDstsJets': ['filePath'],
+                                'Disk_ASchmah': ['filePath']}
+
+N_BULK_BATCH_SIZE = 1000
 
 ##############################################
 
@@ -89,6 +99,8 @@ class mongoDbUtil:
             #print ("Warning: Collection", collectionName, "not known. Index not created.")
             pass
 
+        for field in COLLECTION_SECONDARY_INDICES.get(collectionName, []):
+            collection.create_index([(field, pymongo.ASCENDING)])
             
         return collection
 
@@ -98,6 +110,61 @@ class mongoDbUtil:
 
         self.db[collectionName].drop()
 
+    # _________________________________________________________
+    def createCollection(self, collectionName):
+        """Create new empty collection and set index - an existing one is dropped."""
+
+        self.dropCollection(collectionName)
+        self.db.create_collection(collectionName)
+
+        return self.getCollection(collectionName)
+
+# ----------------------------------------------------------------------------------
+class bulkWriteBuffer:
+    """Buffer of write operations, flushed as unordered bulk_write to a collection.
+
+       Every operation can carry a payload, which is handed back together
+       with the result of the bulk_write to the onFlush callback.
+       """
+
+    # _________________________________________________________
+    def __init__(self, collection, batchSize = N_BULK_BATCH_SIZE, onFlush = None):
+        self._collection = collection
+        self._batchSize  = batchSize
+        self._onFlush    = onFlush
+
+        self._ops      = []
+        self._payloads = []
+
+        self.nOps = 0
+
+    # _________________________________________________________
+    def add(self, op, payload = None):
+        """Add operation to buffer - flush if buffer is full."""
+
+        self._ops.append(op)
+        self._payloads.append(payload)
+
+        if len(self._ops) >= self._batchSize:
+            self.flush()
+
+    # _________________________________________________________
+    def flush(self):
+        """Send buffered operations as one unordered bulk_write."""
+
+        if not self._ops:
+            return
+
+        ops, payloads = self._ops, self._payloads
+        self._ops      = []
+        self._payloads = []
+
+        result = self._collection.bulk_write(ops, ordered=False)
+        self.nOps += len(ops)
+
+        if self._onFlush:
+            self._onFlush(result, payloads)
+
 # ----------------------------------------------------------------------------------
 
 # ____________________________________________________________________________
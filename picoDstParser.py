@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Parser of picoDst paths following the STAR naming conventions
+
+ <runyear>/<system>/<energy>/<trigger>/<production>/<day>/<runnumber>/<fileName>
+
+into STAR details, as in 'starDetails' of the picoDst documents:
+ {'runyear': 'Run10',
+  'system': 'AuAu',
+  'energy': '11GeV',
+  'trigger': 'all',
+  'production': 'P10ih',
+  'day': 149,
+  'runnumber': 11149081,
+  'stream': 'st_physics_adc',
+  'picoType': 'raw'}
+
+Path schemas are compiled once per target and schema (see getPathParser).
+The STAR details of a folder are parsed only once and shared by all
+files in the same folder.
+
+Lists of paths can be parsed in one go with parseBatch, which returns
+the STAR details in columns (see picoDstColumns) - the HPSS crawler
+builds the picoDst documents of a tar file or a bulk write this way.
+
+Run as script to check batch against per-file parsing and for a
+benchmark of both:
+  python picoDstParser.py [nFiles]
+"""
+
+import sys
+import os
+import re
+import time
+import functools
+
+from array import array
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+DEFAULT_PATH_KEYS_SCHEMA = 'runyear/system/energy/trigger/production/day%d/runnumber'
+SHORT_PATH_KEYS_SCHEMA   = 'runyear/system/energy/trigger/day%d/runnumber'
+
+TYPE_MAP = {'s': str, 'd': int, 'f': float}
+
+N_FOLDER_CACHE_SIZE = 65536
+
+STRING_KEYS = ['runyear', 'system', 'energy', 'trigger', 'production', 'stream', 'picoType']
+NUMBER_KEYS = ['day', 'runnumber']
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ____________________________________________________________________________
+def compileSchema(pathKeysSchema):
+    """Compile path keys schema into tuple of (key, type).
+
+       Get the type from each path key (tailing % char), or 's' for
+       string if absent.  i.e.
+       (('runyear', str), ('system', str), ('day', int), ('runnumber', str))
+       """
+
+    typedPathKeys = [k.split('%') if '%' in k else [k, 's'] for k in pathKeysSchema.split(os.path.sep)]
+    return tuple((key, TYPE_MAP[keyType]) for key, keyType in typedPathKeys)
+
+# ----------------------------------------------------------------------------------
+class picoDstPathParser:
+    """Parse picoDst paths of one target into STAR details."""
+
+    # _________________________________________________________
+    def __init__(self, target = 'picoDst', pathKeysSchema = DEFAULT_PATH_KEYS_SCHEMA):
+        self._target           = target
+        self._fileSuffix       = '.{0}.root'.format(target)
+        self._lengthFileSuffix = len(self._fileSuffix)
+
+        self._typedPathKeys      = compileSchema(pathKeysSchema)
+        self._typedPathKeysShort = compileSchema(SHORT_PATH_KEYS_SCHEMA)
+
+        # -- Memo of parsed folders, keyed by folder path
+        self._parseFolder = functools.lru_cache(maxsize=N_FOLDER_CACHE_SIZE)(self._parseFolderUncached)
+
+    # _________________________________________________________
+    def _getTypedPathKeys(self, tokenizedFolder):
+        """Get typed path keys for different scenarios.
+
+           tokenizedFolder is the tokenized path without fileName.
+           """
+
+        # -- Default case
+        if len(tokenizedFolder) == 7:
+            return self._typedPathKeys
+
+        elif len(tokenizedFolder) == 6:
+
+            # -- Get index of date field
+            dateIdx = -1
+            for idx, token in enumerate(tokenizedFolder):
+                try:
+                    if int(token) <= 370:
+                        dateIdx = idx
+                        break
+                except ValueError:
+                    continue
+
+            if dateIdx == 4 and "GeV" in tokenizedFolder[2]:
+                return self._typedPathKeysShort
+
+            else:
+                print("SCHEMA NOT KNOWN !!! - use Default", tokenizedFolder)
+                return self._typedPathKeys
+
+        else:
+            print("SCHEMA NOT KNOWN !!! - use Default", tokenizedFolder)
+            return self._typedPathKeys
+
+    # _________________________________________________________
+    def _parseFolderUncached(self, folderPath):
+        """Parse folder into STAR details.
+
+           return typed path keys and STAR details of folder
+           """
+
+        tokenizedFolder = folderPath.split(os.path.sep) if folderPath else []
+        typedPathKeys   = self._getTypedPathKeys(tokenizedFolder)
+
+        folderStarDetails = dict((key, keyType(value))
+                                 for (key, keyType), value in zip(typedPathKeys, tokenizedFolder))
+
+        return typedPathKeys, folderStarDetails
+
+    # _________________________________________________________
+    @staticmethod
+    @functools.lru_cache(maxsize=N_FOLDER_CACHE_SIZE)
+    def _getStreamRegex(runnumber):
+        """Get regex pattern to get the stream from the fileName."""
+
+        return re.compile('(st_.*)_{}'.format(runnumber))
+
+    # _________________________________________________________
+    def parse(self, fileFullPath):
+        """Parse full path of picoDst.
+
+           return filePath (starting at "Run") and STAR details
+           """
+
+        # -- identify start of "STAR naming conventions"
+        filePath = fileFullPath[fileFullPath.find("/Run")+1:]
+
+        folderPath, _, fileName = filePath.rpartition(os.path.sep)
+
+        typedPathKeys, folderStarDetails = self._parseFolder(folderPath)
+        starDetails = dict(folderStarDetails)
+
+        # -- Path shorter than schema - fileName is part of the details
+        nTokensFolder = folderPath.count(os.path.sep) + 1 if folderPath else 0
+        if len(typedPathKeys) > nTokensFolder:
+            key, keyType = typedPathKeys[nTokensFolder]
+            starDetails[key] = keyType(fileName)
+
+        starDetails['stream'], starDetails['picoType'] = self._parseFileName(fileName, starDetails)
+
+        return filePath, starDetails
+
+    # _________________________________________________________
+    def _parseFileName(self, fileName, starDetails):
+        """Parse fileName.
+
+           Stream is everything between 'st_' at the start and the last
+           '_<runnumber>' - found by string search if possible, otherwise
+           by the regex.
+
+           return stream and picoType
+           """
+
+        runnumber = '{}'.format(starDetails.get('runnumber', ''))
+
+        idxRunnumber = -1
+        if fileName.startswith('st_') and (runnumber.isdigit() or not runnumber) and '\n' not in fileName:
+            idxRunnumber = fileName.rfind('_' + runnumber)
+
+        if idxRunnumber >= 3:
+            fileNameParts = ['', fileName[:idxRunnumber], fileName[idxRunnumber+len(runnumber)+1:]]
+        else:
+            fileNameParts = self._getStreamRegex(runnumber).split(fileName)
+
+        if len(fileNameParts) == 3 and len(fileNameParts[0]) == 0:
+            strippedSuffix = fileNameParts[-1][1:-self._lengthFileSuffix]
+            strippedSuffixParts = strippedSuffix.split('_')
+
+            picoType = strippedSuffixParts[0] \
+                if len(strippedSuffixParts) == 2 \
+                else strippedSuffix
+
+            return fileNameParts[1], picoType
+
+        print('xxx: ', fileNameParts, starDetails)
+        return 'xx', 'xx'
+
+    # _________________________________________________________
+    def parseBatch(self, fileFullPaths):
+        """Parse iterable of full paths of picoDsts.
+
+           return picoDstColumns
+           """
+
+        columns = picoDstColumns()
+
+        folderIndices = {}
+        interned      = {}
+
+        # -- Local references for the inner loop
+        listFilePath  = columns.filePath
+        listFolderIdx = columns.folderIdx
+        listStream    = columns.stream
+        listPicoType  = columns.picoType
+        lengthSuffix  = self._lengthFileSuffix
+
+        for fileFullPath in fileFullPaths:
+
+            # -- identify start of "STAR naming conventions"
+            filePath = fileFullPath[fileFullPath.find("/Run")+1:]
+            folderPath, _, fileName = filePath.rpartition(os.path.sep)
+
+            # -- Get folder - parse it if new
+            try:
+                folderIdx, runnumberTag = folderIndices[folderPath]
+            except KeyError:
+                folderIdx, runnumberTag = folderIndices[folderPath] = self._addFolder(columns, folderPath)
+
+            # -- Path shorter than schema - fileName is part of the details
+            if runnumberTag is None:
+                typedPathKeys, folderStarDetails = columns._folders[folderIdx]
+                nTokensFolder = folderPath.count(os.path.sep) + 1 if folderPath else 0
+
+                key, keyType = typedPathKeys[nTokensFolder]
+                starDetails = dict(folderStarDetails)
+                starDetails[key] = keyType(fileName)
+                columns._extraDetails[len(listFilePath)] = (key, starDetails[key])
+
+                stream, picoType = self._parseFileName(fileName, starDetails)
+
+            # -- Fast path of _parseFileName
+            else:
+                idxRunnumber = fileName.rfind(runnumberTag) \
+                    if runnumberTag and fileName.startswith('st_') and '\n' not in fileName else -1
+
+                if idxRunnumber >= 3:
+                    stream = fileName[:idxRunnumber]
+
+                    strippedSuffix = fileName[idxRunnumber+len(runnumberTag)+1:-lengthSuffix]
+                    strippedSuffixParts = strippedSuffix.split('_')
+
+                    picoType = strippedSuffixParts[0] \
+                        if len(strippedSuffixParts) == 2 \
+                        else strippedSuffix
+                else:
+                    stream, picoType = self._parseFileName(fileName, columns._folders[folderIdx][1])
+
+            listFilePath.append(filePath)
+            listFolderIdx.append(folderIdx)
+            listStream.append(interned.setdefault(stream, stream))
+            listPicoType.append(interned.setdefault(picoType, picoType))
+
+        return columns
+
+    # _________________________________________________________
+    def _addFolder(self, columns, folderPath):
+        """Parse folder and add it to columns.
+
+           return index of folder and '_<runnumber>' to search for in fileName,
+           or '' if no fast path is possible, or None if the fileName is part
+           of the details.
+           """
+
+        typedPathKeys, folderStarDetails = self._parseFolder(folderPath)
+        folderIdx = columns._addFolder(typedPathKeys, folderStarDetails)
+
+        nTokensFolder = folderPath.count(os.path.sep) + 1 if folderPath else 0
+        if len(typedPathKeys) > nTokensFolder:
+            return folderIdx, None
+
+        runnumber = '{}'.format(folderStarDetails.get('runnumber', ''))
+        if runnumber.isdigit() or not runnumber:
+            return folderIdx, '_' + runnumber
+
+        return folderIdx, ''
+
+# ----------------------------------------------------------------------------------
+class picoDstColumns:
+    """STAR details of a list of picoDsts, stored in columns.
+
+       The details of the folder are dictionary encoded: every row holds
+       the index of its folder, the folder holds the details. Strings
+       are shared between rows, numbers are stored in arrays.
+       """
+
+    # _________________________________________________________
+    def __init__(self):
+        self.filePath  = []
+        self.folderIdx = array('l')
+        self.stream    = []
+        self.picoType  = []
+
+        self._folders      = []
+        self._extraDetails = {}
+
+    # _________________________________________________________
+    def __len__(self):
+        return len(self.filePath)
+
+    # _________________________________________________________
+    def _addFolder(self, typedPathKeys, folderStarDetails):
+        """Add parsed folder - return its index."""
+
+        self._folders.append((typedPathKeys, folderStarDetails))
+        return len(self._folders) - 1
+
+    # _________________________________________________________
+    def column(self, key):
+        """Get column of STAR details key.
+
+           Columns of NUMBER_KEYS are arrays, with -1 for missing values,
+           other columns are lists, with None for missing values.
+           """
+
+        if key == 'stream':
+            return self.stream
+        if key == 'picoType':
+            return self.picoType
+
+        # -- Column of folder keys
+        if key in NUMBER_KEYS:
+            folderValues = []
+            for typedPathKeys, folderStarDetails in self._folders:
+                try:
+                    folderValues.append(int(folderStarDetails[key]))
+                except (KeyError, TypeError, ValueError):
+                    folderValues.append(-1)
+            values = array('q', (folderValues[idx] for idx in self.folderIdx))
+        else:
+            folderValues = [folderStarDetails.get(key) for typedPathKeys, folderStarDetails in self._folders]
+            values = [folderValues[idx] for idx in self.folderIdx]
+
+        # -- Add details taken from fileName
+        for idx, (extraKey, extraValue) in self._extraDetails.items():
+            if extraKey != key:
+                continue
+
+            if key in NUMBER_KEYS:
+                try:
+                    extraValue = int(extraValue)
+                except ValueError:
+                    extraValue = -1
+
+            values[idx] = extraValue
+
+        return values
+
+    # _________________________________________________________
+    def columns(self):
+        """Get all columns as dict."""
+
+        columns = dict((key, self.column(key)) for key in STRING_KEYS + NUMBER_KEYS)
+        columns['filePath'] = self.filePath
+
+        return columns
+
+    # _________________________________________________________
+    def starDetails(self, idx):
+        """Get STAR details of row idx as dict - as in picoDst documents."""
+
+        starDetails = dict(self._folders[self.folderIdx[idx]][1])
+
+        if idx in self._extraDetails:
+            key, value = self._extraDetails[idx]
+            starDetails[key] = value
+
+        starDetails['stream']   = self.stream[idx]
+        starDetails['picoType'] = self.picoType[idx]
+
+        return starDetails
+
+# ----------------------------------------------------------------------------------
+
+# -- Registry of compiled parsers, keyed by (target, pathKeysSchema)
+_parserRegistry = {}
+
+# ____________________________________________________________________________
+def getPathParser(target = 'picoDst', pathKeysSchema = DEFAULT_PATH_KEYS_SCHEMA):
+    """Get parser for target and schema - compiled only once."""
+
+    try:
+        return _parserRegistry[(target, pathKeysSchema)]
+    except KeyError:
+        return _parserRegistry.setdefault((target, pathKeysSchema), picoDstPathParser(target, pathKeysSchema))
+
+# ____________________________________________________________________________
+def parseBatch(fileFullPaths, target = 'picoDst', pathKeysSchema = DEFAULT_PATH_KEYS_SCHEMA):
+    """Parse iterable of full paths of picoDsts - return picoDstColumns."""
+
+    return getPathParser(target, pathKeysSchema).parseBatch(fileFullPaths)
+
+# ____________________________________________________________________________
+def checkBatch(listPaths, target = 'picoDst', pathKeysSchema = DEFAULT_PATH_KEYS_SCHEMA):
+    """Check batch parsing against per-file parsing.
+
+       return number of paths with different results
+       """
+
+    parser  = picoDstPathParser(target, pathKeysSchema)
+    columns = parser.parseBatch(listPaths)
+    allColumns = columns.columns()
+
+    nDiffs = 0
+    for idx, fileFullPath in enumerate(listPaths):
+        filePath, starDetails = parser.parse(fileFullPath)
+
+        isSame = columns.filePath[idx] == filePath and columns.starDetails(idx) == starDetails
+        # -- Columns of NUMBER_KEYS hold numbers, -1 for missing values
+        for key in STRING_KEYS:
+            isSame = isSame and allColumns[key][idx] == starDetails.get(key)
+        for key in NUMBER_KEYS:
+            try:
+                value = int(starDetails[key])
+            except (KeyError, TypeError, ValueError):
+                value = -1
+            isSame = isSame and allColumns[key][idx] == value
+
+        if not isSame:
+            print('Batch parsing differs:', fileFullPath)
+            nDiffs += 1
+
+    return nDiffs
+
+# ____________________________________________________________________________
+def main():
+    """Check batch parsing, then benchmark per-file vs batch parsing."""
+
+    nFiles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    # -- Synthetic paths: 50 files per runnumber folder
+    listPaths = []
+    for idx in range(nFiles):
+        day, runIdx, fileIdx = 100 + idx // 5000 % 200, idx // 50 % 100, idx % 50
+        runnumber = 11000000 + day * 1000 + runIdx
+        listPaths.append('/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/{0}/{1}/'
+                         'st_physics_{1}_raw_{2}.picoDst.root'.format(day, runnumber, fileIdx))
+
+    # -- Check batch parsing - synthetic paths and special cases
+    listCheckPaths = listPaths[:10000] + \
+        ['/nersc/projects/starofl/picodsts/Run14/AuAu/200GeV/physics2/P15ic/100/15100001/'
+         'st_physics_adc_15100001_raw_1000001.picoDst.root',
+         '/nersc/projects/starofl/picodsts/Run14/AuAu/200GeV/physics2/P15ic/100/15100001/'
+         'st_mtd_15100001_raw_5500012.picoDst.root',
+         '/nersc/projects/starofl/picodsts/Run12/pp/200GeV/all/P12id/044/13044118/'
+         'st_physics_13044118_raw_2010001_hft.picoDst.root']
+    listShortPaths = ['/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/149/11149081/'
+                      'st_physics_11149081_raw_{0}.picoDst.root'.format(idx) for idx in range(3)]
+
+    nDiffs = checkBatch(listCheckPaths) + checkBatch(listShortPaths, pathKeysSchema=SHORT_PATH_KEYS_SCHEMA)
+    if nDiffs:
+        print('Batch parsing differs from per-file parsing for {0} files'.format(nDiffs))
+        return 1
+
+    print('Batch parsing matches per-file parsing')
+
+    # -- Per-file parsing - as done by the old _makePicoDstDoc without memo
+    parser = picoDstPathParser()
+    start = time.time()
+    for fileFullPath in listPaths:
+        parser._parseFolder.cache_clear()
+        parser.parse(fileFullPath)
+    timeUncached = time.time() - start
+
+    # -- Per-file parsing - memoised folders
+    parser = picoDstPathParser()
+    start = time.time()
+    for fileFullPath in listPaths:
+        parser.parse(fileFullPath)
+    timePerFile = time.time() - start
+
+    # -- Batch parsing
+    parser = picoDstPathParser()
+    start = time.time()
+    columns = parser.parseBatch(listPaths).columns()
+    timeBatch = time.time() - start
+
+    print('Parsed {0} files'.format(nFiles))
+    print('   per-file (no folder memo): {0:8.2f} s'.format(timeUncached))
+    print('   per-file:                  {0:8.2f} s'.format(timePerFile))
+    print('   batch (incl. columns):     {0:8.2f} s'.format(timeBatch))
+
+# ____________________________________________________________________________
+if __name__ == "__main__":
+    sys.exit(main())
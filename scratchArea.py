@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Quota bounded staging area in scratch space
+
+Files recalled from HPSS are kept in the scratch space until all their
+copies are pushed to XRD. Pushed files stay as a cache and are evicted
+least recently used, when space is needed.
+
+Several workers share the scratch space. Every worker keeps its files
+and the work folders of htar in its own folder (workDir), and the bytes
+it uses in a document of the Staging_Scratch collection, with a lease
+renewed by a heartbeat:
+
+{'_id': 'mc0205:12345',
+ 'nBytes': 13538711552,
+ 'nBytesWaiting': 0,
+ 'leaseExpires': 1461949200.0}
+
+The quota holds for all workers together. Space for a recall is reserved
+before the recall starts. If the quota is full, reserve() blocks until
+pushed files can be evicted - this is the backpressure on the recall
+from HPSS. Workers evict their pushed files, if other workers wait for
+space.
+
+Folders of workers whose lease expired are removed at start-up.
+"""
+
+import sys
+import os
+import time
+import socket
+import shutil
+import threading
+
+from collections import OrderedDict
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+SCRATCH_QUOTA = 10 * 1024**4
+
+WORKER_DIR_PREFIX    = '.sdms_'
+HTAR_WORK_DIR_PREFIX = '.htar_'
+
+SCRATCH_LEASE_TIME      = 600
+SCRATCH_UPDATE_INTERVAL = 10
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class scratchArea:
+    """Staging area in scratch space with byte quota and LRU eviction."""
+
+    # _________________________________________________________
+    def __init__(self, scratchDir, collScratch, quota = SCRATCH_QUOTA, leaseTime = SCRATCH_LEASE_TIME):
+        self._scratchDir  = scratchDir
+        self._collScratch = collScratch
+        self._quota       = quota
+        self._leaseTime   = leaseTime
+
+        self._workerId = '{0}:{1}'.format(socket.getfqdn().split('.')[0], os.getpid())
+        self.workDir   = os.path.join(scratchDir, WORKER_DIR_PREFIX + self._workerId)
+
+        self._lock = threading.Condition()
+
+        # -- Pushed files in LRU order: path -> size
+        self._pushedFiles  = OrderedDict()
+
+        # -- Files waiting for push: path -> [size, nPushes]
+        self._pendingFiles = {}
+
+        self._nBytesUsed     = 0
+        self._nBytesReserved = 0
+        self._nBytesWaiting  = 0
+
+        # -- Bytes used by other workers
+        self._nBytesOthers = 0
+
+        # -- Lease first - the folder is not removed by other workers starting up
+        self._update()
+        self._cleanUp()
+
+        os.makedirs(self.workDir, exist_ok=True)
+
+        self._stopHeartbeat = threading.Event()
+        self._heartbeat     = threading.Thread(target=self._renewLease, daemon=True)
+        self._heartbeat.start()
+
+    # _________________________________________________________
+    def _cleanUp(self):
+        """Remove folders of workers whose lease expired."""
+
+        liveWorkers = set(doc['_id'] for doc in self._collScratch.find({'leaseExpires': {'$gte': time.time()}},
+                                                                       {'_id': True}))
+        self._collScratch.delete_many({'leaseExpires': {'$lt': time.time()}})
+
+        try:
+            listDirs = os.listdir(self._scratchDir)
+        except OSError as e:
+            print('Error reading', self._scratchDir, e)
+            return
+
+        for dirName in listDirs:
+            if dirName.startswith(WORKER_DIR_PREFIX) and dirName[len(WORKER_DIR_PREFIX):] not in liveWorkers:
+                shutil.rmtree(os.path.join(self._scratchDir, dirName), ignore_errors=True)
+
+    # _________________________________________________________
+    def reserve(self, nBytes):
+        """Reserve space for recall - blocks until space is free.
+
+           If nothing can be freed anymore by any worker, the reservation
+           is granted over quota, to not block forever.
+           """
+
+        with self._lock:
+            while self._nBytesUsed + self._nBytesReserved + self._nBytesOthers + nBytes > self._quota:
+                if self._evict(self._nBytesUsed + self._nBytesReserved + self._nBytesOthers + nBytes - self._quota):
+                    continue
+
+                if not self._nBytesReserved and not self._pendingFiles and not self._nBytesOthers:
+                    print('Warning: scratch quota exceeded by reservation of {0:.1f} GB'.format(nBytes / 1024**3))
+                    break
+
+                # -- Wait for own files or for other workers - they see the bytes waiting
+                self._nBytesWaiting += nBytes
+                self._lock.wait(SCRATCH_UPDATE_INTERVAL)
+                self._nBytesWaiting -= nBytes
+
+            self._nBytesReserved += nBytes
+
+        self._update()
+
+    # _________________________________________________________
+    def release(self, nBytes):
+        """Release reserved space."""
+
+        with self._lock:
+            self._nBytesReserved -= nBytes
+            self._lock.notify_all()
+
+    # _________________________________________________________
+    def add(self, path, size, nPushes):
+        """Add file recalled to scratch space, to be pushed nPushes times."""
+
+        with self._lock:
+            self._remove(path)
+
+            if nPushes > 0:
+                self._pendingFiles[path] = [size, nPushes]
+            else:
+                self._pushedFiles[path] = size
+
+            self._nBytesUsed += size
+            self._lock.notify_all()
+
+    # _________________________________________________________
+    def setPushed(self, path):
+        """One push of file is finished - evictable after the last one."""
+
+        with self._lock:
+            if path not in self._pendingFiles:
+                return
+
+            self._pendingFiles[path][1] -= 1
+            if self._pendingFiles[path][1] > 0:
+                return
+
+            self._pushedFiles[path] = self._pendingFiles.pop(path)[0]
+            self._lock.notify_all()
+
+    # _________________________________________________________
+    def get(self, path):
+        """Check if file is in scratch space, mark it as recently used."""
+
+        with self._lock:
+            if path in self._pendingFiles:
+                return True
+
+            if path not in self._pushedFiles:
+                return False
+
+            self._pushedFiles.move_to_end(path)
+            return True
+
+    # _________________________________________________________
+    def close(self):
+        """Stop heartbeat, remove folder and document of this worker."""
+
+        self._stopHeartbeat.set()
+        self._heartbeat.join()
+
+        shutil.rmtree(self.workDir, ignore_errors=True)
+        self._collScratch.delete_one({'_id': self._workerId})
+
+    # _________________________________________________________
+    def _update(self):
+        """Store bytes used by this worker, renew its lease and get bytes used by other workers.
+
+           Pushed files are evicted, if other workers wait for space.
+           """
+
+        with self._lock:
+            nBytes        = self._nBytesUsed + self._nBytesReserved
+            nBytesWaiting = self._nBytesWaiting
+
+        self._collScratch.update_one({'_id': self._workerId},
+                                     {'$set': {'nBytes': nBytes, 'nBytesWaiting': nBytesWaiting,
+                                               'leaseExpires': time.time() + self._leaseTime}}, upsert=True)
+
+        nBytesOthers        = 0
+        nBytesWaitingOthers = 0
+        for doc in self._collScratch.find({'_id': {'$ne': self._workerId}, 'leaseExpires': {'$gte': time.time()}}):
+            nBytesOthers        += doc.get('nBytes', 0)
+            nBytesWaitingOthers += doc.get('nBytesWaiting', 0)
+
+        with self._lock:
+            self._nBytesOthers = nBytesOthers
+
+            nBytesOver = self._nBytesUsed + self._nBytesReserved + nBytesOthers + nBytesWaitingOthers - self._quota
+            if nBytesWaitingOthers and nBytesOver > 0:
+                self._evict(nBytesOver)
+
+            self._lock.notify_all()
+
+    # _________________________________________________________
+    def _renewLease(self):
+        """Heartbeat - update document of this worker."""
+
+        while not self._stopHeartbeat.wait(SCRATCH_UPDATE_INTERVAL):
+            try:
+                self._update()
+            except Exception as e:
+                print('Error updating scratch area:', e)
+
+    # _________________________________________________________
+    def _remove(self, path):
+        """Remove file from bookkeeping."""
+
+        if path in self._pushedFiles:
+            self._nBytesUsed -= self._pushedFiles.pop(path)
+        elif path in self._pendingFiles:
+            self._nBytesUsed -= self._pendingFiles.pop(path)[0]
+
+    # _________________________________________________________
+    def _evict(self, nBytes):
+        """Evict least recently used pushed files to free nBytes.
+
+           return True if anything was freed
+           """
+
+        nFreed = 0
+
+        while self._pushedFiles and nFreed < nBytes:
+            path, size = self._pushedFiles.popitem(last=False)
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            self._nBytesUsed -= size
+            nFreed += size
+
+        return nFreed > 0
@@ -26,6 +26,23 @@ each set can have the following parameters
  'day': 149,
  'runnumber': 11149081,
  'stream': 'st_physics_adc',
+
+Besides the sets, the staging file can have storage and recall parameters
+ 'storage': {'nCopies': 2}       (Number of copies on XRD, default 1)
+ 'recall': {'tapeInfo': 'hsi'}   (Source of tape order, see hpssRecall, default 'hsi')
+
+The sets are compiled into one minimal query per target and stageTarget:
+redundant sets are dropped, sets differing in one item are merged.
+With --dry-run only the number of files, size, tar files and required
+capacity are estimated.
+
+Only changes to the last applied request are written to the stageMarker
+fields. The applied request per target and stageTarget is kept in the
+Staging_Requests collection.
+
+Files to be staged are added to the staging queue (see stagingQueue),
+stage() works on the queue until it is drained. With --worker only the
+queue is worked on - several workers can run on different nodes.
 """
 
 import sys
@@ -38,13 +55,24 @@ import time
 import socket
 import datetime
 import shlex, subprocess
-
-from mongoUtil import mongoDbUtil
+import shutil
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mongoUtil import mongoDbUtil, bulkWriteBuffer
+from hpssRecall import recallScheduler, getTapeInfo, TAPE_INFO_SOURCES, N_TAPE_DRIVES, N_ITEMS_PER_RECALL
+from xrdTransfer import xrdTransfer, statFile
+from xrdPlacement import xrdPlacement, N_COPIES
+from scratchArea import scratchArea, SCRATCH_QUOTA, HTAR_WORK_DIR_PREFIX
+from stagingQueue import stagingQueue
 import pymongo
 
 from pymongo import results
 from pymongo import errors
 from pymongo import bulk
+from pymongo import UpdateOne
 
 from pprint import pprint
 
@@ -53,6 +81,23 @@ from pprint import pprint
 
 SCRATCH_SPACE = "/scratch"
 
+# -- Extract whole tar file, if more than this fraction of
+#    its files or its bytes is requested
+TAR_FULL_EXTRACT_FILE_FRACTION = 0.25
+TAR_FULL_EXTRACT_BYTE_FRACTION = 0.5
+
+N_QUERY_CHUNK = 1000
+
+# -- Files to be staged are enqueued in chunks of at least this size - tar files are not split
+N_STAGE_CHUNK = 10000
+
+# -- Fields of HPSS documents needed for staging
+STAGE_DOC_PROJECTION = {'_id': False, 'filePath': True, 'fileFullPath': True, 'fileSize': True,
+                        'isInTarFile': True, 'fileFullPathTar': True, 'target': True}
+
+# -- XRootD namespace of the base folders
+XRD_NAMESPACE = '/star'
+
 ##############################################
 
 # -- Check for a proper Python Version
@@ -65,9 +110,19 @@ class stagerSDMS:
     """ Stager to from HPSS at NERSC"""
 
     # _________________________________________________________
-    def __init__(self, stageingFile, scratchSpace):
+    def __init__(self, dbUtil, stageingFile, scratchSpace, nTapeDrives = N_TAPE_DRIVES,
+                 tarFileFraction = TAR_FULL_EXTRACT_FILE_FRACTION, tarByteFraction = TAR_FULL_EXTRACT_BYTE_FRACTION,
+                 scratchQuota = SCRATCH_QUOTA, dryRun = False, tapeInfo = None):
         self._stageingFile = stageingFile
         self._scratchSpace = scratchSpace
+        self._nTapeDrives  = nTapeDrives
+
+        # -- Scratch area and staging queue - not touched by a dry run
+        self._scratch = None
+        self._queue   = None
+
+        self._tarFileFraction = tarFileFraction
+        self._tarByteFraction = tarByteFraction
 
         self._listOfStageTargets = ['XRD', 'Disk']
 
@@ -82,10 +137,31 @@ class stagerSDMS:
                           'picoDstJet': 'PicoDstsJets',
                           'aschmah': 'ASchmah'}
 
+        # -- base folders on XRD
+        self._baseFolders = {'picoDst': 'picodsts',
+                             'picoDstJet': 'picodsts/JetPicoDsts',
+                             'aschmah': 'picodsts/aschmah'}
+
+        # -- transfers to XRD, running while files are recalled
+        self._transfers     = None
+        self._placement     = None
+        self._placementLock = threading.Lock()
+
+        # -- queue items waiting for their transfers
+        self._pendingItems = {}
+        self._pendingLock  = threading.Lock()
+
         self._readStagingFile()
 
+        # -- Source of tape order of recalls - from staging file, if not given
+        self._tapeInfo = tapeInfo if tapeInfo else getTapeInfo(self._tapeInfoSource)
+
         self._addCollections(dbUtil)
 
+        if not dryRun:
+            self._scratch = scratchArea(scratchSpace, self._collStageScratch, scratchQuota)
+            self._queue   = stagingQueue(self._collStageQueue)
+
     # _________________________________________________________
     def _readStagingFile(self):
         """Read in staging file."""
@@ -99,10 +175,24 @@ class stagerSDMS:
                 print('Error reading staging file: no "sets" found')
                 sys.exit(-1)
 
+            self._nCopies = setList.get('storage', {}).get('nCopies', N_COPIES)
+            self._tapeInfoSource = setList.get('recall', {}).get('tapeInfo', 'hsi')
+            if self._tapeInfoSource not in TAPE_INFO_SOURCES:
+                print('Error reading staging file: Unknown "tapeInfo"', self._tapeInfoSource)
+                sys.exit(-1)
+
     # _________________________________________________________
     def _addCollections(self, dbUtil):
         """Get collections from mongoDB."""
 
+        self._collHpssFiles       = dbUtil.getCollection('HPSS_Files')
+        self._collHpssCrawlEpochs = dbUtil.getCollection('HPSS_CrawlEpochs')
+        self._collStageRequests   = dbUtil.getCollection('Staging_Requests')
+        self._collDataServers     = dbUtil.getCollection('XRD_DataServers')
+        self._collXrdTransfers    = dbUtil.getCollection('XRD_Transfers')
+        self._collStageQueue      = dbUtil.getCollection('Staging_Queue')
+        self._collStageScratch    = dbUtil.getCollection('Staging_Scratch')
+
         self._collsHPSS = dict.fromkeys(self._listOfTargets)
         for target in self._listOfTargets:
             self._collsHPSS[target] = dbUtil.getCollection('HPSS_' + self._baseColl[target])
@@ -116,31 +206,137 @@ class stagerSDMS:
 
     # _________________________________________________________
     def markFilesToBeStaged(self):
-        """Mark files to be staged in staging file."""
+        """Mark files to be staged in staging file.
 
-        self._resetAllStagingMarks()
+           Only the differences to the last applied request are updated.
+           An unchanged request is skipped, unless HPSS has been crawled
+           since - then only new files are marked.
+           """
 
+        requestQueries = self.compileRequest()
+
+        # -- Get state of last HPSS crawl
+        lastEpoch  = self._collHpssCrawlEpochs.find_one(sort=[('_id', pymongo.DESCENDING)])
+        crawlState = [lastEpoch['_id'], lastEpoch['finished']] if lastEpoch else None
+
+        for target in self._listOfTargets:
+            for stageTarget in self._listOfStageTargets:
+                self._updateStagingMarks(target, stageTarget, requestQueries.get((target, stageTarget), []), crawlState)
+
+    # _________________________________________________________
+    def compileRequest(self):
+        """Compile sets of staging file into one minimal query per target and stageTarget.
+
+           return dict of (target, stageTarget) -> list of queries
+           """
+
+        requestQueries = {}
         for stageSet in self._sets:
+            stageSet = dict(stageSet)
+            target, stageTarget = stageSet.get('target'), stageSet.get('stageTarget')
             if not self._prepareSet(stageSet):
                 continue
-            self._coll.update_many(stageSet, {'$set': {self._targetField: True}})
+            requestQueries.setdefault((target, stageTarget), []).append(stageSet)
+
+        for key, queries in requestQueries.items():
+            requestQueries[key] = mergeQueries(queries)
+
+        return requestQueries
 
     # _________________________________________________________
-    def _resetAllStagingMarks(self):
-        """Reset all staging marks."""
+    def estimateRequest(self):
+        """Estimate files, bytes, tar files and capacity needed for request.
+
+           Uses server side aggregation only - nothing is written.
+
+           return dict of (target, stageTarget) -> estimate
+           """
+
+        # -- Free space on active XRD data servers
+        freeSpaceXRD = sum(doc.get('freeSpace', 0) for doc in self._collDataServers.find({'stateActive': True},
+                                                                                          {'freeSpace': True}))
+
+        estimates = {}
+        for (target, stageTarget), queries in sorted(self.compileRequest().items()):
+            pipeline = [{'$match': makeRequestFilter(queries)},
+                        {'$group': {'_id': '$fileFullPathTar',
+                                    'nFiles': {'$sum': 1}, 'nBytes': {'$sum': '$fileSize'}}},
+                        {'$group': {'_id': None,
+                                    'nFiles': {'$sum': '$nFiles'}, 'nBytes': {'$sum': '$nBytes'},
+                                    'nTars': {'$sum': {'$cond': [{'$eq': ['$_id', None]}, 0, 1]}}}}]
+            # -- No files match request - zero estimate
+            estimate = next(self._collsHPSS[target].aggregate(pipeline), None)
+            if not estimate:
+                estimate = {'nFiles': 0, 'nBytes': 0, 'nTars': 0}
+            estimate.pop('_id', None)
+
+            # -- Bytes already on stageTarget
+            pipeline = [{'$match': {'storage.location': stageTarget, 'target': target}},
+                        {'$group': {'_id': None, 'nBytes': {'$sum': '$fileSize'}}}]
+            staged = next(self._collsStage[target][stageTarget].aggregate(pipeline), None)
+            estimate['nBytesStaged'] = staged['nBytes'] if staged else 0
+
+            print('For {0} on {1}: {2} queries'.format(target, stageTarget, len(queries)))
+            print('   Files: {0}, size: {1:.1f} GB, tar files: {2}'.format(estimate['nFiles'], estimate['nBytes'] / 1024**3,
+                                                                           estimate['nTars']))
+            print('   Capacity required: {0:.1f} GB, currently staged: {1:.1f} GB'.format(self._nCopies * estimate['nBytes'] / 1024**3,
+                                                                                        estimate['nBytesStaged'] / 1024**3))
+            if stageTarget == 'XRD':
+                print('   Free space on active XRD servers: {0:.1f} GB'.format(freeSpaceXRD / 1024**3))
+
+            estimates[(target, stageTarget)] = estimate
+
+        return estimates
 
-        for target, collections in self._collStage.items():
-            for stageTarget, coll in collections.items():
-                targetField = 'staging.stageMarker{0}'.format(stageTarget)
+    # _________________________________________________________
+    def _updateStagingMarks(self, target, stageTarget, queries, crawlState):
+        """Update staging marks of target on stageTarget to the queries of the request.
+
+           Documents gained are marked, documents lost are unmarked. The
+           applied request is stored in Staging_Requests.
+           """
+
+        requestId   = '{0}_{1}'.format(target, stageTarget)
+        lastRequest = self._collStageRequests.find_one({'_id': requestId})
+
+        # -- Query keys contain dots, store queries as json string
+        request     = json.dumps(queries, sort_keys=True)
+        lastRequest = lastRequest if lastRequest else {'request': json.dumps([]), 'crawlState': None}
+
+        if request == lastRequest['request'] and (not queries or crawlState == lastRequest['crawlState']):
+            return
+
+        coll        = self._collsHPSS[target]
+        targetField = 'staging.stageMarker{0}'.format(stageTarget)
+
+        # -- Mark documents gained, which are not marked yet
+        nGained = 0
+        if queries:
+            gainedFilter = makeRequestFilter(queries)
+            gainedFilter[targetField] = {'$ne': True}
+            nGained = coll.update_many(gainedFilter, {'$set': {targetField: True}}).modified_count
+
+        # -- Unmark documents lost
+        nLost = 0
+        if request != lastRequest['request']:
+            lostFilter = {targetField: True}
+            if queries:
+                lostFilter['$nor'] = queries
+            nLost = coll.update_many(lostFilter, {'$set': {targetField: False}}).modified_count
 
-                coll.update_many({}, {'$set': {targetField: False}})
+        self._collStageRequests.replace_one({'_id': requestId},
+                                            {'request': request, 'crawlState': crawlState,
+                                             'applied': datetime.datetime.today().strftime('%Y-%m-%d')},
+                                            upsert=True)
+
+        print('For {0} on {1}: {2} files marked, {3} files unmarked'.format(target, stageTarget, nGained, nLost))
 
     # _________________________________________________________
     def listOfFilesToBeStaged(self):
         """Returns a list of all files to be staged"""
 
-        for target, collections in self._collStage.items():
-            for stageTarget, coll in collections.items():
+        for target, coll in self._collsHPSS.items():
+            for stageTarget in self._listOfStageTargets:
                 targetField = 'staging.stageMarker{0}'.format(stageTarget)
                 nStaged = coll.find({targetField: True}).count()
 
@@ -170,7 +366,7 @@ class stagerSDMS:
             if target not in  self._listOfTargets:
                 print('Error reading staging file: Unknown "target"', target)
                 return False
-            self._coll = self._collsStage[target][stageTarget]
+            self._coll = self._collsHPSS[target]
 
         except:
             print('Error reading staging file: no "target" found in set' , stageSet)
@@ -182,7 +378,7 @@ class stagerSDMS:
         del(stageSet['stageTarget'])
 
         # -- Check if query items are correct
-        for key, value in stageSet.items():
+        for key, value in list(stageSet.items()):
             if "starDetails." in key:
                 continue
             if key not in self._listOfQueryItems:
@@ -196,7 +392,7 @@ class stagerSDMS:
 
     # _________________________________________________________
     def prepareListOfFilesToBeStaged(self, stageTarget):
-        """Check for files to be staged"""
+        """Check for files to be staged and add them to the staging queue"""
 
         if stageTarget not in  self._listOfStageTargets:
             return False
@@ -206,77 +402,635 @@ class stagerSDMS:
         # -- Loop over targets
         for target in self._listOfTargets:
 
-            # -- Get all files to be staged
-            #   ... FIX query
-            hpssDocs = self._collsHPSS[target].find({'dataClass': target, stageField: True})])
-            docsSetHPSS = set([item['filePath'] for item in hpssDocs])
+            collStage = self._collsStage[target][stageTarget]
+
+            # -- Stream files to be staged and files on stageing Target, both sorted by filePath
+            hpssDocs   = self._collsHPSS[target].find({'target': target, stageField: True},
+                                                      STAGE_DOC_PROJECTION).sort('filePath', pymongo.ASCENDING)
+            stagedDocs = collStage.find({'storage.location': stageTarget, 'target': target},
+                                        {'_id': False, 'filePath': True}).sort('filePath', pymongo.ASCENDING)
 
-            # -- Get all files on stageing Target
-            stagedDocs = list(self._collsXRDNew[target].find({'storage.location': stageTarget,
-                                                      'dataClass': target}))
-            docsSetStaged = set([item['filePath'] for item in stagedDocs])
+            # -- Mark Documents as to be unStaged
+            #    -> use other clear script to explictly remove
+            unStageWriter = bulkWriteBuffer(collStage)
 
-            # -- Document to be staged
-            docsToStage  = docsSetHPSS - docsSetStaged
+            # -- Files not in tar files are enqueued in chunks
+            chunkToStage = []
+            nToStage     = 0
+            nItems       = 0
 
-            # -- Documents to be removed from stageTarget
-            docsToRemove = docsSetStaged - docsSetHPSS
+            for hpssDoc, stagedDoc in mergeJoinByFilePath(hpssDocs, stagedDocs):
+                if not stagedDoc:
+                    if hpssDoc['isInTarFile']:
+                        continue
 
-            # -- Mark Documents as to be unStaged
-            self._collsStage[target][stageTarget].update_many({'filePath' : '$in' : docsToRemove},
-                                                              { '$set': {'unStageFlag': True} })
+                    chunkToStage.append(hpssDoc)
+                    nToStage += 1
+
+                    if len(chunkToStage) >= N_STAGE_CHUNK:
+                        nItems += self._enqueueHPSSFiles(chunkToStage, stageTarget, nItems)
+                        chunkToStage = []
 
+                elif not hpssDoc:
+                    unStageWriter.add(UpdateOne({'filePath': stagedDoc['filePath']}, {'$set': {'unStageFlag': True}}))
 
-            # -- Make list of documents to be removed
-            mark collection files in staged collection as  to be removed
-            -> use other clear script to explictly remove
+            nItems += self._enqueueHPSSFiles(chunkToStage, stageTarget, nItems)
 
-            listToStageFromHPSS = []
+            # -- Members of tar files are not adjacent in filePath order - stream them by tar file,
+            #    a chunk ends only between tar files
+            tarDocs = self._collsHPSS[target].find({'target': target, stageField: True, 'isInTarFile': True},
+                                                   STAGE_DOC_PROJECTION).sort('fileFullPathTar', pymongo.ASCENDING)
 
-            #            get files  which are not in tar file
-            #                -> make list of files to be stage
-            #                    - get files from HPSS to staging area
-            #- use hpss tape ordering
+            chunkToStage = []
+            for hpssDoc in tarDocs:
+                if len(chunkToStage) >= N_STAGE_CHUNK and hpssDoc['fileFullPathTar'] != chunkToStage[-1]['fileFullPathTar']:
+                    chunkToStage = self._getNotStaged(collStage, stageTarget, target, chunkToStage)
+                    nToStage += len(chunkToStage)
+                    nItems   += self._enqueueHPSSFiles(chunkToStage, stageTarget, nItems)
+                    chunkToStage = []
 
+                chunkToStage.append(hpssDoc)
 
-            #get list file in tar balls  -> sort by tar file name
-            #            -> disti   nct -> via set
+            chunkToStage = self._getNotStaged(collStage, stageTarget, target, chunkToStage)
+            nToStage += len(chunkToStage)
+            nItems   += self._enqueueHPSSFiles(chunkToStage, stageTarget, nItems)
+            unStageWriter.flush()
 
-#    loop over tarballs and get nFiles per tar ball
-#    if nFiles is larger then 25%
-#        (get all files from Tarball into stageingArea)
-#        add tar ball to stage list -> (use hpss tapeordering on it)
+            print('For {0} on {1}: {2} files to be staged, {3} files to be unstaged'.format(target, stageTarget,
+                                                                                          nToStage,
+                                                                                          unStageWriter.nOps))
 
+        return True
+
+    #  ____________________________________________________________________________
+    def _getNotStaged(self, collStage, stageTarget, target, listDocs):
+        """Get documents of list not yet on stageTarget - looked up in chunks of $in queries."""
 
-            self._stageHPSSFiles(listToStageFromHPSS)
+        stagedPaths = set()
+        listPaths = [doc['filePath'] for doc in listDocs]
+        for idx in range(0, len(listPaths), N_QUERY_CHUNK):
+            stagedPaths.update(doc['filePath'] for doc in
+                               collStage.find({'storage.location': stageTarget, 'target': target,
+                                               'filePath': {'$in': listPaths[idx:idx+N_QUERY_CHUNK]}},
+                                              {'_id': False, 'filePath': True}))
+
+        return [doc for doc in listDocs if doc['filePath'] not in stagedPaths]
 
     #  ____________________________________________________________________________
-    def _stageHPSSFiles(self, stageList):
-        """ Stage list of files from HPSS on to scratch space"""
+    def _enqueueHPSSFiles(self, stageList, stageTarget, orderOffset = 0):
+        """ Add list of files to be staged from HPSS to the staging queue
+
+            Recall items are ordered by tape, see hpssRecall. The tape order
+            starts at orderOffset, so that later chunks are recalled after
+            earlier ones.
+
+            return number of recall items
+            """
+
+        listItems = self._makeRecallItems(stageList)
+        if not listItems:
+            return 0
+
+        self._planTarExtraction([item for item in listItems if item['isTarFile']])
+
+        scheduler = recallScheduler(self._tapeInfo)
+        scheduler.reportPlan(scheduler.makePlan(listItems))
+
+        for item in listItems:
+            item['tapeOrder'] += orderOffset
+
+        self._queue.enqueue(listItems, stageTarget)
+
+        return len(listItems)
+
+    #  ____________________________________________________________________________
+    def _makeRecallItems(self, stageList):
+        """Make recall items - one per file not in tar file, one per tar file."""
+
+        listItems = []
+        tarItems  = {}
+
+        for doc in stageList:
+            if not doc['isInTarFile']:
+                listItems.append({'hpssPath': doc['fileFullPath'], 'fileSize': doc['fileSize'],
+                                  'isTarFile': False, 'docs': [doc]})
+                continue
+
+            if doc['fileFullPathTar'] not in tarItems:
+                tarItems[doc['fileFullPathTar']] = {'hpssPath': doc['fileFullPathTar'], 'fileSize': 0,
+                                                    'isTarFile': True, 'docs': []}
+
+            tarItems[doc['fileFullPathTar']]['fileSize'] += doc['fileSize']
+            tarItems[doc['fileFullPathTar']]['docs'].append(doc)
+
+        return listItems + list(tarItems.values())
+
+    #  ____________________________________________________________________________
+    def _planTarExtraction(self, listTarItems, report = True):
+        """Decide for every tar file between whole and member list extraction.
+
+           A whole tar file is extracted if the requested fraction of its
+           files or of its bytes is above the thresholds, otherwise only
+           the requested members are extracted. Sets 'extractAll', and
+           'fileSize' to the bytes to be read from tape.
+
+           Planned again for claimed items, members may have been added.
+           """
+
+        # -- Get number of files and size of tar files
+        tarInfo = {}
+        listTarPaths = [item['hpssPath'] for item in listTarItems]
+        for idx in range(0, len(listTarPaths), N_QUERY_CHUNK):
+            for doc in self._collHpssFiles.find({'fileFullPath': {'$in': listTarPaths[idx:idx+N_QUERY_CHUNK]}},
+                                                {'fileFullPath': True, 'fileSize': True, 'filesInTar': True}):
+                tarInfo[doc['fileFullPath']] = doc
+
+        nAll = 0
+        for item in listTarItems:
+            item['extractAll'] = False
+            item['fileSize']   = sum(doc['fileSize'] for doc in item['docs'])
+
+            tarDoc = tarInfo.get(item['hpssPath'])
+            if not tarDoc or not tarDoc.get('filesInTar') or not tarDoc['fileSize']:
+                continue
+
+            fileFraction = len(item['docs']) / tarDoc['filesInTar']
+            byteFraction = item['fileSize'] / tarDoc['fileSize']
+
+            if fileFraction > self._tarFileFraction or byteFraction > self._tarByteFraction:
+                item['extractAll'] = True
+                item['fileSize']   = tarDoc['fileSize']
+                nAll += 1
+
+        if not report:
+            return
+
+        print('Tar files to stage: {0} - whole extraction: {1}, member extraction: {2}'.format(len(listTarItems),
+                                                                                              nAll, len(listTarItems) - nAll))
+
+    #  ____________________________________________________________________________
+    def _getExtractionCommand(self, item):
+        """Get htar command line for tar item - one call per tar file."""
+
+        if item['extractAll']:
+            return ['htar', '-xf', item['hpssPath']]
+
+        return ['htar', '-xf', item['hpssPath']] + [doc['fileFullPath'] for doc in item['docs']]
+
+    #  ____________________________________________________________________________
+    def _getScratchPath(self, item, doc):
+        """Get path of file in scratch space.
+
+           Files for XRD are kept in the folder of this worker, for Disk
+           the scratch space is the staging location.
+           """
+
+        if item['stageTarget'] == 'XRD':
+            return os.path.join(self._scratch.workDir, doc['filePath'])
+
+        return os.path.join(self._scratchSpace, doc['filePath'])
+
+    #  ____________________________________________________________________________
+    def _isInScratch(self, item):
+        """Check if all files of item are still in the scratch space."""
+
+        return all(self._scratch.get(self._getScratchPath(item, doc)) and os.path.isfile(self._getScratchPath(item, doc))
+                   for doc in item['docs'])
+
+    #  ____________________________________________________________________________
+    def _recallWorker(self):
+        """Claim batches of requested items in tape order and recall them.
+
+           Items for XRD are only recalled, if transfers to XRD are running.
+           """
+
+        tapeVolume   = None
+        stageTargets = None if self._transfers else [stageTarget for stageTarget in self._listOfStageTargets
+                                                     if stageTarget != 'XRD']
+
+        while True:
+            batch = self._queue.claimBatch('requested', N_ITEMS_PER_RECALL, tapeVolume, stageTargets)
+            if not batch:
+                return
+
+            tapeVolume = batch[0]['tapeVolume']
+
+            for item in self._recallFromHPSS(batch):
+                print('Error staging from HPSS:', item['hpssPath'])
+                self._queue.release(item, 'recall from HPSS failed')
+
+    #  ____________________________________________________________________________
+    def _recallFromHPSS(self, batch):
+        """Recall batch of items in tape order from HPSS.
+
+           Items still in the scratch space are not recalled again. Waits
+           for space in the scratch area before the recall.
+
+           return list of failed items
+           """
+
+        listInScratch = [item for item in batch if self._isInScratch(item)]
+        if listInScratch:
+            inScratch = set(id(item) for item in listInScratch)
+            batch = [item for item in batch if id(item) not in inScratch]
+            self._onRecalled(listInScratch)
+
+        self._planTarExtraction([item for item in batch if item['isTarFile']], report=False)
+
+        nBytes = sum(item['fileSize'] for item in batch)
+        self._scratch.reserve(nBytes)
+
+        try:
+            listFailed = []
+
+            listFiles = [item for item in batch if not item['isTarFile']]
+            if listFiles:
+                listFailed.extend(self._getFiles(listFiles))
 
-        foo = "dd"
-        #-> tape ordering
-        #-> stage files ->
+            for item in batch:
+                if item['isTarFile'] and not self._extractTarFile(item):
+                    listFailed.append(item)
+
+            failedIds = set(id(item) for item in listFailed)
+            self._onRecalled([item for item in batch if id(item) not in failedIds])
+
+        finally:
+            self._scratch.release(nBytes)
+
+        return listFailed
+
+    #  ____________________________________________________________________________
+    def _onRecalled(self, listItems):
+        """Move recalled items on in the queue and push their files to XRD.
+
+           For stageTarget Disk the scratch space is the staging location,
+           the items are done and not managed by the scratch area.
+           """
+
+        listTransfers = []
+
+        for item in listItems:
+            if item['stageTarget'] != 'XRD':
+                self._queue.advance(item, 'verified')
+                continue
+
+            self._queue.advance(item, 'recalled', keep=True)
+
+            nTransfers = 0
+            with self._placementLock:
+                for doc in item['docs']:
+                    doc['nodes'] = self._placement.place(doc)
+                    if len(doc['nodes']) < self._nCopies:
+                        print('Error staging to XRD: no space for {0} of {1} copies of {2}'.format(self._nCopies - len(doc['nodes']),
+                                                                                               self._nCopies, doc['filePath']))
+
+                    self._scratch.add(self._getScratchPath(item, doc), doc['fileSize'], len(doc['nodes']))
+
+                    for nodeName in doc['nodes']:
+                        listTransfers.append({'target': doc['target'], 'filePath': doc['filePath'],
+                                              'source': self._getScratchPath(item, doc),
+                                              'destination': os.path.join(XRD_NAMESPACE, self._baseFolders[doc['target']],
+                                                                          doc['filePath']),
+                                              'nodeName': nodeName, 'queueId': item['_id']})
+                    nTransfers += len(doc['nodes'])
+
+            if not nTransfers:
+                self._queue.release(item, 'no space on XRD')
+                continue
+
+            with self._pendingLock:
+                self._pendingItems[item['_id']] = {'item': item, 'nTransfers': nTransfers, 'nFailed': 0}
+
+        if listTransfers:
+            self._transfers.add(listTransfers)
+
+    #  ____________________________________________________________________________
+    def _onTransferDone(self, transfer, isDone):
+        """Transfer finished or failed - file can be evicted after its last transfer,
+           queue item is transferred after the last transfer of all its files."""
+
+        self._scratch.setPushed(transfer['source'])
+
+        with self._pendingLock:
+            pending = self._pendingItems[transfer['queueId']]
+            pending['nTransfers'] -= 1
+            if not isDone:
+                pending['nFailed'] += 1
+
+            if pending['nTransfers'] > 0:
+                return
+
+            del(self._pendingItems[transfer['queueId']])
+
+        if pending['nFailed']:
+            self._queue.release(pending['item'], '{0} transfers to XRD failed'.format(pending['nFailed']))
+        else:
+            self._queue.setNodes(pending['item'])
+            self._queue.advance(pending['item'], 'transferred')
+
+    #  ____________________________________________________________________________
+    def _pushRecalled(self):
+        """Push items recalled before to XRD - recall them again, if not in scratch space anymore."""
+
+        if not self._transfers:
+            return
+
+        seenIds = set()
+
+        while True:
+            batch = self._queue.claimBatch('recalled', N_ITEMS_PER_RECALL)
+
+            # -- Stop, once items given back come around again
+            listNew = [item for item in batch if item['_id'] not in seenIds]
+            for item in batch:
+                if item['_id'] in seenIds:
+                    self._queue.release(item, undoAttempt=True)
+            if not listNew:
+                return
+
+            seenIds.update(item['_id'] for item in listNew)
+
+            for item in listNew:
+                if not self._isInScratch(item):
+                    self._queue.advance(item, 'requested')
+
+            self._onRecalled([item for item in listNew if item['state'] == 'recalled'])
+
+    #  ____________________________________________________________________________
+    def _verifyTransferred(self):
+        """Verify transferred items - all copies on XRD with the right size.
+
+           Items failing the verification, or with files without any copy,
+           are pushed again.
+           """
+
+        while True:
+            batch = self._queue.claimBatch('transferred', N_ITEMS_PER_RECALL)
+            if not batch:
+                return
+
+            for item in batch:
+                isVerified = all(doc.get('nodes') for doc in item['docs']) and all(statFile(nodeName, os.path.join(XRD_NAMESPACE, self._baseFolders[doc['target']],
+                                                                 doc['filePath'])) == doc['fileSize']
+                                 for doc in item['docs'] for nodeName in doc.get('nodes', []))
+
+                self._queue.advance(item, 'verified' if isVerified else 'recalled')
+
+    #  ____________________________________________________________________________
+    def _getFiles(self, listItems):
+        """Get files not in tar files from HPSS - one hsi call for all.
+
+           return list of failed items
+           """
+
+        listCmds = []
+        for item in listItems:
+            scratchPath = self._getScratchPath(item, item['docs'][0])
+            os.makedirs(os.path.dirname(scratchPath), exist_ok=True)
+            listCmds.append('get {0} : {1}'.format(scratchPath, item['hpssPath']))
+
+        p = subprocess.Popen(['hsi', '-q', '; '.join(listCmds)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        p.communicate()
+
+        listFailed = []
+        for item in listItems:
+            scratchPath = self._getScratchPath(item, item['docs'][0])
+            if not os.path.isfile(scratchPath) or os.path.getsize(scratchPath) != item['fileSize']:
+                listFailed.append(item)
+
+        return listFailed
+
+    #  ____________________________________________________________________________
+    def _extractTarFile(self, item):
+        """Extract files of a tar file from HPSS to scratch space.
+
+           Members are extracted in a work folder and the requested
+           members are moved into place.
+           """
+
+        workDir = tempfile.mkdtemp(prefix=HTAR_WORK_DIR_PREFIX, dir=self._scratch.workDir)
+
+        try:
+            p = subprocess.Popen(self._getExtractionCommand(item), cwd=workDir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            p.communicate()
+
+            if p.returncode != 0:
+                print('Error extracting tar file:', item['hpssPath'])
+                return False
+
+            for doc in item['docs']:
+                os.renames(os.path.join(workDir, doc['fileFullPath'].lstrip('/')), self._getScratchPath(item, doc))
+
+        except OSError as e:
+            print('Error extracting tar file:', item['hpssPath'], e)
+            return False
+
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+        return True
+
+    # ____________________________________________________________________________
+    def _startTransfers(self):
+        """Start transfers to XRD - nCopies of each file are placed on the active data servers."""
+
+        self._placement = xrdPlacement(self._collDataServers, self._nCopies)
+        if not self._placement.getNodes():
+            print('Error staging to XRD: no active data servers with free space - items for XRD are not recalled')
+            return
+
+        self._transfers = xrdTransfer(self._collXrdTransfers, onDone=self._onTransferDone)
+        self._transfers.start()
 
     # ____________________________________________________________________________
     def stage(self):
-        """Stage all files from stageing area to staging location"""
+        """Stage all files from stageing area to staging location
+
+           Works on the staging queue until it is drained - several workers
+           on different nodes can run in parallel. Items are recalled with
+           one thread per tape drive and pushed to XRD while they are
+           recalled. Items recalled before are pushed, transferred items
+           are verified. Transferred files stay in the scratch area until
+           they are evicted or the worker is done.
+           """
+
+        # -- No queue and scratch area in a dry run
+        if not self._queue:
+            print('Dry run - nothing is staged')
+            return
+
+        self._startTransfers()
+
+        # -- Push items recalled before, e.g. by dead workers
+        self._pushRecalled()
+
+        # -- Recall requested items, one thread per tape drive
+        with ThreadPoolExecutor(max_workers=self._nTapeDrives) as executor:
+            for future in [executor.submit(self._recallWorker) for idx in range(self._nTapeDrives)]:
+                future.result()
+
+        if self._transfers:
+            self._transfers.finish()
+            self._transfers = None
+
+        self._verifyTransferred()
+
+        self._queue.printSummary()
+        self._queue.close()
+        self._scratch.close()
+
+# ____________________________________________________________________________
+def _queryValues(value):
+    """Normalise query value - a set of allowed values, or a json string for operators."""
+
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+
+    if isinstance(value, list):
+        return frozenset(json.dumps(item, sort_keys=True) for item in value)
+
+    return frozenset([json.dumps(value, sort_keys=True)])
+
+# ____________________________________________________________________________
+def _containsQuery(general, specific):
+    """Check if all documents matched by specific are matched by general."""
+
+    for key, values in general.items():
+        if key not in specific:
+            return False
+        if values == specific[key]:
+            continue
+        if not isinstance(values, frozenset) or not isinstance(specific[key], frozenset) \
+           or not specific[key] <= values:
+            return False
+
+    return True
+
+# ____________________________________________________________________________
+def mergeQueries(listQueries):
+    """Merge list of queries into a minimal list for a $or query.
+
+       Lists as values mean any of the values. Queries contained in a more
+       general query are dropped, queries which differ only in the values
+       of one key are merged into an $in.
+       """
+
+    queries = [dict((key, _queryValues(value)) for key, value in query.items()) for query in listQueries]
+
+    merged = True
+    while merged:
+        merged = False
+
+        # -- Drop redundant queries
+        reduced = []
+        for idx, query in enumerate(queries):
+            if any(_containsQuery(other, query) and (not _containsQuery(query, other) or jdx < idx)
+                   for jdx, other in enumerate(queries) if jdx != idx):
+                continue
+            reduced.append(query)
+        queries = reduced
+
+        # -- Merge pairs of queries differing in one key
+        for idx in range(len(queries)):
+            for jdx in range(idx+1, len(queries)):
+                if queries[idx].keys() != queries[jdx].keys():
+                    continue
+
+                diffKeys = [key for key in queries[idx] if queries[idx][key] != queries[jdx][key]]
+                if len(diffKeys) != 1 or not isinstance(queries[idx][diffKeys[0]], frozenset) \
+                   or not isinstance(queries[jdx][diffKeys[0]], frozenset):
+                    continue
+
+                query = dict(queries[idx])
+                query[diffKeys[0]] = queries[idx][diffKeys[0]] | queries[jdx][diffKeys[0]]
+
+                queries = [item for kdx, item in enumerate(queries) if kdx not in (idx, jdx)] + [query]
+                merged = True
+                break
+
+            if merged:
+                break
+
+    # -- Convert back to mongoDB queries
+    listMerged = []
+    for query in queries:
+        mongoQuery = {}
+        for key, values in query.items():
+            if not isinstance(values, frozenset):
+                mongoQuery[key] = json.loads(values)
+            elif len(values) == 1:
+                mongoQuery[key] = json.loads(next(iter(values)))
+            else:
+                mongoQuery[key] = {'$in': [json.loads(value) for value in sorted(values)]}
+        listMerged.append(mongoQuery)
+
+    return sorted(listMerged, key=lambda query: json.dumps(query, sort_keys=True))
+
+# ____________________________________________________________________________
+def makeRequestFilter(queries):
+    """Make filter matching any of the queries."""
+
+    if len(queries) == 1:
+        return dict(queries[0])
+
+    return {'$or': queries}
+
+# ____________________________________________________________________________
+def mergeJoinByFilePath(leftDocs, rightDocs):
+    """Merge join two streams of documents, both sorted by filePath.
+
+       yields (leftDoc, rightDoc) - one of them is None if the
+       filePath exists only in one stream
+       """
+
+    leftDoc  = next(leftDocs, None)
+    rightDoc = next(rightDocs, None)
+
+    while leftDoc or rightDoc:
+        if not rightDoc or (leftDoc and leftDoc['filePath'] < rightDoc['filePath']):
+            yield leftDoc, None
+            leftDoc = next(leftDocs, None)
+        elif not leftDoc or rightDoc['filePath'] < leftDoc['filePath']:
+            yield None, rightDoc
+            rightDoc = next(rightDocs, None)
+        else:
+            yield leftDoc, rightDoc
+            leftDoc  = next(leftDocs, None)
+            rightDoc = next(rightDocs, None)
 
 # ____________________________________________________________________________
 def main():
     """Initialize and run"""
 
+    dryRun = '--dry-run' in sys.argv[1:]
+
+    if dryRun and '--worker' in sys.argv[1:]:
+        print('Error: --worker and --dry-run can not be combined')
+        return 1
+
     # -- Connect to mongoDB
     dbUtil = mongoDbUtil("", "admin")
 
-    stager = stagerSDMS(dbUtil, 'stagingRequest.json', os.getenv('SCRATCH', SCRATCH_SPACE))
+    stager = stagerSDMS(dbUtil, 'stagingRequest.json', os.getenv('SCRATCH', SCRATCH_SPACE), dryRun=dryRun)
+
+    # -- Only work on staging queue
+    if '--worker' in sys.argv[1:]:
+        stager.stage()
+        dbUtil.close()
+        return
+
+    # -- Only estimate cost of request
+    if dryRun:
+        stager.estimateRequest()
+        dbUtil.close()
+        return
 
     # -- Mark files to be staged
     stager.markFilesToBeStaged()
     stager.listOfFilesToBeStaged()
 
     # -- Get list of files to be staged
-    stager.prepareListOfFilesToBeStaged()
+    stager.prepareListOfFilesToBeStaged('XRD')
 
     # -- Stage from staging area to staging location
     stager.stage()
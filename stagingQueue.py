@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Persistent staging queue in mongoDB
+
+Every recall item (file or tar file on HPSS) is one document in the
+Staging_Queue collection and moves through the states
+
+  requested -> recalled -> transferred -> verified      (or failed)
+
+Workers claim items atomically with find_one_and_update and hold a
+lease on them. The lease is renewed by a heartbeat, items of dead
+workers are reclaimed by other workers when the lease expired.
+
+This is a typical document:
+{'_id': 'XRD:/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/149.tar',
+ 'stageTarget': 'XRD',
+ 'hpssPath': '/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/149.tar',
+ 'fileSize': 13538711552,
+ 'isTarFile': True,
+ 'tapeVolume': 'EA123400',
+ 'tapeOrder': 17,
+ 'docs': [{'filePath': ..., 'fileFullPath': ..., 'fileSize': ..., 'target': 'picoDst', 'nodes': ['mc0101']}, ...],
+ 'state': 'recalled',
+ 'worker': 'mc0205:12345',
+ 'leaseExpires': 1461949200.0,
+ 'nAttempts': 1,
+ 'error': '',
+ 'updated': '2016-04-29 17:02:11'}
+"""
+
+import sys
+import os
+import time
+import socket
+import datetime
+import threading
+
+import pymongo
+from pymongo import UpdateOne, ReturnDocument
+
+from mongoUtil import bulkWriteBuffer
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+LEASE_TIME      = 600
+N_MAX_ATTEMPTS  = 3
+VERIFIED_RETENTION_DAYS = 7
+
+QUEUE_STATES = ['requested', 'recalled', 'transferred', 'verified', 'failed']
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class stagingQueue:
+    """Staging queue with leases for several workers."""
+
+    # _________________________________________________________
+    def __init__(self, collQueue, leaseTime = LEASE_TIME, nMaxAttempts = N_MAX_ATTEMPTS):
+        self._collQueue    = collQueue
+        self._leaseTime    = leaseTime
+        self._nMaxAttempts = nMaxAttempts
+
+        self._workerId = '{0}:{1}'.format(socket.getfqdn().split('.')[0], os.getpid())
+
+        # -- Items held by this worker, leases are renewed by heartbeat
+        self._held     = set()
+        self._heldLock = threading.Lock()
+
+        self._stopHeartbeat = threading.Event()
+        self._heartbeat     = None
+
+        self._collQueue.create_index([('state', pymongo.ASCENDING), ('tapeVolume', pymongo.ASCENDING),
+                                      ('tapeOrder', pymongo.ASCENDING)])
+
+    # _________________________________________________________
+    def enqueue(self, listItems, stageTarget):
+        """Add recall items as requested.
+
+           Members are added to items already in the queue, unless they
+           are there - members are identified by their filePath. An item
+           getting new members is requested again, as are failed items.
+           'fileSize' is the sum of the member sizes, the extraction of
+           tar files is planned when the item is claimed.
+           """
+
+        # -- Remove old verified items, they can be requested again
+        minDate = (datetime.datetime.today() - datetime.timedelta(days=VERIFIED_RETENTION_DAYS)).strftime('%Y-%m-%d')
+        self._collQueue.delete_many({'state': 'verified', 'updated': {'$lt': minDate}})
+
+        # -- Items have to exist, before members are added
+        itemWriter   = bulkWriteBuffer(self._collQueue)
+        memberWriter = bulkWriteBuffer(self._collQueue)
+
+        requested = {'state': 'requested', 'worker': None, 'leaseExpires': 0, 'nAttempts': 0, 'error': '',
+                     'updated': self._now()}
+
+        for item in listItems:
+            itemId = '{0}:{1}'.format(stageTarget, item['hpssPath'])
+
+            doc = dict(requested, stageTarget=stageTarget, hpssPath=item['hpssPath'], isTarFile=item['isTarFile'],
+                       tapeVolume=item['tapeVolume'], tapeOrder=item['tapeOrder'], fileSize=0, docs=[])
+
+            itemWriter.add(UpdateOne({'_id': itemId}, {'$setOnInsert': doc}, upsert=True))
+
+            # -- New member - request item again, a worker holding it loses its lease
+            for member in item['docs']:
+                memberWriter.add(UpdateOne({'_id': itemId, 'docs.filePath': {'$ne': member['filePath']}},
+                                           {'$push': {'docs': member},
+                                            '$inc': {'fileSize': member['fileSize']},
+                                            '$set': requested}))
+
+            # -- Retry failed item
+            memberWriter.add(UpdateOne({'_id': itemId, 'state': 'failed'}, {'$set': requested}))
+
+        itemWriter.flush()
+        memberWriter.flush()
+
+    # _________________________________________________________
+    def claim(self, state, tapeVolume = None, stageTargets = None):
+        """Claim next item in state, in tape order - only of stageTargets, if given.
+
+           Items of tapeVolume are preferred, to keep the tape mounted.
+           Otherwise volumes not worked on by other workers are preferred.
+
+           return item or None
+           """
+
+        query = {'state': state, 'leaseExpires': {'$lt': time.time()}}
+        if stageTargets is not None:
+            query['stageTarget'] = {'$in': stageTargets}
+
+        if tapeVolume is not None:
+            listQueries = [dict(query, tapeVolume=tapeVolume), query]
+        else:
+            busyVolumes = self._collQueue.distinct('tapeVolume', {'state': state,
+                                                                  'leaseExpires': {'$gte': time.time()}})
+            listQueries = [dict(query, tapeVolume={'$nin': busyVolumes}), query] if busyVolumes else [query]
+
+        for query in listQueries:
+            item = self._collQueue.find_one_and_update(query,
+                                                       {'$set': {'worker': self._workerId,
+                                                                 'leaseExpires': time.time() + self._leaseTime,
+                                                                 'updated': self._now()},
+                                                        '$inc': {'nAttempts': 1}},
+                                                       sort=[('tapeVolume', pymongo.ASCENDING),
+                                                             ('tapeOrder', pymongo.ASCENDING)],
+                                                       return_document=ReturnDocument.AFTER)
+            if item:
+                self._hold(item)
+                return item
+
+        return None
+
+    # _________________________________________________________
+    def claimBatch(self, state, nItems, tapeVolume = None, stageTargets = None):
+        """Claim up to nItems in state from one tape volume - only of stageTargets, if given."""
+
+        listItems = []
+
+        while len(listItems) < nItems:
+            item = self.claim(state, tapeVolume, stageTargets)
+            if not item:
+                break
+
+            # -- Different volume - give it back for another drive
+            if listItems and item['tapeVolume'] != tapeVolume:
+                self.release(item, undoAttempt=True)
+                break
+
+            tapeVolume = item['tapeVolume']
+            listItems.append(item)
+
+        return listItems
+
+    # _________________________________________________________
+    def advance(self, item, state, fields = None, keep = False):
+        """Move item to state - keep holds the lease for this worker."""
+
+        update = {'state': state, 'error': '', 'nAttempts': 0, 'updated': self._now()}
+        if fields:
+            update.update(fields)
+        if not keep:
+            update.update({'worker': None, 'leaseExpires': 0})
+
+        self._collQueue.update_one({'_id': item['_id'], 'worker': self._workerId}, {'$set': update})
+
+        item['state'] = state
+        if not keep:
+            self._unhold(item)
+
+    # _________________________________________________________
+    def setNodes(self, item):
+        """Store the nodes of the members of item - other members are kept."""
+
+        writer = bulkWriteBuffer(self._collQueue)
+
+        for doc in item['docs']:
+            writer.add(UpdateOne({'_id': item['_id'], 'worker': self._workerId, 'docs.filePath': doc['filePath']},
+                                 {'$set': {'docs.$.nodes': doc.get('nodes', [])}}))
+
+        writer.flush()
+
+    # _________________________________________________________
+    def release(self, item, error = '', undoAttempt = False):
+        """Give item back in its state - failed after too many attempts."""
+
+        update = {'worker': None, 'leaseExpires': 0, 'error': error, 'updated': self._now()}
+        if not undoAttempt and item['nAttempts'] >= self._nMaxAttempts:
+            update['state'] = 'failed'
+
+        operations = {'$set': update}
+        if undoAttempt:
+            operations['$inc'] = {'nAttempts': -1}
+
+        self._collQueue.update_one({'_id': item['_id'], 'worker': self._workerId}, operations)
+        self._unhold(item)
+
+    # _________________________________________________________
+    def printSummary(self):
+        """Print number of items per state."""
+
+        counts = dict((doc['_id'], doc['nItems'])
+                      for doc in self._collQueue.aggregate([{'$group': {'_id': '$state', 'nItems': {'$sum': 1}}}]))
+
+        print('Staging queue:', ', '.join('{0}: {1}'.format(state, counts.get(state, 0)) for state in QUEUE_STATES))
+
+    # _________________________________________________________
+    def close(self):
+        """Stop heartbeat and give back all held items."""
+
+        self._stopHeartbeat.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+        with self._heldLock:
+            listHeld = list(self._held)
+            self._held.clear()
+
+        if listHeld:
+            self._collQueue.update_many({'_id': {'$in': listHeld}, 'worker': self._workerId},
+                                        {'$set': {'worker': None, 'leaseExpires': 0}})
+
+    # _________________________________________________________
+    def _hold(self, item):
+        """Add item to held items, start heartbeat."""
+
+        with self._heldLock:
+            self._held.add(item['_id'])
+
+            if not self._heartbeat:
+                self._stopHeartbeat.clear()
+                self._heartbeat = threading.Thread(target=self._renewLeases, daemon=True)
+                self._heartbeat.start()
+
+    # _________________________________________________________
+    def _unhold(self, item):
+        """Remove item from held items."""
+
+        with self._heldLock:
+            self._held.discard(item['_id'])
+
+    # _________________________________________________________
+    def _renewLeases(self):
+        """Heartbeat - renew leases of held items."""
+
+        while not self._stopHeartbeat.wait(self._leaseTime / 3):
+            with self._heldLock:
+                listHeld = list(self._held)
+
+            if listHeld:
+                self._collQueue.update_many({'_id': {'$in': listHeld}, 'worker': self._workerId},
+                                            {'$set': {'leaseExpires': time.time() + self._leaseTime}})
+
+    # _________________________________________________________
+    def _now(self):
+        """Get current time as string."""
+
+        return datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')
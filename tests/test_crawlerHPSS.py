@@ -0,0 +1,161 @@
+import os
+import stat
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+import crawlerHPSS
+from crawlerHPSS import hpssUtil
+from htarCache import htarCache
+
+SUB_FOLDER = '/nersc/projects/starofl/picodsts/Run10'
+
+# -- Listing cut short after the first block, hsi exits with an error
+FAKE_HSI = """#!/bin/sh
+echo "{0}/AuAu:"
+echo "-rw-r----- 1 starofl starprod 5103599 Apr 29 2016 a.picoDst.root"
+echo ""
+echo "*** hsi: Error during ls: timeout"
+exit 72
+""".format(SUB_FOLDER)
+
+
+# -- Incremental listing cut short after the header, hsi exits with an error
+FAKE_HSI_INCREMENTAL = """#!/bin/sh
+echo "{0}:"
+echo "drwxr-x--- 2 starofl starprod 512 Apr 29 2016 AuAu"
+exit 72
+""".format(SUB_FOLDER)
+
+# -- Listing of one tar file, htar fails on it
+FAKE_HSI_TAR = """#!/bin/sh
+echo "{0}/AuAu:"
+echo "-rw-r----- 1 starofl starprod 13538711552 Apr 29 2016 149.tar"
+""".format(SUB_FOLDER)
+
+FAKE_HTAR = """#!/bin/sh
+echo "ERROR: Error -5 on hpss_Open (read) for {0}/AuAu/149.tar"
+exit 72
+""".format(SUB_FOLDER)
+
+
+def addFakeCommand(tmpdir, monkeypatch, name, script):
+    command = tmpdir.join(name)
+    command.write(script)
+    os.chmod(str(command), stat.S_IRWXU)
+    monkeypatch.setenv('PATH', '{0}{1}{2}'.format(tmpdir, os.pathsep, os.environ['PATH']))
+
+
+@pytest.fixture
+def fakeHsi(tmpdir, monkeypatch):
+    addFakeCommand(tmpdir, monkeypatch, 'hsi', FAKE_HSI)
+
+
+def makeCrawler(db):
+    hpss = hpssUtil()
+    hpss.setCollections(db.HPSS_Files, db.HPSS_PicoDsts, db.HPSS_Duplicates, db.HPSS_CrawlCheckpoints,
+                        db.HPSS_DirFingerprints)
+    return hpss
+
+
+def test_failing_hsi_keeps_checkpoint_and_marks_subfolder_failed(fakeHsi, tmpdir, monkeypatch):
+    monkeypatch.setattr(crawlerHPSS, 'htarCache', lambda: htarCache(str(tmpdir.join('htarCache'))))
+
+    db = mongomock.MongoClient().db
+    collEpochs = db.HPSS_CrawlEpochs
+
+    hpss = makeCrawler(db)
+
+    crawlEpoch = crawlerHPSS.startCrawlEpoch(collEpochs)
+    hpss._crawlEpoch = crawlEpoch
+    hpss._parseSubFolder(SUB_FOLDER)
+
+    summary = hpss.getSummary()
+    assert summary['failed']
+    assert summary['nFiles'] == 1
+
+    # -- Blocks listed before the failure are kept to resume the crawl
+    assert db.HPSS_CrawlCheckpoints.count_documents({'subFolder': SUB_FOLDER}) == 1
+
+    # -- Fingerprints of a cut short listing are not refreshed
+    assert db.HPSS_DirFingerprints.count_documents({}) == 0
+
+    # -- Crawl epoch is resumed by the next crawl
+    assert crawlerHPSS.startCrawlEpoch(collEpochs) == crawlEpoch
+
+
+def test_failing_hsi_in_incremental_crawl_keeps_fingerprints(tmpdir, monkeypatch):
+    monkeypatch.setattr(crawlerHPSS, 'htarCache', lambda: htarCache(str(tmpdir.join('htarCache'))))
+    addFakeCommand(tmpdir, monkeypatch, 'hsi', FAKE_HSI_INCREMENTAL)
+
+    db = mongomock.MongoClient().db
+
+    hpss = makeCrawler(db)
+    hpss._crawlEpoch = crawlerHPSS.startCrawlEpoch(db.HPSS_CrawlEpochs, incremental=True)
+    hpss._parseSubFolder(SUB_FOLDER, incremental=True)
+
+    assert hpss.getSummary()['failed']
+    assert db.HPSS_DirFingerprints.count_documents({}) == 0
+
+
+def test_failing_htar_is_reported_only(tmpdir, monkeypatch):
+    monkeypatch.setattr(crawlerHPSS, 'htarCache', lambda: htarCache(str(tmpdir.join('htarCache'))))
+    addFakeCommand(tmpdir, monkeypatch, 'hsi', FAKE_HSI_TAR)
+    addFakeCommand(tmpdir, monkeypatch, 'htar', FAKE_HTAR)
+
+    db = mongomock.MongoClient().db
+
+    hpss = makeCrawler(db)
+    hpss._crawlEpoch = crawlerHPSS.startCrawlEpoch(db.HPSS_CrawlEpochs)
+    hpss._parseSubFolder(SUB_FOLDER)
+
+    summary = hpss.getSummary()
+    assert not summary['failed']
+    assert summary['nFailedTars'] == 1
+
+    # -- Crawl of subFolder is done, tar file is listed again by the next crawl
+    assert db.HPSS_CrawlCheckpoints.count_documents({}) == 0
+    assert db.HPSS_Files.count_documents({'fileType': 'tar', 'filesInTar': {'$exists': False}}) == 1
+
+
+def test_picoDst_docs_of_tar_members_match_per_file_parsing(tmpdir, monkeypatch):
+    monkeypatch.setattr(crawlerHPSS, 'htarCache', lambda: htarCache(str(tmpdir.join('htarCache'))))
+
+    hpss = hpssUtil()
+    tarDoc = {'fileFullPath': '/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/149.tar'}
+    listMembers = [['/project/projectdirs/starprod/picodsts/Run10/AuAu/11GeV/all/P10ih/149/11149081/'
+                    'st_physics_adc_11149081_raw_{0}.picoDst.root'.format(idx), 100 + idx] for idx in range(3)]
+
+    listDocs = hpss._makePicoDstDocs(listMembers, hpssDoc=tarDoc, isInTarFile=True)
+
+    for doc, (fileFullPath, fileSize) in zip(listDocs, listMembers):
+        filePath, starDetails = hpss._pathParser.parse(fileFullPath)
+        assert doc['filePath'] == filePath
+        assert doc['starDetails'] == starDetails
+        assert doc['fileSize'] == fileSize
+        assert doc['fileFullPathTar'] == tarDoc['fileFullPath']
+
+
+def test_members_of_requeued_tar_file_are_not_duplicates(tmpdir, monkeypatch):
+    monkeypatch.setattr(crawlerHPSS, 'htarCache', lambda: htarCache(str(tmpdir.join('htarCache'))))
+
+    db = mongomock.MongoClient().db
+
+    hpss = makeCrawler(db)
+    hpss._resetSummary('test')
+    tarDoc = {'fileFullPath': '/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/149.tar'}
+    listMembers = [['/project/projectdirs/starprod/picodsts/Run10/AuAu/11GeV/all/P10ih/149/11149081/'
+                    'st_physics_adc_11149081_raw_{0}.picoDst.root'.format(idx), 100 + idx] for idx in range(3)]
+
+    hpss._insertPicoDsts(hpss._makePicoDstDocs(listMembers, hpssDoc=tarDoc, isInTarFile=True))
+
+    # -- Same tar file listed again after a crash - members are already there
+    hpss._insertPicoDsts(hpss._makePicoDstDocs(listMembers, hpssDoc=tarDoc, isInTarFile=True), isRequeued=True)
+    assert db.HPSS_PicoDsts.count_documents({}) == 3
+    assert db.HPSS_Duplicates.count_documents({}) == 0
+
+    # -- Same origin, but not a requeued tar file - real duplicates
+    hpss._insertPicoDsts(hpss._makePicoDstDocs(listMembers, hpssDoc=tarDoc, isInTarFile=True))
+    assert db.HPSS_PicoDsts.count_documents({}) == 3
+    assert db.HPSS_Duplicates.count_documents({}) == 3
@@ -0,0 +1,23 @@
+import os
+import shlex
+import stat
+
+from hpssRecall import hsiTapeInfo
+
+# -- Keep the hsi command line, no output
+FAKE_HSI = """#!/bin/sh
+echo "$2" > {0}
+"""
+
+
+def test_hsi_tape_info_quotes_paths(tmpdir, monkeypatch):
+    hsi = tmpdir.join('hsi')
+    hsi.write(FAKE_HSI.format(tmpdir.join('cmdLine')))
+    os.chmod(str(hsi), stat.S_IRWXU)
+    monkeypatch.setenv('PATH', '{0}{1}{2}'.format(tmpdir, os.pathsep, os.environ['PATH']))
+
+    listPaths = ['/nersc/projects/starofl/picodsts/Run10/my day/148.tar',
+                 '/nersc/projects/starofl/picodsts/Run10/a;b/149.tar']
+
+    assert hsiTapeInfo().getTapeInfo(listPaths) == {}
+    assert shlex.split(tmpdir.join('cmdLine').read()) == ['ls', '-P'] + listPaths
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+import stagerSDMS
+
+TAR_FOLDER = '/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih'
+
+
+class fakeDbUtil:
+    def __init__(self):
+        self.db = mongomock.MongoClient().db
+
+    def getCollection(self, collectionName):
+        return self.db[collectionName]
+
+
+def makeMember(filePath, tarName):
+    return {'filePath': filePath, 'fileFullPath': '/project/projectdirs/starprod/picodsts/' + filePath,
+            'fileSize': 100, 'target': 'picoDst', 'isInTarFile': True,
+            'fileFullPathTar': '{0}/{1}.tar'.format(TAR_FOLDER, tarName),
+            'staging': {'stageMarkerXRD': True}}
+
+
+def test_members_of_a_tar_file_are_enqueued_together(tmpdir, monkeypatch):
+    stagingFile = tmpdir.join('stagingRequest.json')
+    stagingFile.write(json.dumps({'sets': []}))
+
+    dbUtil = fakeDbUtil()
+    stager = stagerSDMS.stagerSDMS(dbUtil, str(stagingFile), str(tmpdir), dryRun=True)
+
+    # -- Members of tar file 149 are not adjacent in filePath order
+    dbUtil.db.HPSS_PicoDsts.insert_many([makeMember('Run10/AuAu/11GeV/all/P10ih/149/a.picoDst.root', '149'),
+                                         makeMember('Run10/AuAu/11GeV/all/P10ih/149/b.picoDst.root', '150'),
+                                         makeMember('Run10/AuAu/11GeV/all/P10ih/149/c.picoDst.root', '149'),
+                                         makeMember('Run10/AuAu/11GeV/all/P10ih/149/d.picoDst.root', '151'),
+                                         makeMember('Run10/AuAu/11GeV/all/P10ih/149/e.picoDst.root', '151')])
+
+    # -- Already staged member is not staged again
+    dbUtil.db.XRD_PicoDsts.insert_one({'filePath': 'Run10/AuAu/11GeV/all/P10ih/149/e.picoDst.root',
+                                       'target': 'picoDst', 'storage': {'location': 'XRD'}})
+
+    listChunks = []
+    monkeypatch.setattr(stagerSDMS, 'N_STAGE_CHUNK', 2)
+    monkeypatch.setattr(stager, '_enqueueHPSSFiles',
+                        lambda stageList, stageTarget, orderOffset = 0: listChunks.append(list(stageList)) or 0)
+
+    assert stager.prepareListOfFilesToBeStaged('XRD')
+
+    chunkOfTar = {}
+    for idx, chunk in enumerate(listChunks):
+        for doc in chunk:
+            assert chunkOfTar.setdefault(doc['fileFullPathTar'], idx) == idx
+
+    assert sum(len(chunk) for chunk in listChunks) == 4
+    assert sorted(chunkOfTar) == ['{0}/{1}.tar'.format(TAR_FOLDER, tarName) for tarName in ['149', '150', '151']]
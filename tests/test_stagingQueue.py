@@ -0,0 +1,104 @@
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from stagingQueue import stagingQueue
+
+TAR_PATH = '/nersc/projects/starofl/picodsts/Run10/AuAu/11GeV/all/P10ih/149.tar'
+
+
+def makeTarItem(listMembers):
+    docs = [{'filePath': 'Run10/AuAu/11GeV/all/P10ih/149/11149081/' + member,
+             'fileFullPath': '/project/projectdirs/starprod/picodsts/Run10/AuAu/11GeV/all/P10ih/149/11149081/' + member,
+             'fileSize': 100, 'target': 'picoDst'} for member in listMembers]
+
+    return {'hpssPath': TAR_PATH, 'fileSize': 100 * len(docs), 'isTarFile': True,
+            'tapeVolume': 'EA123400', 'tapeOrder': 0, 'docs': docs}
+
+
+def getMembers(item):
+    return sorted(doc['filePath'].rsplit('/', 1)[1] for doc in item['docs'])
+
+
+@pytest.fixture
+def queue():
+    return stagingQueue(mongomock.MongoClient().db.Staging_Queue)
+
+
+def test_enqueue_same_tar_twice_merges_members(queue):
+    queue.enqueue([makeTarItem(['a.picoDst.root', 'b.picoDst.root'])], 'XRD')
+    queue.enqueue([makeTarItem(['b.picoDst.root', 'c.picoDst.root'])], 'XRD')
+
+    item = queue.claim('requested')
+    queue.close()
+
+    assert getMembers(item) == ['a.picoDst.root', 'b.picoDst.root', 'c.picoDst.root']
+    assert item['fileSize'] == 300
+
+
+def test_enqueue_member_with_other_key_order_once(queue):
+    item = makeTarItem(['a.picoDst.root'])
+    queue.enqueue([item], 'XRD')
+
+    item['docs'] = [dict(reversed(list(item['docs'][0].items())))]
+    queue.enqueue([item], 'XRD')
+
+    item = queue.claim('requested')
+    queue.close()
+
+    assert getMembers(item) == ['a.picoDst.root']
+    assert item['fileSize'] == 100
+
+
+def test_enqueue_new_member_requests_item_again(queue):
+    queue.enqueue([makeTarItem(['a.picoDst.root'])], 'XRD')
+
+    item = queue.claim('requested')
+    queue.advance(item, 'recalled', keep=True)
+
+    queue.enqueue([makeTarItem(['b.picoDst.root'])], 'XRD')
+
+    # -- Worker holding the item lost it - its nodes are not stored
+    item['docs'][0]['nodes'] = ['mc0101']
+    queue.setNodes(item)
+
+    item = queue.claim('requested')
+    queue.close()
+
+    assert getMembers(item) == ['a.picoDst.root', 'b.picoDst.root']
+    assert all('nodes' not in doc for doc in item['docs'])
+
+
+def test_set_nodes_keeps_members_added_meanwhile(queue):
+    queue.enqueue([makeTarItem(['a.picoDst.root'])], 'XRD')
+
+    item = queue.claim('requested')
+    queue._collQueue.update_one({'_id': item['_id']}, {'$push': {'docs': makeTarItem(['b.picoDst.root'])['docs'][0]}})
+
+    item['docs'][0]['nodes'] = ['mc0101']
+    queue.setNodes(item)
+    queue.advance(item, 'transferred')
+
+    item = queue.claim('transferred')
+    queue.close()
+
+    assert getMembers(item) == ['a.picoDst.root', 'b.picoDst.root']
+    assert item['docs'][0]['nodes'] == ['mc0101']
+
+
+def test_enqueue_requests_failed_item_again(queue):
+    queue.enqueue([makeTarItem(['a.picoDst.root'])], 'XRD')
+
+    item = queue.claim('requested')
+    queue._nMaxAttempts = 1
+    queue.release(item, 'recall from HPSS failed')
+    assert queue.claim('requested') is None
+
+    queue.enqueue([makeTarItem(['a.picoDst.root'])], 'XRD')
+
+    item = queue.claim('requested')
+    queue.close()
+
+    assert item['nAttempts'] == 1
+    assert item['error'] == ''
+    assert len(item['docs']) == 1
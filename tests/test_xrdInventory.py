@@ -0,0 +1,31 @@
+from xrdInventory import xrdInventory, runBenchmark
+
+
+def test_crawl_reports_only_changes(tmpdir):
+    inventory = xrdInventory(str(tmpdir.join('inventory.sqlite')))
+    inventory.seed([('picoDst', 'a.picoDst.root', 10, 'data'),
+                    ('picoDst', 'b.picoDst.root', 10, 'data'),
+                    ('picoDst', 'c.picoDst.root', 10, 'data')])
+
+    inventory.startRun()
+    changes = [inventory.update('picoDst', 'a.picoDst.root', 10, 'data1'),
+               inventory.update('picoDst', 'b.picoDst.root', 20, 'data'),
+               inventory.update('picoDst', 'd.picoDst.root', 10, 'data')]
+    missing = list(inventory.getMissing('picoDst'))
+    inventory.finishRun()
+
+    assert changes == [None, 'changed', 'new']
+    assert missing == ['c.picoDst.root']
+
+    # -- Next run - all files of last run are known
+    inventory.startRun()
+    assert inventory.update('picoDst', 'd.picoDst.root', 10, 'data') is None
+    assert sorted(inventory.getMissing('picoDst')) == ['a.picoDst.root', 'b.picoDst.root']
+    inventory.close()
+
+
+def test_benchmark_changes():
+    result = runBenchmark(2000)
+
+    assert (result['new'], result['changed'], result['missing']) == (100, 19, 100)
+    assert result['nFilesAfter'] == 2000 - result['daemonChanges'] // 2
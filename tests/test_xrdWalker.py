@@ -0,0 +1,23 @@
+import os
+
+import xrdWalker
+
+
+def test_disk_of_shared_device_from_link_target(tmpdir, monkeypatch):
+    # -- All data partitions on the same device as the namespace
+    monkeypatch.setattr(xrdWalker, 'DISK_PREFIX', str(tmpdir))
+    monkeypatch.setattr(xrdWalker, 'DISK_LIST', ['data', 'data1'])
+
+    namespace = tmpdir.mkdir('namespace')
+    for disk in ['data', 'data1']:
+        tmpdir.mkdir(disk).join('{0}.picoDst.root'.format(disk)).write('x' * 10)
+        os.symlink(str(tmpdir.join(disk, '{0}.picoDst.root'.format(disk))),
+                   str(namespace.join('{0}.picoDst.root'.format(disk))))
+
+    walker = xrdWalker.xrdWalker(nThreads=2)
+    assert walker._diskByDevice == {}
+
+    listFiles = sorted(walker.walk([str(namespace)]))
+
+    assert [(os.path.basename(path), fileSize, disk) for path, fileSize, disk in listFiles] == \
+        [('data.picoDst.root', 10, 'data'), ('data1.picoDst.root', 10, 'data1')]
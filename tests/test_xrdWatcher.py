@@ -0,0 +1,54 @@
+import ctypes
+import errno
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+
+from xrdWatcher import xrdWatcher
+
+
+class noWatchesLeft:
+    """libc, which has no inotify watches left."""
+
+    def __init__(self, libc):
+        self._libc = libc
+
+    def inotify_add_watch(self, fd, path, mask):
+        ctypes.set_errno(errno.ENOSPC)
+        return -1
+
+    def __getattr__(self, name):
+        return getattr(self._libc, name)
+
+
+def test_drain_drops_queued_events(tmpdir):
+    watcher = xrdWatcher()
+    try:
+        watcher.addTree(str(tmpdir))
+        for idx in range(10):
+            tmpdir.join('{0}.picoDst.root'.format(idx)).write('x')
+
+        assert watcher.drain() > 0
+        assert watcher.read(0) == []
+    finally:
+        watcher.close()
+
+
+def test_directories_without_watch_are_listed_and_kept(tmpdir):
+    tmpdir.mkdir('149').join('a.picoDst.root').write('x')
+
+    watcher = xrdWatcher()
+    watcher._libc = noWatchesLeft(watcher._libc)
+    try:
+        listFiles = []
+        watcher.addTree(str(tmpdir), listFiles)
+
+        assert listFiles == [str(tmpdir.join('149', 'a.picoDst.root'))]
+        assert watcher.unwatched == set([str(tmpdir), str(tmpdir.join('149'))])
+
+        watcher.removeTree(str(tmpdir.join('149')))
+        assert watcher.unwatched == set([str(tmpdir)])
+    finally:
+        watcher.close()
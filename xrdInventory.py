@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Local inventory of files on a XRootD data server
+
+The files found by the last crawl are kept in a SQLite file on the data
+server. A new crawl is compared with this snapshot locally, only the
+changes are reported to mongoDB.
+
+Every file is one row (target, filePath, fileSize, disk, seen), fileSize
+is -1 for broken links. 'seen' holds the id of the last run in which the
+file was found - files not seen in the current run are missing. Run ids
+are counted up from the highest id in the inventory.
+
+An empty inventory is seeded with the files of the node in mongoDB.
+
+The inventory is used by one crawl or daemon at a time - it is locked
+exclusively (<inventory>.lock) from opening until close.
+
+Run as script to benchmark a crawl and daemon changes against an
+inventory of N_BENCHMARK_FILES files (or the number given):
+  xrdInventory.py [nFiles]
+"""
+
+import sys
+import os
+import time
+import tempfile
+import sqlite3
+import fcntl
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+INVENTORY_FILE = '/export/data/xrd/sdmsInventory.sqlite'
+
+N_BENCHMARK_FILES   = 1000000
+N_BENCHMARK_CHANGES = 10000
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class xrdInventory:
+    """Local snapshot of files on data server."""
+
+    # _________________________________________________________
+    def __init__(self, fileName = INVENTORY_FILE):
+        # -- Wait for other users of the inventory
+        self._lockFile = open(fileName + '.lock', 'a')
+        fcntl.flock(self._lockFile, fcntl.LOCK_EX)
+
+        self._conn = sqlite3.connect(fileName)
+
+        self._conn.execute('CREATE TABLE IF NOT EXISTS files (target TEXT, filePath TEXT, fileSize INTEGER, '
+                           'disk TEXT, seen INTEGER, PRIMARY KEY (target, filePath))')
+        self._conn.commit()
+
+        self._runId = 0
+
+    # _________________________________________________________
+    def isSeeded(self):
+        """Check if inventory was seeded - stored as user_version."""
+
+        return self._conn.execute('PRAGMA user_version').fetchone()[0] > 0
+
+    # _________________________________________________________
+    def seed(self, listFiles):
+        """Replace inventory with list of (target, filePath, fileSize, disk)."""
+
+        self._conn.execute('DELETE FROM files')
+        self._conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, 0)', listFiles)
+        self._conn.execute('PRAGMA user_version = 1')
+        self._conn.commit()
+
+    # _________________________________________________________
+    def startRun(self):
+        """Start new run - changes are committed by finishRun."""
+
+        self._runId = self._conn.execute('SELECT IFNULL(MAX(seen), 0) + 1 FROM files').fetchone()[0]
+
+    # _________________________________________________________
+    def update(self, target, filePath, fileSize, disk):
+        """Add file found in this run.
+
+           return 'new', 'changed' (fileSize differs) or None if unchanged
+           """
+
+        # -- Unchanged file - just mark as seen
+        cursor = self._conn.execute('UPDATE files SET seen = ?, disk = ? '
+                                    'WHERE target = ? AND filePath = ? AND fileSize = ?',
+                                    (self._runId, disk, target, filePath, fileSize))
+        if cursor.rowcount:
+            return None
+
+        cursor = self._conn.execute('UPDATE files SET seen = ?, disk = ?, fileSize = ? '
+                                    'WHERE target = ? AND filePath = ?',
+                                    (self._runId, disk, fileSize, target, filePath))
+        if cursor.rowcount:
+            return 'changed'
+
+        self._conn.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?)', (target, filePath, fileSize, disk, self._runId))
+        return 'new'
+
+    # _________________________________________________________
+    def remove(self, target, filePath):
+        """Remove file.
+
+           return True if file was in inventory
+           """
+
+        cursor = self._conn.execute('DELETE FROM files WHERE target = ? AND filePath = ?', (target, filePath))
+        return cursor.rowcount > 0
+
+    # _________________________________________________________
+    def removeTree(self, target, prefix):
+        """Remove all files of target below prefix - '' for all files.
+
+           return list of removed filePaths
+           """
+
+        if prefix:
+            prefix = prefix.rstrip('/') + '/'
+
+        query = ' FROM files WHERE target = ? AND substr(filePath, 1, ?) = ?'
+        args  = (target, len(prefix), prefix)
+
+        listFilePaths = [row[0] for row in self._conn.execute('SELECT filePath' + query, args)]
+        self._conn.execute('DELETE' + query, args)
+
+        return listFilePaths
+
+    # _________________________________________________________
+    def commit(self):
+        """Commit changes made outside of a run."""
+
+        self._conn.commit()
+
+    # _________________________________________________________
+    def getMissing(self, target):
+        """Get files of target not found in this run - yields filePath."""
+
+        for row in self._conn.execute('SELECT filePath FROM files WHERE target = ? AND seen != ?',
+                                      (target, self._runId)):
+            yield row[0]
+
+    # _________________________________________________________
+    def finishRun(self):
+        """Remove missing files and commit run."""
+
+        self._conn.execute('DELETE FROM files WHERE seen != ?', (self._runId,))
+        self._conn.commit()
+
+    # _________________________________________________________
+    def close(self):
+        """Close inventory and release lock - uncommitted changes are discarded."""
+
+        self._conn.rollback()
+        self._conn.close()
+
+        self._lockFile.close()
+
+# ____________________________________________________________________________
+def makeBenchmarkFile(idx):
+    """Make (target, filePath, fileSize, disk) of synthetic file idx."""
+
+    return ('picoDst',
+            'Run14/AuAu/200GeV/physics2/P15ic/{0:03d}/{1}/st_physics_{1}_raw_{2:07d}.picoDst.root'.format(idx % 365,
+                                                                                                         15000000 + idx // 100,
+                                                                                                         idx),
+            1000000 + idx % 1000, '/export/data{0}'.format(idx % 4))
+
+# ____________________________________________________________________________
+def runBenchmark(nFiles):
+    """Benchmark crawl and daemon changes against inventory of nFiles files.
+
+       The crawl finds 5% new files, 5% are missing and 1% changed size.
+       The daemon adds N_BENCHMARK_CHANGES changes, half of them deletions.
+
+       return dict of number of changes and times
+       """
+
+    result = {'nFiles': nFiles, 'new': 0, 'changed': 0}
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        inventory = xrdInventory(os.path.join(tmpDir, 'inventory.sqlite'))
+
+        start = time.time()
+        inventory.seed(makeBenchmarkFile(idx) for idx in range(nFiles))
+        result['timeSeed'] = time.time() - start
+
+        # -- Crawl - all files are walked, only the changes are reported
+        start = time.time()
+        inventory.startRun()
+
+        for idx in range(nFiles // 20, nFiles + nFiles // 20):
+            target, filePath, fileSize, disk = makeBenchmarkFile(idx)
+            if idx % 100 == 0:
+                fileSize += 1
+
+            change = inventory.update(target, filePath, fileSize, disk)
+            if change:
+                result[change] += 1
+
+        result['missing'] = sum(1 for filePath in inventory.getMissing('picoDst'))
+        inventory.finishRun()
+        result['timeCrawl'] = time.time() - start
+
+        # -- Daemon - single changes, committed together
+        result['daemonChanges'] = min(N_BENCHMARK_CHANGES, nFiles)
+
+        start = time.time()
+        for idx in range(nFiles // 20, nFiles // 20 + result['daemonChanges']):
+            target, filePath, fileSize, disk = makeBenchmarkFile(idx)
+            if idx % 2:
+                inventory.remove(target, filePath)
+            else:
+                inventory.update(target, filePath, fileSize + 1, disk)
+        inventory.commit()
+        result['timeDaemon'] = time.time() - start
+
+        result['nFilesAfter'] = inventory._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+        inventory.close()
+
+    return result
+
+# ____________________________________________________________________________
+def main():
+    """Benchmark crawl and daemon changes against inventory - see runBenchmark."""
+
+    nFiles = int(sys.argv[1]) if len(sys.argv) > 1 else N_BENCHMARK_FILES
+
+    result = runBenchmark(nFiles)
+
+    print('Inventory of {0} files'.format(nFiles))
+    print('   seed:                 {0:8.2f} s'.format(result['timeSeed']))
+    print('   crawl:                {0:8.2f} s   (new: {1}, changed: {2}, missing: {3})'.format(result['timeCrawl'],
+                                                                                            result['new'],
+                                                                                            result['changed'],
+                                                                                            result['missing']))
+    print('   daemon {0:6d} changes: {1:8.2f} s'.format(result['daemonChanges'], result['timeDaemon']))
+
+# ____________________________________________________________________________
+if __name__ == "__main__":
+    sys.exit(main())
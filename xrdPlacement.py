@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Placement of files on XRootD data servers
+
+For every file nCopies distinct data servers are chosen among the active
+servers in XRD_DataServers:
+
+ - servers holding the fewest files of the same dataset (folder of the
+   file) are preferred, to spread datasets over the data servers
+ - among those, a server is drawn weighted by its free space
+ - a reserve fraction of the total space of each server is kept free
+
+The free space of a server is reduced by every file placed on it.
+"""
+
+import sys
+import os
+import random
+import bisect
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+N_COPIES              = 1
+FREE_SPACE_RESERVE    = 0.05
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class xrdPlacement:
+    """Capacity aware placement of files on XRootD data servers."""
+
+    # _________________________________________________________
+    def __init__(self, collDataServers, nCopies = N_COPIES, reserve = FREE_SPACE_RESERVE):
+        self._nCopies = nCopies
+
+        # -- Usable free space of active data servers
+        self._freeSpace = {}
+        for doc in collDataServers.find({'stateActive': True}, {'nodeName': True, 'freeSpace': True, 'totalSpace': True}):
+            freeSpace = doc.get('freeSpace', 0) - reserve * doc.get('totalSpace', 0)
+            if freeSpace > 0:
+                self._freeSpace[doc['nodeName']] = freeSpace
+
+        # -- Number of files per dataset and data server
+        self._datasetCounts = {}
+
+    # _________________________________________________________
+    def getNodes(self):
+        """Get list of data servers available for placement."""
+
+        return sorted(self._freeSpace.keys())
+
+    # _________________________________________________________
+    def place(self, doc):
+        """Choose data servers for file.
+
+           return list of nodeNames - shorter than nCopies if space is missing
+           """
+
+        dataset = os.path.dirname(doc['filePath'])
+        counts  = self._datasetCounts.setdefault(dataset, {})
+
+        listNodes = []
+        for copy in range(self._nCopies):
+            candidates = [nodeName for nodeName, freeSpace in self._freeSpace.items()
+                          if freeSpace >= doc['fileSize'] and nodeName not in listNodes]
+            if not candidates:
+                break
+
+            # -- Prefer data servers with fewest files of dataset
+            minCount   = min(counts.get(nodeName, 0) for nodeName in candidates)
+            candidates = sorted(nodeName for nodeName in candidates if counts.get(nodeName, 0) == minCount)
+
+            nodeName = self._drawWeighted(candidates)
+
+            listNodes.append(nodeName)
+            counts[nodeName] = counts.get(nodeName, 0) + 1
+            self._freeSpace[nodeName] -= doc['fileSize']
+
+        return listNodes
+
+    # _________________________________________________________
+    def _drawWeighted(self, candidates):
+        """Draw data server weighted by free space."""
+
+        cumulative = []
+        total = 0
+        for nodeName in candidates:
+            total += self._freeSpace[nodeName]
+            cumulative.append(total)
+
+        idx = bisect.bisect_right(cumulative, random.random() * total)
+        return candidates[min(idx, len(candidates) - 1)]
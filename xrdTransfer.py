@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Parallel transfer of files from scratch space onto XRootD data servers
+
+Transfers run in a pool of workers with a global cap and a cap per
+data server. The caps hold for all stagers together: running transfers
+are counted in the XRD_Transfers collection before a transfer is started.
+Failed transfers are retried with exponential backoff.
+Transfers can be added while the dispatcher is running, onDone is
+called once for every transfer finished or finally failed.
+
+A transfer is a dict with:
+ 'target'      : 'picoDst'
+ 'filePath'    : path starting with "STAR naming conventions"
+ 'source'      : path of file in scratch space
+ 'destination' : path in XRootD namespace
+ 'nodeName'    : data server
+
+The progress of every transfer is tracked in the XRD_Transfers collection.
+
+This is a typical document:
+{'_id': 'picoDst:mc0101:Run10/AuAu/11GeV/all/P10ih/149/11149081/st_physics_adc_11149081_raw_2520001.picoDst.root',
+ 'target': 'picoDst',
+ 'filePath': 'Run10/AuAu/11GeV/all/P10ih/149/11149081/st_physics_adc_11149081_raw_2520001.picoDst.root',
+ 'nodeName': 'mc0101',
+ 'state': 'done',          (queued, running, retry, done, failed)
+ 'nAttempts': 1,
+ 'started': 1461949200.0,
+ 'error': '',
+ 'updated': '2016-04-29 17:02:11'}
+"""
+
+import sys
+import time
+import queue
+import pymongo
+import threading
+import datetime
+import subprocess
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from mongoUtil import bulkWriteBuffer
+from pymongo import UpdateOne
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+XRD_PORT = 1094
+
+N_TRANSFER_WORKERS   = 32
+N_TRANSFERS_PER_NODE = 4
+N_TRANSFER_RETRIES   = 3
+TRANSFER_BACKOFF     = 30
+
+POLL_INTERVAL = 1
+
+# -- Running transfers older than this are not counted - their stager died
+TRANSFER_STALE_TIME = 4 * 3600
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class xrdTransfer:
+    """Transfer files from scratch space onto XRootD data servers."""
+
+    # _________________________________________________________
+    def __init__(self, collTransfers, nWorkers = N_TRANSFER_WORKERS, nPerNode = N_TRANSFERS_PER_NODE,
+                 nRetries = N_TRANSFER_RETRIES, backoff = TRANSFER_BACKOFF, onDone = None):
+        self._collTransfers = collTransfers
+        self._onDone        = onDone
+
+        self._nWorkers = nWorkers
+        self._nPerNode = nPerNode
+        self._nRetries = nRetries
+        self._backoff  = backoff
+
+        self._collTransfers.create_index([('state', pymongo.ASCENDING), ('nodeName', pymongo.ASCENDING),
+                                          ('started', pymongo.ASCENDING)])
+
+    # _________________________________________________________
+    def start(self):
+        """Start dispatcher - transfers can be added while running."""
+
+        self._listDone   = []
+        self._listFailed = []
+
+        self._inbox = queue.Queue()
+
+        self._dispatcher = threading.Thread(target=self._dispatch)
+        self._dispatcher.start()
+
+    # _________________________________________________________
+    def add(self, listTransfers):
+        """Add transfers to running dispatcher."""
+
+        writer = bulkWriteBuffer(self._collTransfers)
+
+        for item in listTransfers:
+            item['_id']       = '{0}:{1}:{2}'.format(item['target'], item['nodeName'], item['filePath'])
+            item['nAttempts'] = 0
+            item['notBefore'] = 0
+
+            writer.add(UpdateOne({'_id': item['_id']}, {'$set': self._makeStateDoc(item, 'queued', upsert=True)},
+                                 upsert=True))
+
+        writer.flush()
+
+        for item in listTransfers:
+            self._inbox.put(item)
+
+    # _________________________________________________________
+    def finish(self):
+        """Wait for all transfers to finish.
+
+           return list of done and list of failed transfers
+           """
+
+        self._inbox.put(None)
+        self._dispatcher.join()
+
+        print('Transfers to XRD: {0} done, {1} failed'.format(len(self._listDone), len(self._listFailed)))
+
+        return self._listDone, self._listFailed
+
+    # _________________________________________________________
+    def _getNewTransfers(self, queues, nRunning, block):
+        """Queue new transfers per data server.
+
+           return True if no more transfers will be added
+           """
+
+        closed = False
+
+        try:
+            item = self._inbox.get(block=block)
+            while True:
+                if item is None:
+                    closed = True
+                else:
+                    queues.setdefault(item['nodeName'], deque()).append(item)
+                    nRunning.setdefault(item['nodeName'], 0)
+
+                item = self._inbox.get_nowait()
+        except queue.Empty:
+            pass
+
+        return closed
+
+    # _________________________________________________________
+    def _dispatch(self):
+        """Start transfers up to the caps, retry failed ones."""
+
+        queues   = {}
+        nRunning = {}
+        running  = {}
+        closed   = False
+
+        with ThreadPoolExecutor(max_workers=self._nWorkers) as executor:
+            while not closed or running or any(queues.values()):
+
+                # -- Get new transfers - wait for them if idle
+                if not closed:
+                    closed = self._getNewTransfers(queues, nRunning, block=not running and not any(queues.values()))
+
+                # -- Start transfers up to the caps - transfers over the caps of all stagers wait
+                now = time.time()
+                for nodeName, nodeQueue in queues.items():
+                    while nodeQueue and nodeQueue[0]['notBefore'] <= now and \
+                          nRunning[nodeName] < self._nPerNode and len(running) < self._nWorkers:
+                        if not self._claimSlot(nodeQueue[0]):
+                            nodeQueue[0]['notBefore'] = now + POLL_INTERVAL
+                            break
+
+                        item = nodeQueue.popleft()
+                        running[executor.submit(self._copy, item)] = item
+                        nRunning[nodeName] += 1
+
+                # -- Wait for a transfer to finish, the next retry to be due or new transfers
+                listNotBefore = [nodeQueue[0]['notBefore'] for nodeQueue in queues.values()
+                                 if nodeQueue and nRunning[nodeQueue[0]['nodeName']] < self._nPerNode]
+                timeout = max(0, min(listNotBefore) - now) if listNotBefore else None
+                if not closed:
+                    timeout = min(timeout, POLL_INTERVAL) if timeout is not None else POLL_INTERVAL
+
+                if not running:
+                    time.sleep(timeout if timeout is not None else 0)
+                    continue
+
+                done, notDone = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    item = running.pop(future)
+                    nRunning[item['nodeName']] -= 1
+
+                    error = future.result()
+                    if not error:
+                        self._setState(item, 'done')
+                        self._listDone.append(item)
+                    elif item['nAttempts'] <= self._nRetries:
+                        self._setState(item, 'retry', error)
+                        item['notBefore'] = time.time() + self._backoff * 2**(item['nAttempts']-1)
+                        queues[item['nodeName']].append(item)
+                        continue
+                    else:
+                        self._setState(item, 'failed', error)
+                        self._listFailed.append(item)
+
+                    if self._onDone:
+                        self._onDone(item, not error)
+
+    # _________________________________________________________
+    def _claimSlot(self, item):
+        """Set transfer running, if the caps of all stagers allow it.
+
+           Running transfers are counted in XRD_Transfers - transfers started
+           earlier take precedence, so concurrent stagers never exceed the caps.
+
+           return True if transfer can be started, otherwise it is queued again
+           """
+
+        item['nAttempts'] += 1
+        item['started']    = time.time()
+        self._setState(item, 'running')
+
+        queryBefore = {'state': 'running', 'started': {'$gt': item['started'] - TRANSFER_STALE_TIME},
+                       '$or': [{'started': {'$lt': item['started']}},
+                               {'started': item['started'], '_id': {'$lt': item['_id']}}]}
+
+        if self._collTransfers.find(dict(queryBefore, nodeName=item['nodeName'])).count() < self._nPerNode and \
+           self._collTransfers.find(queryBefore).count() < self._nWorkers:
+            return True
+
+        item['nAttempts'] -= 1
+        self._setState(item, 'queued')
+
+        return False
+
+    # _________________________________________________________
+    def _copy(self, item):
+        """Copy file to data server.
+
+           return error message or None
+           """
+
+        destination = 'root://{0}:{1}/{2}'.format(item['nodeName'], XRD_PORT, item['destination'])
+
+        try:
+            p = subprocess.Popen(['xrdcp', '-f', '-s', '--posc', item['source'], destination],
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = p.communicate()[0]
+        except OSError as e:
+            return str(e)
+
+        if p.returncode != 0:
+            return output.decode("utf-8").strip() or 'xrdcp exit code {0}'.format(p.returncode)
+
+        return None
+
+    # _________________________________________________________
+    def _makeStateDoc(self, item, state, error = '', upsert = False):
+        """Make document of transfer state - with the transfer itself for upsert."""
+
+        doc = {'state': state, 'nAttempts': item['nAttempts'], 'error': error,
+               'updated': datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')}
+
+        if state == 'running':
+            doc['started'] = item['started']
+
+        if upsert:
+            doc.update({'target': item['target'], 'filePath': item['filePath'], 'nodeName': item['nodeName']})
+
+        return doc
+
+    # _________________________________________________________
+    def _setState(self, item, state, error = ''):
+        """Set transfer state in mongoDB."""
+
+        self._collTransfers.update_one({'_id': item['_id']}, {'$set': self._makeStateDoc(item, state, error)})
+
+# ____________________________________________________________________________
+def statFile(nodeName, destination):
+    """Get size of file on data server.
+
+       return size or None if file does not exist
+       """
+
+    try:
+        p = subprocess.Popen(['xrdfs', 'root://{0}:{1}'.format(nodeName, XRD_PORT), 'stat', destination],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0]
+    except OSError:
+        return None
+
+    if p.returncode != 0:
+        return None
+
+    for line in output.decode("utf-8").splitlines():
+        lineTokenized = line.split()
+        if len(lineTokenized) == 2 and lineTokenized[0] == 'Size:':
+            return int(lineTokenized[1])
+
+    return None
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Parallel walker of the XRootD namespace on a data server
+
+The namespace consists of links pointing to the files on the data
+partitions (DISK_LIST). Directories are read with scandir by a pool of
+threads, so that the metadata I/O on the different partitions overlaps.
+
+The file type is taken from the directory entry, only one stat (following
+the link) is needed per file. The partition is found from the device of
+this stat, the link is only read if the device is unknown or shared by
+several partitions (e.g. bind mounts).
+
+For every file a tuple (fullPath, fileSize, disk) is returned, fileSize
+is -1 for broken links. An unexpected error in a worker stops the walk
+and is raised by walk().
+"""
+
+import sys
+import os
+import queue
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+DISK_PREFIX = '/export'
+DISK_LIST   = ['data', 'data1', 'data2', 'data3', 'data4']
+
+N_WALK_THREADS   = 2 * len(DISK_LIST)
+N_PENDING_BLOCKS = 1000
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class xrdWalker:
+    """Walk XRootD namespace with a pool of threads."""
+
+    # _________________________________________________________
+    def __init__(self, nThreads = N_WALK_THREADS):
+        self._nThreads = nThreads
+
+        # -- Map device -> disk of data partitions - only devices of a single partition
+        disksByDevice = {}
+        for disk in DISK_LIST:
+            try:
+                disksByDevice.setdefault(os.stat(os.path.join(DISK_PREFIX, disk)).st_dev, []).append(disk)
+            except OSError:
+                pass
+
+        self._diskByDevice = dict((device, listDisks[0]) for device, listDisks in disksByDevice.items()
+                                  if len(listDisks) == 1)
+
+    # _________________________________________________________
+    def walk(self, listFolders, onDir = None):
+        """Walk folders - onDir is called with every directory before it is read.
+
+           yields (fullPath, fileSize, disk) for every file
+           """
+
+        self._onDir = onDir
+
+        self._dirs    = queue.Queue()
+        self._results = queue.Queue(maxsize=N_PENDING_BLOCKS)
+        self._aborted = False
+
+        # -- Number of directories queued or being read
+        self._nPending = len(listFolders)
+        self._lock     = threading.Lock()
+
+        if not listFolders:
+            return
+
+        for folder in listFolders:
+            self._dirs.put(folder)
+
+        for idx in range(self._nThreads):
+            threading.Thread(target=self._work, daemon=True).start()
+
+        # -- Collect files of all directories until all workers are done
+        error    = None
+        nRunning = self._nThreads
+        while nRunning:
+            block = self._results.get()
+            if block is None:
+                nRunning -= 1
+                continue
+
+            # -- Error in worker - stop walk, raise after all workers are done
+            if isinstance(block, Exception):
+                self._aborted = True
+                error = error or block
+                continue
+
+            if not error:
+                for entry in block:
+                    yield entry
+
+        if error:
+            raise error
+
+    # _________________________________________________________
+    def _work(self):
+        """Worker - read directories until all are done.
+
+           Errors are handed to walk(), the pending count and the end of
+           the worker are always reported.
+           """
+
+        try:
+            while True:
+                path = self._dirs.get()
+                if path is None:
+                    break
+
+                try:
+                    if not self._aborted:
+                        self._results.put(self._readDir(path))
+                except Exception as e:
+                    self._results.put(e)
+
+                finally:
+                    with self._lock:
+                        self._nPending -= 1
+                        if self._nPending == 0:
+                            for idx in range(self._nThreads):
+                                self._dirs.put(None)
+        finally:
+            self._results.put(None)
+
+    # _________________________________________________________
+    def _readDir(self, path):
+        """Read one directory - queue subdirectories.
+
+           return list of files
+           """
+
+        block = []
+
+        if self._onDir:
+            self._onDir(path)
+
+        try:
+            entries = list(scandir(path))
+        except OSError as e:
+            print('Error reading', path, e)
+            return block
+
+        for entry in entries:
+            # -- Directories - file type from directory entry, no stat
+            try:
+                isDir = entry.is_dir(follow_symlinks=False)
+            except OSError as e:
+                print('Error reading', entry.path, e)
+                continue
+
+            if isDir:
+                with self._lock:
+                    self._nPending += 1
+                self._dirs.put(entry.path)
+                continue
+
+            # -- Files - size and disk from stat of link target
+            try:
+                fstat = entry.stat()
+            except OSError:
+                block.append((entry.path, -1, ''))
+                continue
+
+            try:
+                isLink = entry.is_symlink()
+            except OSError:
+                isLink = True
+
+            block.append((entry.path, fstat.st_size, self._getDisk(entry.path, fstat, isLink)))
+
+        return block
+
+    # _________________________________________________________
+    def getFileInfo(self, path):
+        """Get info of single file.
+
+           return (fullPath, fileSize, disk) - fileSize is -1 for broken links
+           """
+
+        try:
+            fstat = os.stat(path)
+        except OSError:
+            return path, -1, ''
+
+        return path, fstat.st_size, self._getDisk(path, fstat, os.path.islink(path))
+
+    # _________________________________________________________
+    def _getDisk(self, path, fstat, isLink):
+        """Get disk of file from device - read link only if device is unknown or shared."""
+
+        disk = self._diskByDevice.get(fstat.st_dev)
+        if disk is not None:
+            return disk
+
+        if not isLink:
+            return ''
+
+        try:
+            target = os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
+        except OSError:
+            return ''
+
+        for disk in DISK_LIST:
+            if target.startswith(os.path.join(DISK_PREFIX, disk) + '/'):
+                return disk
+
+        return ''
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+b'This script requires python 3.4'
+
+"""
+Watch the XRootD namespace on a data server with Linux inotify
+
+All directories below the watched folders get an inotify watch, new
+directories are added when they are created or moved in.
+
+Events are returned as (fullPath, created, isDir):
+ - created True  : link created, moved in or file closed after writing -
+                   for a directory moved in, one event for every file
+                   in it follows
+ - created False : link deleted or moved out - for a directory, all files
+                   below fullPath are gone
+
+If the kernel event queue overflowed, 'overflowed' is set - events were
+lost and a full rescan is needed. Queued events can be dropped with drain
+before the rescan.
+
+Directories, which could not be watched as the limit of inotify watches
+(fs.inotify.max_user_watches) is reached, are kept in 'unwatched' - they
+have to be rescanned periodically.
+"""
+
+import sys
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+##############################################
+# -- GLOBAL CONSTANTS
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO   = 0x00000080
+IN_CREATE     = 0x00000100
+IN_DELETE     = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED    = 0x00008000
+IN_ONLYDIR    = 0x01000000
+IN_ISDIR      = 0x40000000
+
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE    = 1024 * 1024
+
+##############################################
+
+# -- Check for a proper Python Version
+if sys.version[0:3] < '3.0':
+    print ('Python version 3.0 or greater required (found: {0}).'.format(sys.version[0:5]))
+    sys.exit(-1)
+
+# ----------------------------------------------------------------------------------
+class xrdWatcher:
+    """Watch directory trees for created and deleted files."""
+
+    # _________________________________________________________
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, 'inotify_init: ' + os.strerror(e))
+
+        # -- Watched directories - wd -> path and path -> wd
+        self._paths = {}
+        self._wds   = {}
+
+        self.overflowed = False
+
+        # -- Directories not watched - limit of watches reached
+        self.unwatched = set()
+
+    # _________________________________________________________
+    def addTree(self, path, listFiles = None):
+        """Watch directory and all directories below - files found are added to listFiles."""
+
+        listDirs = [path]
+
+        while listDirs:
+            dirPath = listDirs.pop()
+            if not self._addWatch(dirPath) and dirPath not in self.unwatched:
+                continue
+
+            # -- Read directory after watch is added - no file is lost
+            try:
+                entries = list(scandir(dirPath))
+            except OSError as e:
+                print('Error reading', dirPath, e)
+                continue
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    listDirs.append(entry.path)
+                elif listFiles is not None:
+                    listFiles.append(entry.path)
+
+    # _________________________________________________________
+    def addDir(self, path):
+        """Watch directory - directories below are not added.
+
+           return True if watch was added
+           """
+
+        return self._addWatch(path)
+
+    # _________________________________________________________
+    def removeTree(self, path):
+        """Stop watching directory and all directories below."""
+
+        for dirPath in [dirPath for dirPath in self._wds if dirPath == path or dirPath.startswith(path + '/')]:
+            wd = self._wds.pop(dirPath)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+        self.unwatched = set(dirPath for dirPath in self.unwatched
+                             if dirPath != path and not dirPath.startswith(path + '/'))
+
+    # _________________________________________________________
+    def read(self, timeout):
+        """Wait up to timeout for events.
+
+           return list of (fullPath, created, isDir)
+           """
+
+        listEvents = []
+
+        for wd, mask, name in self._readEvents(timeout):
+            dirPath = self._paths.get(wd)
+            if dirPath is None:
+                continue
+
+            path  = os.path.join(dirPath, os.fsdecode(name))
+            isDir = bool(mask & IN_ISDIR)
+
+            if mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+                listEvents.append((path, True, isDir))
+                if isDir:
+                    listFiles = []
+                    self.addTree(path, listFiles)
+                    listEvents.extend((filePath, True, False) for filePath in listFiles)
+
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                listEvents.append((path, False, isDir))
+                if isDir:
+                    self.removeTree(path)
+
+        return listEvents
+
+    # _________________________________________________________
+    def drain(self):
+        """Drop all queued events - before a full rescan.
+
+           return number of dropped events
+           """
+
+        nEvents = 0
+
+        while select.select([self._fd], [], [], 0)[0]:
+            nEvents += len(list(self._readEvents(0)))
+
+        return nEvents
+
+    # _________________________________________________________
+    def _readEvents(self, timeout):
+        """Wait up to timeout for events - overflows and removed watches are handled here.
+
+           yields (wd, mask, name) of other events
+           """
+
+        readable = select.select([self._fd], [], [], timeout)[0]
+        if not readable:
+            return
+
+        buf = os.read(self._fd, READ_SIZE)
+
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, nameLength = EVENT_HEADER.unpack_from(buf, pos)
+            name = buf[pos+EVENT_HEADER.size:pos+EVENT_HEADER.size+nameLength].rstrip(b'\0')
+            pos += EVENT_HEADER.size + nameLength
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+
+            # -- Watch removed by kernel - directory deleted
+            if mask & IN_IGNORED:
+                dirPath = self._paths.pop(wd, None)
+                if dirPath is not None and self._wds.get(dirPath) == wd:
+                    del self._wds[dirPath]
+                continue
+
+            yield wd, mask, name
+
+    # _________________________________________________________
+    def close(self):
+        """Close inotify instance."""
+
+        os.close(self._fd)
+
+        self._paths.clear()
+        self._wds.clear()
+        self.unwatched.clear()
+
+    # _________________________________________________________
+    def _addWatch(self, path):
+        """Add watch on directory.
+
+           return True if watch was added
+           """
+
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOSPC:
+                if path not in self.unwatched:
+                    print('Error watching', path, '- increase fs.inotify.max_user_watches')
+                self.unwatched.add(path)
+            elif e not in (errno.ENOENT, errno.ENOTDIR):
+                print('Error watching', path, os.strerror(e))
+            return False
+
+        self._paths[wd]  = path
+        self._wds[path] = wd
+        self.unwatched.discard(path)
+
+        return True